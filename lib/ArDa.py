@@ -9,7 +9,7 @@ import pandas as pd
 import numpy as np
 from datetime import date, datetime, timedelta
 import configparser
-from ArDa.myExtensions import docTableModel, projTreeModel, mySortFilterProxy, docTableView
+from ArDa.myExtensions import docTableModel, projTreeModel, mySortFilterProxy, docTableView, importWorker
 from util.my_widgets import QTextEditExt, MyDictionaryCompleter, QLabelElided
 from ArDa.dialog_settings import SettingsDialog
 from ArDa.dialog_project import ProjectDialog
@@ -23,7 +23,6 @@ from ArDa.arda_db_sql import *
 from ArDa.arda_db_obsid import *
 from ArDa.arda_db_bib import *
 import pdb, warnings
-import bibtexparser
 import logging
 import traceback            # This for catching all errors for logging
 from profilehooks import profile
@@ -58,6 +57,10 @@ class ArDa(Ui_MainWindow):
         # Initialize sidepanel buttons (ie connect them, set diabled, etc...)
         self.initSidePanelButtons()
 
+        # Initializing the repeat action for potential duplicates (see askDuplicateAction)
+        self.do_same = False
+        self.do_action = None
+
         # Set other attributes of metadata fields
         self.initMetaDataFields()
 
@@ -95,6 +98,8 @@ class ArDa(Ui_MainWindow):
         self.watch_path = self.config.get("Watch Paths", "path_001")
         self.last_check_watched = self.config.get("Other Variables", "last_check")
         self.all_bib_path = self.config.get("Bib", "all_bib_path")
+        # Libraries with more documents are read a page at a time
+        self.paged_min_docs = self.config.getint("General Properties", "paged_min_docs", fallback=50000)
 
         # Open the associated arda database
         self.adb = ArDa_DB_SQL()
@@ -120,17 +125,19 @@ class ArDa(Ui_MainWindow):
         string_fields = ['Authors', 'Title', 'Journal']
         int_fields = ['ID', 'Year']
         date_fields = []
+        header_to_field = self.adb.get_schema().get_header_to_field("Documents")
 
         # Case statement based on field types
         if search_col == 'All Fields':
-            logging.debug("Still need to implement searching through all fields")
-            return
+            # Using the db's full-text index (words match as prefixes, quotes as phrases)
+            search_ids = self.adb.search_docs(search_text)
         elif search_col in string_fields:
-            self.search_filter_ids = set(self.tm.arraydata[self.tm.arraydata[search_col].str.contains(search_text, regex=False, case=False, na=False)].ID)
+            # (searching the db, so paged models needn't read every row)
+            search_ids = self.adb.search_field_docs(header_to_field[search_col], search_text)
         elif search_col in int_fields:
             try:
                 search_text = int(search_text)
-                self.search_filter_ids = set(self.tm.arraydata[self.tm.arraydata[search_col]==search_text].ID)
+                search_ids = self.adb.search_field_docs(header_to_field[search_col], search_text)
             except ValueError:
                 logging.debug(f"Search value '{search_text}' is not castable to an int.")
                 return
@@ -138,34 +145,16 @@ class ArDa(Ui_MainWindow):
             logging.debug(f"Do not recognize the type for searching on field: {search_col}")
             return
 
-        # Changing the filtered list in the proxy model
-        self.tm.beginResetModel()
-        self.all_filter_ids = self.proj_filter_ids & self.diag_filter_ids & \
-                            self.custom_filter_ids & self.search_filter_ids
-        self.proxyModel.show_list = list(self.all_filter_ids)
-        self.tm.endResetModel()
-
-        # Updating the current filter message
-        msg = f" search ('{search_text}' in {search_col});"
-        # Checking if there was an earlier filter in place
-        start = self.label_CurrentFilter.text().find(' search (')
-        if start != -1:
-            # Replacing old msg with the new
-            end = start + self.label_CurrentFilter.text()[start:].find(";") + 1
-            old_msg = self.label_CurrentFilter.text()[start:end]
-            new_msg = self.label_CurrentFilter.text().replace(old_msg, msg)
-            self.label_CurrentFilter.setText(new_msg)
-        else:
-            self.label_CurrentFilter.setText(self.label_CurrentFilter.text() + msg)
-        self.label_CurrentFilter.show()
-        self.pushButton_ClearFilter.show()
+        # Changing the search filter in the proxy model (and the current filter message)
+        self.proxyModel.setFilterFacet('search', search_ids, f"'{search_text}' in {search_col}")
+        self.updateFilterLabel()
 
         # # The below code is for using the filter proxy's regex
         # # Setting the column to search on
         # self.proxyModel.setFilterKeyColumn(-1) #self.search_col)
         #
         # # Updating the set of ids? (maybe not needed)
-        # # self.search_filter_ids = set(self.tm.arraydata.ID)
+        # # search_ids = set(self.tm.arraydata.ID)
         #
         # # Setting the proxyModel search value
         # self.proxyModel.setFilterRegExp(str(self.lineEdit_Search.text()))
@@ -187,6 +176,7 @@ class ArDa(Ui_MainWindow):
             mult_txt = "all "
 
         # Gathers the read/unread status of each selected document
+        self.tm.loadColumns(['Read'])       # (in case it is read on demand)
         sel_df = self.tm.arraydata[self.tm.arraydata.ID.isin(self.selected_doc_ids)]
         unread = (sel_df['Read'].isnull()) | (sel_df['Read'] == '')
         # Adds "read" option if any are unread
@@ -417,24 +407,22 @@ class ArDa(Ui_MainWindow):
         self.loadMetaData([self.selected_doc_ids[0]])
 
     def addFromPDFFile(self):
-        # This function calls a file browser and adds the selected pdf file
+        # This function calls a file browser and adds the selected pdf file(s)
         
-        # Open a folder dialog to get a selected path
+        # Open a folder dialog to get the selected path(s)
         diag_path_start = self.config['Data Sources']['def_pdfs_path']
-        new_file_path = QtWidgets.QFileDialog.getOpenFileName(self.parent,
+        new_file_paths = QtWidgets.QFileDialog.getOpenFileNames(self.parent,
                                                                 'Open File',
                                                                 diag_path_start)[0]
         # Check if a file was chosen
-        if (new_file_path == None) or (new_file_path == ''):
+        if (new_file_paths == None) or (len(new_file_paths) == 0):
             return
 
-        # Extracting just the filename from the path
-        new_filename = new_file_path[new_file_path.rfind("/")+1:]
-
-        # Creating info for the bib entry and adding it
-        new_bib_dict = {'Title': new_filename}
-        new_bib_dict['full_path'] = new_file_path
-        self.addBibEntry(new_bib_dict, supress_view_update = True)
+        # Creating info for the bib entries (titled by their filenames) and adding them
+        doc_dicts = [{'title': new_file_path[new_file_path.rfind("/")+1:],
+                        'full_path': new_file_path} for new_file_path in new_file_paths]
+        self.startImport(lambda adb, **kwargs: adb.import_doc_dicts(doc_dicts, **kwargs),
+                            "Importing Files")
 
     def addFromBibFile(self):
         # Opens a dialog to open a bib file and imports the bib entries
@@ -449,58 +437,152 @@ class ArDa(Ui_MainWindow):
         if (bib_path == None) or (bib_path == ''):
             return
 
-        with open(bib_path, encoding='utf-8') as bibtex_file:
-            bib_database = bibtexparser.load(bibtex_file, )
+        self.startImport(lambda adb, **kwargs: adb.import_bib_file(bib_path, **kwargs),
+                            "Importing Bib File")
 
-        bib_entries = bib_database.entries_dict
+    def startImport(self, import_func, title, check_duplicates = True):
+        """
+            Runs an import on a background thread (so the app can still be used)
+            while new documents are added to the table as each batch is committed
+
+            :param import_func: function taking the (worker's) ArDa_DB object and the
+                    progress_callback, entry_filter and batch_callback keyword
+                    arguments which runs the import
+            :param title: str of the title of the progress dialog
+            :param check_duplicates: boolean indicating whether to hold back (and
+                    ask about) documents which are potential duplicates
+        """
+        # Only running a single import at a time
+        if getattr(self, 'import_thread', None) is not None:
+            QtWidgets.QMessageBox.information(self.parent, title,
+                        "Please wait for the current import to finish.")
+            return
 
-        # Opening a dialog with a progress bar to track the import
-        num_bibs = len(bib_entries)
+        # Opening a (non-modal) dialog with a progress bar to track the import
         self.progress_dialog = QtWidgets.QProgressDialog("Starting import...",
-                                                        "Cancel", 0, num_bibs)
+                                                        "Cancel", 0, 100)
         self.progress_dialog.setMinimumDuration(0)
-        self.progress_dialog.setModal(True)
-        self.progress_dialog.setWindowTitle("Importing Bib File")
+        self.progress_dialog.setModal(False)
+        self.progress_dialog.setAutoClose(False)
+        self.progress_dialog.setWindowTitle(title)
         self.progress_dialog.setMinimumSize(500, 200)
-        num_processed = 1
-        self.progress_dialog.setValue(num_processed)
-
-        # Initializing the repeat actions
+        self.progress_dialog.setValue(0)
+
+        # Creating the worker and moving it to its own thread
+        self.import_thread = QtCore.QThread()
+        self.import_worker = importWorker(self.db_path, import_func, check_duplicates)
+        self.import_worker.moveToThread(self.import_thread)
+        self.import_thread.started.connect(self.import_worker.run)
+        self.import_worker.progress.connect(self.onImportProgress)
+        self.import_worker.batchAdded.connect(self.onImportBatch)
+        self.import_worker.failed.connect(self.onImportFailed)
+        self.import_worker.finished.connect(self.onImportFinished)
+        # (a direct connection, as the worker's thread is busy running the import)
+        self.progress_dialog.canceled.connect(self.import_worker.cancel, QtCore.Qt.DirectConnection)
+        self.import_thread.start()
+
+    def onImportProgress(self, num_read, amount_done, amount_total):
+        self.progress_dialog.setLabelText(f"Imported {num_read} entries")
+        if amount_total > 0:
+            self.progress_dialog.setValue(int(99*amount_done/amount_total))
+
+    def onImportBatch(self, doc_ids):
+        # The worker wrote through its own db object, so the tables it touched are
+        #   dropped from this thread's caches before reading the new rows
+        self.adb.invalidate_tables(['Documents', 'Doc_Auth', 'Doc_Paths', 'Doc_Proj'])
+        self.addDocsToTM(doc_ids)
+
+    def onImportFailed(self, msg):
+        QtWidgets.QMessageBox.warning(self.parent, "Import Failed",
+                        f"The import stopped because of an error: {msg}")
+
+    def onImportFinished(self, held_docs):
+        # Tearing down the thread and dialog
+        self.import_thread.quit()
+        self.import_thread.wait()
+        self.import_worker.deleteLater()
+        self.import_thread.deleteLater()
+        self.import_thread = None
+        self.import_worker = None
+        self.progress_dialog.close()
+
+        # Asking what to do with each document held back as a possible duplicate
         self.do_same = False
         self.do_action = None
-
-        # Go over dict and import each entry
-        for key, bib_entry in bib_entries.items():
-            # Checking if the user canceled the operation
-            if (self.progress_dialog.wasCanceled()):	break
-            # Setting progress bar label (for user reference)
-            self.progress_dialog.setLabelText(f"Now importing {bib_entry['ID']}"+\
-                                            f" ({num_processed}/{num_bibs})")
-            # Altering a few of the keys (before adding to DB)
-            logging.debug(bib_entry)
-            bib_entry['Citation Key'] = bib_entry.pop('ID')
-            bib_entry['Type'] = bib_entry.pop('ENTRYTYPE')
-            if 'file' in bib_entry:
-                bib_entry['full_path'] = aux.pathCleaner(bib_entry.pop('file'))
-            if 'link' in bib_entry: bib_entry['URL'] = bib_entry.pop('link')
-            # if 'author' in bib_entry: bib_entry['author_lasts'] = bib_entry.pop('author')
-            if 'arxivId' in bib_entry: bib_entry['arxiv_id'] = bib_entry.pop('arxivId')
-            if 'arxivid' in bib_entry: bib_entry['arxiv_id'] = bib_entry.pop('arxivid')
-
-            bib_entry = aux.convertBibEntryKeys(bib_entry, "header", self.field_df)
-            # Adding the bib entry
-            self.addBibEntry(bib_entry, supress_view_update = True,
-                                        force_addition = False)
-            # Updating the progress bar
-            self.progress_dialog.setValue(num_processed)
-            num_processed += 1
-
+        add_docs, comparisons = [], []
+        for doc_dict in held_docs:
+            sim_ids = self.adb.find_duplicate_ids(doc_dict)
+            if len(sim_ids) > 0:
+                self.askDuplicateAction(len(sim_ids), doc_dict.get('title', None))
+                if self.do_action == self.buttonSkip:
+                    continue
+                elif self.do_action == self.buttonComp:
+                    comparisons.append((doc_dict, min(sim_ids)))
+                    continue
+            add_docs.append(doc_dict)
         # Resetting the repeat actions (so they aren't used inadvertently elsewhere)
         self.do_same = False
         self.do_action = None
 
-        # Now we reset the view so that all these new entries are at the top
-        # self.resetAllFilters()
+        # Adding each document to compare and comparing it with its similar document
+        for doc_dict, comp_id in comparisons:
+            added_docs = self.adb.import_doc_dicts([doc_dict])
+            if len(added_docs) == 0:
+                continue
+            self.addDocsToTM([added_docs[0]['doc_id']])
+            self.openCompareDialog(added_docs[0]['doc_id'], comp_id, compare_mode="first new")
+        # Adding the rest (in the background, like the import itself)
+        if len(add_docs) > 0:
+            self.startImport(lambda adb, **kwargs: adb.import_doc_dicts(add_docs, **kwargs),
+                                "Importing Documents", check_duplicates = False)
+
+    def askDuplicateAction(self, num_similar, title = None):
+        """
+            Asks the user whether to add, skip or compare a document found to be similar
+            to existing ones (unless they chose to do the same for all), which sets
+            self.do_action to the button clicked
+
+            :param num_similar: int of the number of similar documents found
+            :param title: str of the title of the document (if known)
+        """
+        # Check if the repeat action was previously selected
+        if self.do_same:
+            return
+        # Issuing pop up if similar documents were found
+        doc_text = "the document" if not title else f'the document "{title}"'
+        msg = f"{num_similar} document(s) were found to be similar " +\
+                f"to {doc_text} that is currently being added. " +\
+                "Would you like to add it anyway, skip it, or compare "+\
+                "with the first document in this list?"
+        msg_diag = QtWidgets.QMessageBox(QtWidgets.QMessageBox.Question,
+                                "Potential Duplicates", msg)
+        # Defining custom buttons
+        self.buttonAdd = QtWidgets.QPushButton("Add")
+        self.buttonSkip = QtWidgets.QPushButton("Skip")
+        self.buttonComp = QtWidgets.QPushButton("Compare")
+        msg_diag.addButton(self.buttonAdd, QtWidgets.QMessageBox.AcceptRole)
+        msg_diag.addButton(self.buttonSkip, QtWidgets.QMessageBox.RejectRole)
+        msg_diag.addButton(self.buttonComp, QtWidgets.QMessageBox.HelpRole)
+        # Adding do same checkbox
+        checkboxDoSame = QtWidgets.QCheckBox("Do the same for remaining duplicates found.")
+        msg_diag.setCheckBox(checkboxDoSame)
+
+        response = msg_diag.exec_()
+        self.do_action = msg_diag.clickedButton()
+        self.do_same = checkboxDoSame.isChecked()
+
+    def addDocsToTM(self, doc_ids):
+        """
+            Adds the (already inserted) documents to the table model in one go
+
+            :param doc_ids: list of ints of the doc IDs to add
+        """
+        if len(doc_ids) == 0:
+            return
+        old_cols = list(self.tm.arraydata.columns)
+        new_docs = self.adb.get_table("Documents", use_header_text=True, where={'doc_id': doc_ids})
+        new_docs = new_docs[[col for col in old_cols if col in new_docs.columns]]
+        self.tm.addRows(new_docs)
 
     def openFileReader(self):
         # This function will open the selected file(s) in a pdf reader (acrobat for now)
@@ -530,7 +612,8 @@ class ArDa(Ui_MainWindow):
             :param filter_field: string indicatin which type of filter to open,
                         eg "author", "journal", or "keyword"
         """
-        self.ui = FilterDialog(self, filter_field, doc_id_subset = self.all_filter_ids)
+        self.ui = FilterDialog(self, filter_field,
+                                doc_id_subset = self.proxyModel.getFilters().get_shown_ids())
         self.ui.setModal(True)
 
         # Open window and respond based on final selection
@@ -540,45 +623,25 @@ class ArDa(Ui_MainWindow):
             if self.filter_field == "Author":
                 doc_auth_df = self.adb.get_table("Doc_Auth")
                 rows_with_selected_authors = doc_auth_df['full_name'].isin(self.filter_choices)
-                self.diag_filter_ids = doc_auth_df[rows_with_selected_authors]['doc_id'].tolist()
+                diag_ids = doc_auth_df[rows_with_selected_authors]['doc_id'].tolist()
             elif self.filter_field == "Journal":
                 doc_df = self.adb.get_table("Documents")
                 rows_with_selected_journals = doc_df['journal'].isin(self.filter_choices)
-                self.diag_filter_ids = doc_df[rows_with_selected_journals]['doc_id'].tolist()
+                diag_ids = doc_df[rows_with_selected_journals]['doc_id'].tolist()
             elif self.filter_field == "Keyword":
                 doc_df = self.adb.get_table("Documents")
                 # Check for each keyword
                 doc_df['row_has_keyword'] = False
                 for keyword in self.filter_choices:
                     doc_df['row_has_keyword'] = doc_df['row_has_keyword'] | doc_df['keyword'].str.contains(keyword)
-                self.diag_filter_ids = doc_df[doc_df['row_has_keyword']]['doc_id'].tolist()
+                diag_ids = doc_df[doc_df['row_has_keyword']]['doc_id'].tolist()
             else:
                 warnings.warn(f"Filter field ({self.filter_field}) not recognized.")
                 return
-            # Changing to set (for aggregate filtering)
-            self.diag_filter_ids = set(self.diag_filter_ids)
-            
-            # Changing the filtered list in the proxy model
-            self.tm.beginResetModel()
-            self.all_filter_ids = self.proj_filter_ids & self.diag_filter_ids & \
-                                self.custom_filter_ids & self.search_filter_ids
-            self.proxyModel.show_list = list(self.all_filter_ids)
-            self.tm.endResetModel()
-
-            # Updating the current filter message
-            msg = f" filter ({str(self.filter_choices)} in {self.filter_field});"
-            # Checking if there was an earlier filter in place
-            start = self.label_CurrentFilter.text().find(' filter (')
-            if start != -1:
-                # Replacing old msg with the new
-                end = start + self.label_CurrentFilter.text()[start:].find(";") + 1
-                old_msg = self.label_CurrentFilter.text()[start:end]
-                new_msg = self.label_CurrentFilter.text().replace(old_msg, msg)
-                self.label_CurrentFilter.setText(new_msg)
-            else:
-                self.label_CurrentFilter.setText(self.label_CurrentFilter.text() + msg)
-            self.label_CurrentFilter.show()
-            self.pushButton_ClearFilter.show()
+            # Changing the dialog filter in the proxy model (and the current filter message)
+            self.proxyModel.setFilterFacet('filter', set(diag_ids),
+                                            f"{str(self.filter_choices)} in {self.filter_field}")
+            self.updateFilterLabel()
         else:				# User selects cancel
             logging.debug("Filter window canceled.")
 
@@ -670,7 +733,9 @@ class ArDa(Ui_MainWindow):
         if self.s_diag.exec_():
             # If the custom filters were changed then reload the combobox
             if self.s_diag.custom_filters_changed:
-                self.buildFilterComboBoxes()
+                self.buildFilterComboBoxes(connect_signals = False)
+                self.proxyModel.setFilterFacet('custom', None)
+                self.updateFilterLabel()
             # If the DB was changed then reload adb and app contents
             if self.s_diag.db_path_changed:
                 msg = "The DB file has been changed, however ArDa must be " + \
@@ -694,16 +759,9 @@ class ArDa(Ui_MainWindow):
         #	down menu and distills filters to those docs in the table view
         curr_choice = self.comboBox_Filter_Project.currentText().lstrip()
         if curr_choice == 'All projects':
-            self.tm.beginResetModel()
-            self.proj_filter_ids = set(self.tm.arraydata.ID)
-            self.all_filter_ids = self.proj_filter_ids & self.diag_filter_ids & \
-                                self.custom_filter_ids & self.search_filter_ids
-            self.proxyModel.show_list = list(self.all_filter_ids)
-            self.tm.endResetModel()
+            self.proxyModel.setFilterFacet('project', None)
             # Clear any selection in the project tree view
             self.treeView_Projects.selectionModel().clearSelection()
-            # Setting message for no projects filtered
-            msg = ""
         else:
             # Get the project id associated with menu choice
             self.selected_proj_id = self.comboBox_Project_IDs[\
@@ -712,29 +770,12 @@ class ArDa(Ui_MainWindow):
             # Grabbing the cascade setting
             cascade = (self.config["General Properties"]["project_selection_cascade"] == "True")
             # Selecting all doc IDs that are in this project (and children if cascading)
-            self.proj_filter_ids = set(self.adb.get_projs_docs(proj_ids, cascade))
-
-            # Changing the filtered list in the proxy model
-            self.tm.beginResetModel()
-            self.all_filter_ids = self.proj_filter_ids & self.diag_filter_ids & \
-                                self.custom_filter_ids & self.search_filter_ids
-            self.proxyModel.show_list = list(self.all_filter_ids)
-            self.tm.endResetModel()
-
-            # Updating the current filter message
-            msg = f" project (ID = {str(self.selected_proj_id)});"
-        # Checking if there was an earlier project filter in place
-        start = self.label_CurrentFilter.text().find(' project (ID')
-        if start != -1:
-            # Replacing old msg with the new
-            end = start + self.label_CurrentFilter.text()[start:].find(";") + 1
-            old_msg = self.label_CurrentFilter.text()[start:end]
-            new_msg = self.label_CurrentFilter.text().replace(old_msg, msg)
-            self.label_CurrentFilter.setText(new_msg)
-        else:
-            self.label_CurrentFilter.setText(self.label_CurrentFilter.text() + msg)
-        self.label_CurrentFilter.show()
-        self.pushButton_ClearFilter.show()
+            proj_doc_ids = self.adb.get_projs_docs(proj_ids, cascade)
+
+            # Changing the project filter in the proxy model
+            self.proxyModel.setFilterFacet('project', proj_doc_ids, f"ID = {str(self.selected_proj_id)}")
+        # Updating the current filter message
+        self.updateFilterLabel()
 
         # Now we select the corresponding row in the project tree view
         # FIXME: Fix sync btw project combobox and project tree view (currently this selects only the cell not the row)
@@ -744,6 +785,23 @@ class ArDa(Ui_MainWindow):
 
         # self.proxyModel.setFilterKeyColumn(self.search_col)
 
+    def customFilterEngaged(self):
+        # This function applies the custom filter chosen in the filter drop down menu
+        filter_ind = self.comboBox_Filter.currentIndex()
+        if filter_ind == -1:
+            return
+        filter_id = self.comboBox_Filter_IDs[filter_ind]
+        cascade = (self.config["General Properties"]["project_selection_cascade"] == "True")
+        try:
+            filter_ids = self.adb.get_custom_filter_docs(filter_id, cascade)
+        except ValueError as e:
+            QtWidgets.QMessageBox.warning(self.parent, "Custom Filter",
+                        f"The filter '{self.comboBox_Filter.currentText()}' could not be applied: {e}")
+            filter_ids = None
+        # Changing the custom filter in the proxy model (an empty filter keeps everything)
+        self.proxyModel.setFilterFacet('custom', filter_ids, self.comboBox_Filter.currentText())
+        self.updateFilterLabel()
+
     def rowSelectChanged(self):
         # Undoing previous document selection
         self.selected_doc_ids = -1
@@ -896,7 +954,7 @@ class ArDa(Ui_MainWindow):
 
         # Recompiling any relevant QCompleter objects
         if field == "journal":
-            journals = sorted(self.tm.arraydata['Journal'].dropna().unique())
+            journals = sorted(self.adb.get_table("Documents", columns=['journal'])['journal'].dropna().unique())
             self.completer_journal.setModel(QtCore.QStringListModel(journals))
         if field == "author_lasts":
             author_df = self.adb.get_table(table_name='Doc_Auth')
@@ -947,18 +1005,13 @@ class ArDa(Ui_MainWindow):
         """ Wrapper function for writing all project bib files """
         # Checking if project cascade is set to be on and passing to internal function
         cascade = (self.config["General Properties"]["project_selection_cascade"] == "True")
-        self.adb.write_all_proj_bib_files(self.all_bib_path, cascade = cascade)
+        self.adb.write_all_proj_bib_files(self.all_bib_path, cascade = cascade, max_workers = None)
 
 ####end
 ##### Auxiliary Functions #######################################################
     def updateDocViewCell(self, doc_id, col_name, new_value):
-        # Updating the table model (and emitting a changed signal)
-        self.tm.arraydata.loc[self.tm.arraydata.ID==doc_id,
-                                                    col_name] = new_value
-        cell_row = self.tm.getRowOfDocID(doc_id)
-        cell_col = list(self.tm.headerdata).index(col_name)
-        cell_index = self.tm.index(cell_row, cell_col)
-        self.tm.dataChanged.emit(cell_index, cell_index)
+        # Updating the table model (which emits a changed signal)
+        self.tm.setDocValues(doc_id, {col_name: new_value})
     
     def updateDocViewRow(self, doc_id):
         # Updates (from the DB) all the cells in the indicated row
@@ -967,29 +1020,20 @@ class ArDa(Ui_MainWindow):
         doc_dict = self.adb.get_doc_record(doc_id)
         doc_dict = self.adb.standardize_doc_dict_keys(doc_dict, "Documents", header_or_field="header")
         logging.debug(f"Doc_dict: {doc_dict}")
-        columns = list(self.tm.headerdata)
-        cell_row = self.tm.getRowOfDocID(doc_id)
-        # Iterate over each column in table model and update the cell
-        for cell_col in range(len(columns)):
-            header_text = columns[cell_col]
-            if header_text in doc_dict:
-                self.tm.arraydata.loc[self.tm.arraydata.ID==doc_id,
-                                                    header_text] = doc_dict[header_text]
-                cell_index = self.tm.index(cell_row, cell_col)
-                self.tm.dataChanged.emit(cell_index, cell_index)
-
-    def addBibEntry(self, bib_dict = None, supress_view_update = False,
-                    force_addition = True, select_new_row = True):
+        # Updating each cell of the row in the table model
+        self.tm.setDocValues(doc_id, {header_text: doc_dict[header_text] for header_text
+                                        in self.tm.headerdata if header_text in doc_dict})
+
+    def addBibEntry(self, bib_dict = None, supress_view_update = False, select_new_row = True):
         """
             This function adds a new bib entry to the dataframe and table model
+            (imports check for duplicates, see onImportFinished)
 
             :param bib_dict: dictionary of information included in this entry.
                 Could include keys such as 'Title', 'ID', 'Authors',
                 'file_path', ....
             :param suppress_view_update: boolean indicating whether to skip
                 updating the table view (useful when multiple insertions )
-            :param force_addition: boolean indicating whether to force the
-                addition of this entry (without checking/prompting for duplicates)
         """
         # Setting some defaults (if no bib dict was passed)
         if bib_dict is None: bib_dict = dict()
@@ -1002,45 +1046,6 @@ class ArDa(Ui_MainWindow):
         else:
             logging.debug(f"Adding a new bib record with doc id {bib_dict['ID']} with the following info:\n{bib_dict}")
 
-        # If it is not set to force the addition, check for duplicate entries
-        if not force_addition:
-            sim_ids = self.findDuplicates(bib_dict = {'Title':bib_dict.get('Title', 'New Title')})
-            # If there are duplicates and repeat action was not selected
-            if (len(sim_ids) > 0):
-                # Check if the repeat action was previously selected
-                if not self.do_same:
-                    # TODO: Fully implement duplicate query when importing via bib file
-                    # Issuing pop up if similar documents were found
-                    msg = f"{len(sim_ids)} document(s) were found to be similar " +\
-                            "to the document that is currently being added. " +\
-                            "Would you like to add it anyway, skip it, or compare "+\
-                            "with the first document in this list?"
-                    msg_diag = QtWidgets.QMessageBox(QtWidgets.QMessageBox.Question,
-                                            "Potential Duplicates", msg)#,
-                                            # QtWidgets.QMessageBox.Ok |
-                                            # QtWidgets.QMessageBox.Cancel)
-                    # Defining custom buttons
-                    self.buttonAdd = QtWidgets.QPushButton("Add")
-                    self.buttonSkip = QtWidgets.QPushButton("Skip")
-                    self.buttonComp = QtWidgets.QPushButton("Compare")
-                    msg_diag.addButton(self.buttonAdd, QtWidgets.QMessageBox.AcceptRole)
-                    msg_diag.addButton(self.buttonSkip, QtWidgets.QMessageBox.RejectRole)
-                    msg_diag.addButton(self.buttonComp, QtWidgets.QMessageBox.HelpRole)
-                    # Adding do same checkbox
-                    checkboxDoSame = QtWidgets.QCheckBox("Do the same for remaining duplicates found.")
-                    msg_diag.setCheckBox(checkboxDoSame)
-
-                    response = msg_diag.exec_()
-                    self.do_action = msg_diag.clickedButton()
-                    self.do_same = checkboxDoSame.isChecked()
-
-                # Handling the dialog responses (or repeating the last action)
-                if self.do_action == self.buttonAdd:
-                    logging.debug("Add anyway selected.")
-                elif self.do_action == self.buttonSkip:
-                    # Exit function without adding any entry
-                    return
-        
         # Add the bib entry into the main underlying documents table (this also handles authors)
         self.adb.add_table_record(bib_dict, "Documents")
 
@@ -1048,30 +1053,8 @@ class ArDa(Ui_MainWindow):
         if 'full_path' in bib_dict:
             self.adb.add_table_record(bib_dict, "Doc_Paths")
 
-        # Counting rows and columns to check insertion went correctly
-        old_row_ct = self.tm.arraydata.shape[0]
-        old_cols = set(self.tm.arraydata.columns)
-        # Getting the info just inserted (and converting/filtering to header keys)
-        tm_doc_dict = self.adb.standardize_doc_dict_keys(
-                                self.adb.get_doc_record(bib_dict['ID']), 
-                                "Documents", header_or_field="header")
-        tm_doc_dict = {key:value for key, value in tm_doc_dict.items() if key in old_cols}
-        # Adding the entry to the the class dataframe and the model data
-        self.tm.beginInsertRows(QtCore.QModelIndex(),
-                                self.tm.rowCount(self), self.tm.rowCount(self))
-        self.tm.arraydata = self.tm.arraydata.append(tm_doc_dict, ignore_index=True)
-        self.tm.endInsertRows()
-        # Verifying insertion did nothing wierd (one more row and same columns)
-        if (old_row_ct+1 != self.tm.arraydata.shape[0]) or (len(old_cols) != len(self.tm.arraydata.columns)):
-            warn_msg = f"extra columns = {set(self.tm.arraydata.columns)-old_cols}"
-            warn_msg = warn_msg + f", extra rows = {self.tm.arraydata.shape[0] - old_row_ct+1}."
-            warnings.warn("Insertion did something funky, "+warn_msg)
-
-        # Now comparing the entries (if there were duplicates and that was selected)
-        if (not force_addition) and (len(sim_ids)>0) and (self.do_action == self.buttonComp):
-            comp_id = sim_ids.pop()
-            self.openCompareDialog(bib_dict['ID'], comp_id, compare_mode="first new")
-            # TODO: Need to respond to choice in compare dialog
+        # Adding the entry to the table model
+        self.addDocsToTM([bib_dict['ID']])
 
         if not supress_view_update:
             # Resetting all the filters to make sure new row is visible
@@ -1091,13 +1074,7 @@ class ArDa(Ui_MainWindow):
         """
         # Update the table model (if directed to)
         if update_table_model:
-            tm_row_id = self.tm.getRowOfDocID(doc_id)
-            tm_ind = self.tm.createIndex(tm_row_id, 0)
-            # pdb.set_trace()
-            # tm_ind = self.proxyModel.mapFromSource(tm_ind) # This will get the row in the proxy model (then change tm to proxyModel)
-            self.tm.beginRemoveRows(tm_ind.parent(), tm_ind.row(), tm_ind.row())
-            self.tm.arraydata.drop(tm_row_id, axis=0, inplace=True)
-            self.tm.endRemoveRows()
+            self.tm.dropRows([self.tm.getRowOfDocID(doc_id)])
 
     def resetAllFilters(self, sort_added = False):
         '''
@@ -1112,37 +1089,32 @@ class ArDa(Ui_MainWindow):
         self.treeView_Projects.blockSignals(True)
         self.treeView_Projects.selectionModel().clearSelection()
         self.treeView_Projects.blockSignals(False)
-        self.proj_filter_ids = set(self.tm.arraydata.ID)
 
         # Resetting the custom filter combo box
         self.comboBox_Filter.blockSignals(True)
         self.comboBox_Filter.setCurrentIndex(0)
-        self.comboBox_Filter.blockSignals(True)
-        self.custom_filter_ids = set(self.tm.arraydata.ID)
+        self.comboBox_Filter.blockSignals(False)
 
         # Resetting the search box
         self.lineEdit_Search.setText("")
-        self.search_filter_ids = set(self.tm.arraydata.ID)
 
-        # Resets the filter dialog (and all ids)
-        self.diag_filter_ids = set(self.tm.arraydata.ID)
-        self.all_filter_ids = set(self.tm.arraydata.ID)
+        # Updating the proxy model to reflect showing everything (clearing all filters)
+        self.proxyModel.clearFilters()
 
-        # Updating the proxy model to reflect showing everything
-        # self.tm.beginResetModel()
-        self.proxyModel.show_list = list(self.tm.arraydata.ID)
-        # self.tm.endResetModel()
-        self.proxyModel.invalidateFilter() # Alternative to beginResetModel/endResetModel (and seems faster)
-
-        # Resets the sorting as well (by date added) !! VERY SLOW STEP !!
+        # Resets the sorting as well (by date added)
         if sort_added:
             self.proxyModel.sort(list(self.tm.headerdata).index("Added"),
                                                 order = QtCore.Qt.DescendingOrder)
 
         # Hides the filter msg label and button as well
-        self.label_CurrentFilter.hide()
-        self.pushButton_ClearFilter.hide()
-        self.label_CurrentFilter.setText("Current subset:")
+        self.updateFilterLabel()
+
+    def updateFilterLabel(self):
+        # Sets the current filter message from the filters (hiding it if there are none)
+        filters = self.proxyModel.getFilters()
+        self.label_CurrentFilter.setText(filters.get_label_text())
+        self.label_CurrentFilter.setVisible(filters.is_filtered())
+        self.pushButton_ClearFilter.setVisible(filters.is_filtered())
 
     def loadMetaData(self, doc_ids):
         # This function will load the meta data for the passed id into the fields
@@ -1164,7 +1136,7 @@ class ArDa(Ui_MainWindow):
                                         'first_name':[''], 'last_name':['Multiple Selected']})
         else: # Otherwise we assume a single ID was passed in a list
             # Extract the info for the doc_id passed
-            doc_row = self.tm.arraydata[self.tm.arraydata.ID == int(doc_ids[0])].iloc[0]
+            doc_row = self.tm.getDocRow(int(doc_ids[0]))
             # Converting any None of NaN values to empty strings
             doc_row[doc_row.isnull()] = ""
 
@@ -1247,7 +1219,7 @@ class ArDa(Ui_MainWindow):
         doc_proj = self.adb.get_table('Doc_Proj_Ext')
         proj_names = doc_proj[doc_proj['doc_id'].isin(doc_ids)]['proj_text'].tolist()
         proj_ids = doc_proj[doc_proj['doc_id'].isin(doc_ids)]['proj_id'].tolist()
-        proj_names = [self.project_tree_model.projectPath(proj_id, ignore_x_parents = 1) for proj_id in proj_ids]
+        proj_names = [self.getProjectLabel(proj_id) for proj_id in proj_ids]
         self.lineEdit_Projects.setText(', '.join(proj_names))
 
         # Setting project specific note combobox
@@ -1257,9 +1229,15 @@ class ArDa(Ui_MainWindow):
         self.comboBox_ProjNotes.clear()
         self.comboBox_ProjNotes.blockSignals(False)
         self.comboBox_ProjNotes_IDs = doc_proj[doc_proj['doc_id'].isin(doc_ids)]['proj_id'].tolist()
-        proj_paths = [self.project_tree_model.projectPath(proj_id, ignore_x_parents = 1) for proj_id in self.comboBox_ProjNotes_IDs]
+        proj_paths = [self.getProjectLabel(proj_id) for proj_id in self.comboBox_ProjNotes_IDs]
         self.comboBox_ProjNotes.addItems(proj_paths)
 
+    def getProjectLabel(self, proj_id):
+        # Returns the project's path (from the db's cached project paths) without its
+        #   top level parent (top level projects keep their own name)
+        return self.adb.get_proj_full_path(proj_id, ignore_x_parents = 1) or \
+                    self.adb.get_proj_full_path(proj_id)
+
     def loadProjectNote(self):
         # This function loads the relevant project note (if there is one)
 
@@ -1300,20 +1278,21 @@ class ArDa(Ui_MainWindow):
                 to check against.
         """
         sim_ids = set()
+        # (documents are compared in the db, so paged models needn't read every row)
+        header_to_field = self.adb.get_schema().get_header_to_field("Documents")
         # Checking if doc_id or bib_dict was passed
         if doc_id != None:
             if compare_fields == None:
                 logging.debug("Must specify fields to compare along with document id.")
 
-            # Extracting the row index for the passed doc_id
-            row_ind = self.tm.arraydata[self.tm.arraydata['ID']==doc_id].index[0]
+            # Extracting the row for the passed doc_id
+            doc_row = self.adb.get_table("Documents", use_header_text=True, where={'doc_id': doc_id}).iloc[0]
             # Checking if bib_dict was also erroneously passed
             if bib_dict != None:
                 warnings.warn('Bibdict is being overwritten. Should not pass" +\
                                 "all three arguments to findDuplicates.')
             # Creating dictionary of values of each field for given doc id
-            bib_dict = {field: self.tm.arraydata.at[row_ind,field] for field \
-                        in compare_fields if field in self.tm.arraydata.columns}
+            bib_dict = {field: doc_row[field] for field in compare_fields if field in doc_row.index}
         elif bib_dict == None:
             warnings.warn('Insufficient arguments passed to findDuplicates.')
             return
@@ -1327,8 +1306,11 @@ class ArDa(Ui_MainWindow):
             # 	continue
             # # Get value of the field for the doc_id
             # field_val = self.tm.arraydata.at[row_ind,field]
-            # Get doc_ids of those with same value
-            new_ids = set(self.tm.arraydata[self.tm.arraydata[field]==field_val]['ID'])
+            # Get doc_ids of those with same value (empty values match nothing)
+            if aux.sqlValue(field_val) is None:
+                continue
+            new_ids = set(self.adb.get_table("Documents", columns=['doc_id'],
+                                where={header_to_field.get(field, field): field_val})['doc_id'])
             # Merge in the newly found IDs
             sim_ids = sim_ids | new_ids
 
@@ -1338,6 +1320,31 @@ class ArDa(Ui_MainWindow):
             logging.debug(f"Primary: {doc_id}, Similar: {sim_ids}")
         return sim_ids
 
+    def checkForDuplicates(self):
+        """
+            This function searches the whole library for clusters of near-duplicate
+            documents and opens a comparison dialog for each pair so the user can
+            merge them (documents merged in a cluster are compared to the merged one)
+        """
+        clusters = self.adb.find_duplicate_clusters()
+        if len(clusters) == 0:
+            QtWidgets.QMessageBox.information(self.parent, "Check for Duplicates",
+                                                "No potential duplicates were found.")
+            return
+        msg = f"{len(clusters)} groups of potential duplicates were found "+\
+                f"({sum([len(doc_ids) for doc_ids, _ in clusters])} documents). "+\
+                "Would you like to compare them now?"
+        response = QtWidgets.QMessageBox.question(self.parent, "Check for Duplicates", msg)
+        if response != QtWidgets.QMessageBox.Yes:	return
+
+        for doc_ids, score in clusters:
+            logging.debug(f"Comparing potential duplicates {doc_ids} (similarity {score:.2f})")
+            base_id = doc_ids[0]
+            for other_id in doc_ids[1:]:
+                if self.openCompareDialog(base_id, other_id, compare_mode="both old"):
+                    # Comparing the rest of the cluster with the merged document
+                    base_id = self.c_diag.doc_id_dict['doc_id']
+
     def updateBackups(self):
         # This function updates backups as dictated by the current settings
 
@@ -1504,21 +1511,27 @@ class ArDa(Ui_MainWindow):
     def initDocumentViewer(self):
         # Initialize the various aspects of the table view that holds the documents
 
-        # Getting document data and field info
-        alldocs = self.adb.get_table("Documents", use_header_text=True)
-        self.field_df = self.adb.get_table("Fields")
-        doc_field_df = self.field_df[self.field_df['table_name']=="Documents"].copy()
+        # Getting field info
+        schema = self.adb.get_schema()
+        self.field_df = schema.get_field_df()
+        doc_field_df = schema.get_field_df("Documents")
 
         # Sorting data fields by what's specified (hidden columns go to end)
-        doc_field_df.loc[doc_field_df.doc_table_order==-1,'doc_table_order'] = 1000
-        default_col_order = doc_field_df.sort_values('doc_table_order')['header_text']
-        alldocs = alldocs[default_col_order.tolist()].copy()
-        # Sorting the actual data on the added date
-        alldocs.sort_values('Added', ascending = False, inplace = True)
-
-        # Putting documents in Table View
-        header = alldocs.columns
-        self.tm = docTableModel(alldocs, header, parent=self) #, self)
+        default_col_order, hidden_cols = schema.get_display_order("Documents")
+        header = pd.Index(default_col_order)
+
+        # Putting documents in Table View (large libraries are read a page at a time,
+        #   in the order of the added date, with the hidden columns read on demand)
+        num_docs = self.adb.get_table("Documents", columns=['doc_id']).shape[0]
+        if num_docs > self.paged_min_docs:
+            self.tm = docTableModel(pd.DataFrame(columns=header), header, parent=self, schema=schema)
+            self.tm.startPaging(self.adb, 'Added', descending=True, lazy_headers=hidden_cols)
+        else:
+            alldocs = self.adb.get_table("Documents", use_header_text=True)
+            alldocs = alldocs[default_col_order].copy()
+            # Sorting the actual data on the added date
+            alldocs.sort_values('Added', ascending = False, inplace = True)
+            self.tm = docTableModel(alldocs, header, parent=self, schema=schema) #, self)
 
         # Creating the table view and adding to app
         self.tableView_Docs = docTableView(self.gridLayoutWidget) #QtWidgets.QTableView(self.gridLayoutWidget)
@@ -1670,7 +1683,7 @@ class ArDa(Ui_MainWindow):
         self.parent.setTabOrder(self.textEditExt_Keywords, self.lineEdit_Projects)
 
         # Adding a QCompleter to the journals field
-        journals = sorted(self.tm.arraydata['Journal'].dropna().unique())
+        journals = sorted(self.adb.get_table("Documents", columns=['journal'])['journal'].dropna().unique())
         self.completer_journal = QtWidgets.QCompleter(journals)
         self.completer_journal.setFilterMode(QtCore.Qt.MatchContains)
         self.completer_journal.setCaseSensitivity(QtCore.Qt.CaseInsensitive)
@@ -1693,7 +1706,7 @@ class ArDa(Ui_MainWindow):
 
         # Clearing and inserting the doc type items
         self.comboBox_DocType.clear()
-        doc_types = list(self.tm.arraydata['Type'].dropna().unique())
+        doc_types = list(self.adb.get_table("Documents", columns=['doc_type'])['doc_type'].dropna().unique())
         doc_types.sort(key=str.lower)
         doc_types.append('undefined')
         self.comboBox_DocType.addItems(doc_types)
@@ -1760,6 +1773,7 @@ class ArDa(Ui_MainWindow):
         # This function will attach all the menu choices to their relavant response
         self.action_Exit.triggered.connect(self.parent.close)
         self.actionCheck_for_New_Docs.triggered.connect(self.checkWatchedFolders)
+        self.actionCheck_for_Duplicates.triggered.connect(self.checkForDuplicates)
         self.actionOpen_Selected_in_Acrobat.triggered.connect(self.openFileReader)
         self.actionPDF_File.triggered.connect(self.addFromPDFFile)
         self.actionBib_File.triggered.connect(self.addFromBibFile)
@@ -1808,26 +1822,23 @@ class ArDa(Ui_MainWindow):
         if connect_signals:
             self.comboBox_Filter_Project.currentIndexChanged.connect(self.projectFilterEngaged)
 
-        # Initializing the filter id set
-        self.proj_filter_ids = set(self.tm.arraydata.ID)
-
-    def buildFilterComboBoxes(self):
+    def buildFilterComboBoxes(self, connect_signals = True):
         # This function will initialize the filter combo box with the filters
         #		found in the DB table "Custom_Filters"
 
         # Grab the custom filters and sort by the filter ID
         filters = self.adb.get_table("Custom_Filters")
         filters.sort_values('filter_id', inplace=True)
-        # Adding text to combo box (after clearing out items)
+        # Adding text to combo box (after clearing out items) and the ids in the same order
+        self.comboBox_Filter_IDs = list(filters["filter_id"])
+        self.comboBox_Filter.blockSignals(True)
         self.comboBox_Filter.clear()
         self.comboBox_Filter.addItems(list(filters["filter_name"]))
+        self.comboBox_Filter.blockSignals(False)
 
         # Connecting combo box to action
-        #self.comboBox_Filter_Project.currentIndexChanged.connect(self.FilterEngaged)
-        #logging.debug(self.folders)
-
-        # Initializing the filter id set
-        self.custom_filter_ids = set(self.tm.arraydata.ID)
+        if connect_signals:
+            self.comboBox_Filter.currentIndexChanged.connect(self.customFilterEngaged)
 
     def buildColumnComboBoxes(self):
         # This function will initialize the search field combo box
@@ -1839,13 +1850,6 @@ class ArDa(Ui_MainWindow):
     def initSearchBox(self):
         # This function initializes everything asociated with the search box
 
-        # Initializing the filter id set
-        self.search_filter_ids = set(self.tm.arraydata.ID)
-
-        # Also initializing the dialog id set (since nowhere else makes sense)
-        self.diag_filter_ids = set(self.tm.arraydata.ID)
-        self.all_filter_ids = set(self.tm.arraydata.ID)
-
         # Connecting search box to action
         self.lineEdit_Search.returnPressed.connect(self.SearchEngaged)
 
@@ -1,15 +1,33 @@
 # This define a class which allows for interacting with an ArDa database object
 
 import pandas as pd
+import numpy as np
 from os.path import exists, isfile, join
 from os import makedirs, listdir, path
 from datetime import date, datetime
-import warnings, logging
+import warnings, logging, time, hashlib, os, io, shutil
+from concurrent.futures import ThreadPoolExecutor
+try:
+    from ArDa.arda_schema import ArDa_Schema
+except ModuleNotFoundError:
+    from lib.ArDa.arda_schema import ArDa_Schema
+try:
+    import ArDa.aux_functions as aux
+except ModuleNotFoundError:
+    import lib.ArDa.aux_functions as aux
+try:
+    import ArDa.arda_dedup as dedup
+except ModuleNotFoundError:
+    import lib.ArDa.arda_dedup as dedup
 
 class ArDa_DB:
 
+    # Derived tables (built from other tables) that must follow changes to their sources
+    CACHE_DEPENDENTS = {'Doc_Proj': ['Doc_Proj_Ext'], 'Projects': ['Doc_Proj_Ext']}
+
     def __init__(self):
         self.db = None
+        self.init_table_cache()
 
     def make_new_db(self, db_path):
         raise NotImplementedError
@@ -19,12 +37,189 @@ class ArDa_DB:
         if (not exists(db_path)):
             raise FileNotFoundError
         self.db_path = db_path
+        self.init_table_cache()
+
+    ## Table Cache Functions #######################################
+    ################################################################
+
+    def init_table_cache(self):
+        """ (Re)sets the cache of tables (along with its hit/miss counters and schema) """
+        self.table_cache = {}
+        self.cache_stats = {'hits': 0, 'misses': 0}
+        self.schema = None
+        # Rendered bib entries, doc_id: (modified_date, fields included, entry text)
+        self.bib_entry_cache = {}
+        # Digests of the bib files written, filename: (sha1 digest, mtime, size)
+        self.bib_file_digests = {}
+
+    def get_cached_table(self, table_name, copy = True):
+        """
+            Returns a copy of the cached table (so callers are free to modify it)
+            or None if the table is not currently cached
+
+            :param table_name: string of the table name
+            :param copy: boolean indicating whether to copy the table (only pass
+                    False when the table will not be modified, eg see filter_table)
+        """
+        if table_name in self.table_cache:
+            self.cache_stats['hits'] += 1
+            return self.table_cache[table_name].copy() if copy else self.table_cache[table_name]
+        self.cache_stats['misses'] += 1
+        return None
+
+    def set_cached_table(self, table_name, table_df):
+        """ Stores the passed (freshly extracted) table in the cache """
+        self.table_cache[table_name] = table_df.copy()
+
+    def invalidate_tables(self, table_names = None):
+        """
+            Drops the passed table(s) (and any tables derived from them) from the cache
+
+            :param table_names: string or list of table names (None drops every table)
+        """
+        if table_names is None:
+            self.table_cache = {}
+            self.schema = None
+            return
+        if not isinstance(table_names, list):
+            table_names = [table_names]
+        # The schema is built from the Fields table so it must be rebuilt as well
+        if 'Fields' in table_names:
+            self.schema = None
+        for table_name in table_names:
+            self.table_cache.pop(table_name, None)
+            for dep_table in self.CACHE_DEPENDENTS.get(table_name, []):
+                self.table_cache.pop(dep_table, None)
+
+    def get_schema(self):
+        """ Returns the schema registry of the db (building it the first time it's needed) """
+        if self.schema is None:
+            self.schema = self.load_schema()
+        return self.schema
+
+    def load_schema(self):
+        """ Builds the schema registry (from Fields.csv, back-ends may use their own field info) """
+        return ArDa_Schema(pd.read_csv(path.join(path.dirname(__file__), "Fields.csv")))
+
+    def get_cache_stats(self):
+        """ Returns a dictionary with the cache hits, misses and tables cached """
+        return {**self.cache_stats, 'tables': list(self.table_cache.keys())}
+
+    def patch_cached_table(self, table_name, cond_dict, column_name, new_value):
+        """
+            Applies an update (of a single column) to the cached table in place,
+            falling back to invalidating it if the update can't be mirrored exactly.
+
+            :param table_name: string of the table that was updated
+            :param cond_dict: dictionary of field/value pairs of the rows updated
+            :param column_name: string of the column updated
+            :param new_value: the value (as stored in the db) of the updated cells
+        """
+        # Derived tables are simply rebuilt
+        for dep_table in self.CACHE_DEPENDENTS.get(table_name, []):
+            self.table_cache.pop(dep_table, None)
+        if table_name not in self.table_cache:
+            return
+        table_df = self.table_cache[table_name]
+        if (column_name not in table_df.columns) or \
+                any([key not in table_df.columns for key in cond_dict]):
+            self.invalidate_tables(table_name)
+            return
+        row_mask = self.get_cond_mask(table_df, cond_dict)
+        old_dtype = table_df[column_name].dtype
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                table_df.loc[row_mask, column_name] = new_value
+        except (ValueError, TypeError):
+            self.invalidate_tables(table_name)
+            return
+        # A change in the column type means the cached table no longer matches the db
+        if table_df[column_name].dtype != old_dtype:
+            self.invalidate_tables(table_name)
+
+    def drop_cached_rows(self, table_name, cond_dict):
+        """
+            Removes the rows matching cond_dict from the cached table (and any
+            tables derived from it), invalidating those where that isn't possible
+
+            :param table_name: string of the table rows were deleted from
+            :param cond_dict: dictionary of field/value pairs of the rows deleted
+        """
+        for cache_table in [table_name] + self.CACHE_DEPENDENTS.get(table_name, []):
+            if cache_table not in self.table_cache:
+                continue
+            table_df = self.table_cache[cache_table]
+            if any([key not in table_df.columns for key in cond_dict]):
+                self.table_cache.pop(cache_table)
+                continue
+            self.table_cache[cache_table] = table_df[~self.get_cond_mask(table_df, cond_dict)]
+
+    def get_cond_mask(self, table_df, cond_dict):
+        """
+            Returns a boolean series of the rows in table_df matching all of cond_dict
+
+            :param table_df: DataFrame of the table
+            :param cond_dict: dictionary whose keys are columns and whose values are
+                    either a single value (or None) to match or a list of values to match any of
+        """
+        row_mask = pd.Series(True, index=table_df.index)
+        for key, value in cond_dict.items():
+            if isinstance(value, (list, tuple, set, np.ndarray, pd.Series)):
+                row_mask &= table_df[key].isin(list(value))
+            elif value is None:
+                row_mask &= table_df[key].isna()
+            else:
+                row_mask &= (table_df[key] == value)
+        return row_mask
+
+    def filter_table(self, table_df, columns = None, where = None, order_by = None):
+        """
+            Applies the columns, where and order_by arguments of get_table to a full
+            table. The table itself is left untouched (eg the cached table) and only
+            the rows and columns selected are copied.
+        """
+        if isinstance(order_by, str): order_by = [order_by]
+        order_cols = [] if order_by is None else [order_col.split()[0] for order_col in order_by]
+        if (where is not None) and (len(where) > 0):
+            row_mask = self.get_cond_mask(table_df, where).to_numpy()
+        else:
+            row_mask = slice(None)
+        # (the sort columns are kept until the rows are sorted)
+        if columns is not None:
+            columns = list(columns)
+            table_df = table_df.loc[row_mask, columns + [col for col in dict.fromkeys(order_cols)
+                                                        if col not in columns]]
+        else:
+            table_df = table_df.loc[row_mask]
+        if order_by is not None:
+            ascending = [not order_col.upper().endswith(" DESC") for order_col in order_by]
+            # Sorting by one column at a time (stable sorts from the last column to the
+            #   first) so each puts its nulls first when ascending (like sqlite does)
+            for order_col, asc in reversed(list(zip(order_cols, ascending))):
+                table_df = table_df.sort_values(order_col, ascending=asc, kind='stable',
+                                                na_position="first" if asc else "last")
+        if columns is not None:
+            table_df = table_df[columns]
+        if isinstance(row_mask, slice) and (order_by is None):
+            table_df = table_df.copy()      # (selecting just columns may give a view)
+        return table_df.reset_index(drop=True)
 
     ## Status/Attribute Extraction Functions #######################
     ################################################################
 
-    def get_table(self, table_name='Documents'):
-        """ Extracts and returns the specified table """
+    def get_table(self, table_name='Documents', columns = None, where = None, order_by = None):
+        """
+            Extracts and returns the specified table (or just part of it)
+
+            :param table_name: string of the table name
+            :param columns: list of str of the columns to return (None returns all)
+            :param where: dictionary whose keys are columns and whose values are
+                    either a single value (or None) to match or a list of values to
+                    match any of (eg {'doc_id': [1, 2], 'contribution': "Author"})
+            :param order_by: str or list of str of columns (optionally followed by
+                    " DESC") to sort the rows by
+        """
         # Checking that a valid table name has been sent
         if table_name not in ['Documents', 'Fields', 'Projects', 'Doc_Auth', 'Doc_Proj_Ext',
                                 'Doc_Proj', 'Doc_Paths', 'Proj_Notes', 'Custom_Filters']:
@@ -35,18 +230,24 @@ class ArDa_DB:
             warnings.warn(f"Cannot grab the {table_name} table because no db is loaded.")
         # The rest of this function is implemented in the subclass
 
+    def get_sorted_doc_ids(self, field, descending = False, numeric = False):
+        raise NotImplementedError
+
     def get_doc_record(self, doc_id):
         raise NotImplementedError
 
     def get_next_id(self, id_type):
         raise NotImplementedError
 
+    def reserve_ids(self, id_type, num_ids, min_id = 1):
+        raise NotImplementedError
+
     def get_proj_full_path(self, proj_id, ignore_x_parents = 0, path_delim = "/"):
         """ This extracts the full path of the indicated project  and lops off
             the top x parents specified.
         """
         # Grab all the projects (and reset index for ease)
-        all_projs = self.get_table("Projects")
+        all_projs = self.get_table("Projects", columns=['proj_id', 'proj_text', 'parent_id'])
         all_projs.set_index('proj_id', inplace=True)
         # Iterate up the tree until hitting the root
         curr_proj_id = proj_id
@@ -78,11 +279,19 @@ class ArDa_DB:
             proj_ids = list(set(all_proj_ids))
 
         # Return list of all documents associated with any of these projects
-        all_docs = self.get_table("Doc_Proj")
-        proj_docs = all_docs[all_docs.proj_id.isin(proj_ids)].doc_id.values.tolist()
+        proj_docs = self.get_table("Doc_Proj", columns=['doc_id'],
+                                    where={'proj_id': proj_ids}).doc_id.values.tolist()
         proj_docs = list(set(proj_docs))  # Removing duplicates
         return proj_docs
 
+    def get_all_projs_docs(self, cascade = False):
+        """
+            Returns a dictionary mapping every project id to the list of its document
+            ids (including those of all its descendant projects if cascade specified)
+        """
+        proj_ids = self.get_table("Projects", columns=['proj_id']).proj_id.tolist()
+        return {proj_id: self.get_projs_docs(proj_id, cascade=cascade) for proj_id in proj_ids}
+
     def get_proj_children(self, proj_id, include_x_children = 1, proj_table = None):
         """ Returns the proj_ids of all children projects (and their childrens
             children etc) down to the level specified.
@@ -99,7 +308,7 @@ class ArDa_DB:
         
         if proj_table is None:
             # Grab the table once and pass to future recursive calls
-            proj_table = self.get_table("Projects")
+            proj_table = self.get_table("Projects", columns=['proj_id', 'parent_id'])
         
         # Gather the ids of any proj who is a child of the indicated project
         proj_children = proj_table[proj_table.parent_id == proj_id].proj_id.values.tolist()
@@ -128,7 +337,7 @@ class ArDa_DB:
         """
         # Some initialization such as grabbing the project dataframe if not passed
         if project_df is None:
-            project_df = self.get_table("Projects")
+            project_df = self.get_table("Projects", columns=['proj_id', 'proj_text', 'parent_id'])
         proj_text_list, proj_id_list = [], []
 
         # Select only the children of the current parent
@@ -154,7 +363,7 @@ class ArDa_DB:
 
     def get_proj_folder_path(self, proj_id):
         """ Return the project's folder path or None is not specified """
-        proj_df = self.get_table("Projects")
+        proj_df = self.get_table("Projects", columns=['proj_id', 'path'], where={'proj_id': proj_id})
         proj_df.fillna("", inplace=True)
         proj_df.set_index('proj_id', drop=False, inplace=True)
         if proj_id not in proj_df.index:
@@ -202,25 +411,15 @@ class ArDa_DB:
             else:
                 doc_dict["doc_id"] = self.get_next_id("Documents")
 
-            # Adding some default values if nothing is found
-            doc_dict['title'] = doc_dict.get("title", "New Title")
-            # doc_dict['Authors'] = doc_dict.get("Authors", "Author Last, Author First")
-            # doc_dict['doc_type'] = doc_dict.get("doc_type", "Article")
-            # doc_dict['year'] = doc_dict.get("year", None)
-            td = date.today()
-            doc_dict['add_date'] = doc_dict.get('add_date', td.year*10000 + td.month*100 + td.day)
-            
-            # Altering keyword delimiters if need be
-            if "keyword" in doc_dict:
-                if (doc_dict['keyword'].find(";")==-1) and (doc_dict['keyword'].find(",")!=-1):
-                    doc_dict['keyword'] = doc_dict['keyword'].replace(",", ";")
+            # Adding some default values (and tweaking others)
+            doc_dict = self.set_doc_defaults(doc_dict)
         elif table_name == 'Projects':
             # Check if proj_id is included and grab new one if not
             if "proj_id" in doc_dict:
                 # Check that the doc_id is not used by another record
-                projs = self.get_table("Projects")
-                used_proj_ids = projs.proj_id.values.tolist()
-                if (doc_dict["proj_id"] in used_proj_ids):
+                projs = self.get_table("Projects", columns=['proj_id'],
+                                        where={'proj_id': doc_dict["proj_id"]})
+                if projs.shape[0] > 0:
                     logging.debug(f"Cannot add a project with id {doc_dict['proj_id']} because it already exists in db")
                     raise FileExistsError
             else:
@@ -246,6 +445,133 @@ class ArDa_DB:
         # The rest of this function is implemented in the subclass
         return doc_dict
 
+    def add_table_records(self, doc_dicts, table_name = "Documents"):
+        raise NotImplementedError
+
+    def import_bib_file(self, bib_path, batch_size = 500, progress_callback = None,
+                            entry_filter = None, batch_callback = None):
+        """
+            Imports the entries of a bib file into the Documents table (along with
+            their authors and file paths). Entries are streamed from the file and
+            added in batches (each committed at once) so memory stays bounded.
+
+            :param bib_path: str of the path of the bib file
+            :param progress_callback: function called after each batch with the number
+                    of entries read, the bytes read and the total bytes of the file.
+                    If it returns False the import stops (after that batch).
+            (see import_doc_dicts for the other parameters)
+
+            Returns: list of the document dictionaries added (including their doc_id)
+        """
+        total_bytes = path.getsize(bib_path)
+        with open(bib_path, 'rb') as raw_file:
+            bib_file = io.TextIOWrapper(raw_file, encoding='utf-8')
+            doc_dicts = (self.bib_entry_to_doc_dict(bib_entry)
+                            for bib_entry in aux.iterBibEntries(bib_file))
+            added_docs = self.import_doc_dicts(doc_dicts, batch_size, progress_callback,
+                                entry_filter, batch_callback,
+                                progress_amounts = lambda: (raw_file.tell(), total_bytes))
+        logging.debug(f"Imported {len(added_docs)} documents from {bib_path}.")
+        return added_docs
+
+    def import_doc_dicts(self, doc_dicts, batch_size = 500, progress_callback = None,
+                            entry_filter = None, batch_callback = None, progress_amounts = None):
+        """
+            Adds (an iterable of) documents to the Documents table in batches, each
+            committed at once (see add_table_records).
+
+            :param doc_dicts: iterable of field keyed document dictionaries
+            :param batch_size: int of the number of documents added per commit
+            :param progress_callback: function called after each batch with the number
+                    of documents read, the amount done and the total amount (by
+                    default the documents read and the number of documents, if known).
+                    If it returns False the import stops (after that batch).
+            :param entry_filter: function called with each document dictionary
+                    returning whether the document should be added
+            :param batch_callback: function called with the list of document
+                    dictionaries added by each batch (once committed)
+            :param progress_amounts: function returning the amount done and the
+                    total amount reported to progress_callback
+
+            Returns: list of the document dictionaries added (including their doc_id)
+        """
+        if progress_amounts is None:
+            num_total = len(doc_dicts) if hasattr(doc_dicts, '__len__') else 0
+            progress_amounts = lambda: (num_read, num_total)
+        added_docs = []
+        batch = []
+        num_read = 0
+
+        def add_batch():
+            batch_added = [doc for doc in self.add_table_records(batch) if doc is not None]
+            if batch_callback is not None:
+                batch_callback(batch_added)
+            return batch_added
+
+        for doc_dict in doc_dicts:
+            num_read += 1
+            if (entry_filter is None) or entry_filter(doc_dict):
+                batch.append(doc_dict)
+            if len(batch) >= batch_size:
+                added_docs += add_batch()
+                batch = []
+                if (progress_callback is not None) and \
+                        (progress_callback(num_read, *progress_amounts()) is False):
+                    logging.debug(f"Import stopped after {num_read} documents.")
+                    return added_docs
+        if len(batch) > 0:
+            added_docs += add_batch()
+        if progress_callback is not None:
+            progress_callback(num_read, *progress_amounts())
+        return added_docs
+
+    def release_conn(self):
+        """ Releases any db connection held by the calling (worker) thread """
+        pass
+
+    def bib_entry_to_doc_dict(self, bib_entry):
+        """
+            Maps an entry parsed from a bib file (see aux.iterBibEntries) onto a field
+            keyed document dictionary (dropping any keys the Documents table lacks)
+
+            :param bib_entry: dictionary with 'ID', 'ENTRYTYPE' and lowercase field keys
+        """
+        schema = self.get_schema()
+        header_map = schema.get_header_to_field("Documents", lower=True)
+        doc_fields = set(schema.get_fields("Documents")) | {'author', 'editor', 'full_path'}
+        # Keys of common bib exports which differ from our fields
+        bib_key_map = {'id': 'citation_key', 'entrytype': 'doc_type', 'link': 'url',
+                        'arxivid': 'arxiv_id', 'file': 'full_path'}
+
+        doc_dict = {}
+        for key, value in bib_entry.items():
+            key = key.lower()
+            field = bib_key_map.get(key, header_map.get(key, key))
+            if field in doc_fields:
+                doc_dict[field] = value
+        if doc_dict.get('full_path', "") != "":
+            doc_dict['full_path'] = aux.pathCleaner(doc_dict['full_path'])
+        return doc_dict
+
+    def set_doc_defaults(self, doc_dict):
+        """ Fills in default values (and tidies some fields) of a new document record
+
+            :param doc_dict: (dict) standardized document record (field keys)
+        """
+        # Adding some default values if nothing is found
+        doc_dict['title'] = doc_dict.get("title", "New Title")
+        # doc_dict['Authors'] = doc_dict.get("Authors", "Author Last, Author First")
+        # doc_dict['doc_type'] = doc_dict.get("doc_type", "Article")
+        # doc_dict['year'] = doc_dict.get("year", None)
+        td = date.today()
+        doc_dict['add_date'] = doc_dict.get('add_date', td.year*10000 + td.month*100 + td.day)
+        
+        # Altering keyword delimiters if need be
+        if "keyword" in doc_dict:
+            if (doc_dict['keyword'].find(";")==-1) and (doc_dict['keyword'].find(",")!=-1):
+                doc_dict['keyword'] = doc_dict['keyword'].replace(",", ";")
+        return doc_dict
+
     def delete_doc_record(self, doc_id):
         raise NotImplementedError
 
@@ -260,12 +586,12 @@ class ArDa_DB:
             :param action" str either "add" or "remove" indicating the action to perform
         """
         # Check that the doc_id and proj_id refer to actual objects
-        all_doc_ids = self.get_table("Documents")['doc_id'].values.tolist()
-        all_proj_ids = self.get_table("Projects")['proj_id'].values.tolist()
-        if doc_id not in all_doc_ids:
+        doc_found = self.get_table("Documents", columns=['doc_id'], where={'doc_id': doc_id}).shape[0] > 0
+        proj_found = self.get_table("Projects", columns=['proj_id'], where={'proj_id': proj_id}).shape[0] > 0
+        if not doc_found:
             warnings.warn(f"Cannot add/rem doc {doc_id} to/from project {proj_id} because doc_id doesn't exist")
             return
-        if proj_id not in all_proj_ids:
+        if not proj_found:
             warnings.warn(f"Cannot add/rem doc {doc_id} to/from project {proj_id} because proj_id doesn't exist")
             return
 
@@ -324,33 +650,32 @@ class ArDa_DB:
             :param header_or_field: (str) indicates whether to make them header text 
                 keys ("header") or field keys ("field")
         """
-        # Get the fields table for creating appropriate keys
-        field_df = pd.read_csv("lib//ArDa/Fields.csv")
-        doc_fields = field_df[field_df.table_name==table_name]
+        # Get the field info (of the associated table) for creating appropriate keys
+        schema = self.get_schema()
 
         if header_or_field == "field":
             # First make all keys lowercase
             doc_dict = {key.lower():value for key, value in doc_dict.items()}
 
-            # Create map between header names and field names (of the associated table)
-            header_map = dict(zip(doc_fields.header_text.str.lower(), doc_fields.field))
+            # Map between header names and field names (of the associated table)
+            header_map = schema.get_header_to_field(table_name, lower=True)
 
             # Map all the keys using this dictionary
             doc_dict = {header_map.get(key, key):value for key, value in doc_dict.items()}
 
             # Check that the keys of the dictionary are all recognized
-            recognizable_fields = set(header_map.keys()) | set(doc_fields.field) | {'author'}
+            recognizable_fields = set(header_map.keys()) | set(schema.get_fields(table_name)) | {'author'}
             unrecognized_fields = set(doc_dict.keys()) - recognizable_fields
             recognized_fields = set(doc_dict.keys()) & recognizable_fields
         elif header_or_field == "header":
-            # Create map between field names and header names (of the associated table)
-            field_map = dict(zip(doc_fields.field, doc_fields.header_text))
+            # Map between field names and header names (of the associated table)
+            field_map = schema.get_field_to_header(table_name)
 
             # Map all the keys using this dictionary
             doc_dict = {field_map.get(key, key):value for key, value in doc_dict.items()}
 
             # Check that the keys of the dictionary are all recognized
-            recognizable_fields = set(field_map.keys()) | set(doc_fields.header_text)
+            recognizable_fields = set(field_map.keys()) | set(field_map.values())
             unrecognized_fields = set(doc_dict.keys()) - recognizable_fields
             recognized_fields = set(doc_dict.keys()) & recognizable_fields
         else:
@@ -363,6 +688,41 @@ class ArDa_DB:
 
         return doc_dict
 
+    def get_dup_keys(self, doc_dict):
+        """
+            Returns the duplicate keys (see aux.getDupKeys) of the document passed
+
+            :param doc_dict: dictionary (with field keys) of the document, whose
+                    'author' value (if any) gives its first author
+        """
+        authors = self.format_authors(doc_dict['author']) if doc_dict.get('author', None) else []
+        return aux.getDupKeys(doc_dict, authors[0]['last_name'] if len(authors) > 0 else None)
+
+    def find_duplicate_ids(self, doc_dict, exclude_doc_ids = None):
+        raise NotImplementedError
+
+    def search_docs(self, search_text):
+        raise NotImplementedError
+
+    def search_field_docs(self, field, search_value):
+        raise NotImplementedError
+
+    def get_custom_filter_docs(self, filter_id, cascade = False):
+        raise NotImplementedError
+
+    def find_duplicate_clusters(self, threshold = 0.5):
+        """
+            Returns clusters of near-duplicate documents across the whole library
+            (see dedup.findDuplicateClusters), ie a list of (list of doc ids, float
+            of the lowest similarity linking them) tuples sorted by descending similarity
+
+            :param threshold: float of the minimum estimated similarity of two documents
+        """
+        docs = self.get_table("Documents", columns=['doc_id', 'title', 'author_lasts', 'year'])
+        return dedup.findDuplicateClusters(docs['doc_id'].tolist(), docs['title'].tolist(),
+                                            docs['author_lasts'].tolist(), docs['year'].tolist(),
+                                            threshold = threshold)
+
     def format_authors(self, authors):
         """
             This function formats the author text into a list of dicts of author details
@@ -422,7 +782,8 @@ class ArDa_DB:
             :param exclude_doc_ids: (list of int) doc_ids to exclude from comparison
             Returns: True if it is unique and False if another doc uses it
         '''
-        doc_df = self.get_table("Documents")
+        doc_df = self.get_table("Documents", columns=['doc_id', 'citation_key'],
+                                where={'citation_key': cite_key})
         if include_doc_ids is None:   # Look at all documents
             docs_to_compare = ~doc_df['doc_id'].isin(exclude_doc_ids)
         else:						  # Just look at docs specified in include_doc_ids
@@ -441,72 +802,194 @@ class ArDa_DB:
             :param filename: string of the name of the file (including the path)
             :param fields_included: list of str indicating which fields to include
         """
+        # Rendering (or pulling from the cache) the entry of each document
+        bib_entries = self.get_bib_entries(doc_ids, fields_included)
+        self.write_bib_text(filename, self.join_bib_entries(doc_ids, bib_entries))
+
+    def join_bib_entries(self, doc_ids, bib_entries):
+        """
+            Returns the (utf8 encoded) contents of a bib file made of rendered entries
+
+            :param doc_ids: list of ints indicating which doc IDs to include (in order)
+            :param bib_entries: dictionary of doc ID to the text of its bib entry
+        """
+        return "".join([bib_entries[doc_id] for doc_id in doc_ids
+                            if doc_id in bib_entries]).encode('utf8')
+
+    def write_bib_text(self, filename, bib_bytes):
+        """
+            Writes the contents of a bib file unless the file already holds exactly
+            those contents (so programs watching the file aren't triggered needlessly).
+            Writes go through a temporary file which is then renamed over the target
+            so the file is never seen half written. This is safe to run from worker
+            threads (as long as each thread writes different files).
+
+            :param filename: string of the name of the file (including the path)
+            :param bib_bytes: bytes of the file contents
+
+            Returns: boolean indicating whether the file was (re)written
+        """
+        digest = hashlib.sha1(bib_bytes).hexdigest()
+        # Checking whether the file already has these contents (using the stored
+        #   digest if the file is as we left it and hashing the file otherwise)
+        try:
+            file_stat = os.stat(filename)
+            stored = self.bib_file_digests.get(filename, None)
+            if (stored is not None) and (stored[1:] == (file_stat.st_mtime_ns, file_stat.st_size)):
+                file_digest = stored[0]
+            else:
+                with open(filename, 'rb') as f:
+                    file_digest = hashlib.sha1(f.read()).hexdigest()
+            if file_digest == digest:
+                self.bib_file_digests[filename] = (digest, file_stat.st_mtime_ns, file_stat.st_size)
+                logging.debug(f"Bibfile, {filename}, unchanged so not rewritten.")
+                return False
+        except OSError:
+            pass # ie the file doesn't exist (yet) or can't be read, so we just write it
+
+        # Writing to a temporary file (in the same folder as the file, following any
+        #   symlink so the link itself is kept) and swapping it in
+        target = os.path.realpath(filename)
+        tmp_path = join(os.path.dirname(target), f".arda_{os.urandom(8).hex()}.tmp")
+        try:
+            # (created with the default permissions, ie the os applies the umask)
+            tmp_fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0o666)
+        except OSError:
+            logging.debug(f"Unable to open/find '{filename}' for writing the bib file.")
+            return False
+        try:
+            with os.fdopen(tmp_fd, 'wb') as tmp_file:
+                tmp_file.write(bib_bytes)
+            # Keeping the permissions of a file being rewritten
+            if exists(target):
+                shutil.copymode(target, tmp_path)
+            os.replace(tmp_path, target)
+        except OSError as e:
+            logging.debug(f"Unable to write the bib file '{filename}': {e}")
+            if exists(tmp_path): os.remove(tmp_path)
+            return False
+        file_stat = os.stat(filename)
+        self.bib_file_digests[filename] = (digest, file_stat.st_mtime_ns, file_stat.st_size)
+        logging.debug(f"Bibfile, {filename}, successfully written.")
+        return True
+
+    def get_bib_entries(self, doc_ids, fields_included = None):
+        """
+            Returns a dictionary mapping the doc IDs passed to the text of their bib
+            entries. Entries are cached by document so only those documents modified
+            since they were last rendered (or never rendered) are rendered again.
+
+            :param doc_ids: list of ints indicating which doc IDs to include
+            :param fields_included: list of str indicating which fields to include
+        """
         # Default fields to include
         if fields_included == None:
             fields_included = ['title', 'year', 'journal', 'pages', 'number',
                                 'chapter', 'city', 'edition', 'institution',
                                 'publisher', 'series', 'volume', 'editor', 'author',
                                 'booktitle']
+        fields_key = tuple(fields_included)
 
-        # Grabbing relevant tables and setting index for ease
-        author_db = self.get_table("Doc_Auth")
-        doc_df = self.get_table("Documents")
-        doc_df.set_index('doc_id', inplace=True)
-
-        # Opening file writing stream
-        try:
-            f = open(filename, 'wb')
-        except FileNotFoundError:
-            logging.debug(f"Unable to open/find '{filename}' for writing the bib file.")
-            return
-
+        # Finding the documents whose cached entries are missing or out of date
+        mod_df = self.get_table("Documents", columns=['doc_id', 'modified_date'],
+                                where={'doc_id': doc_ids})
+        mod_dates = {doc_id: (None if pd.isna(mod_date) else mod_date)
+                        for doc_id, mod_date in zip(mod_df.doc_id, mod_df.modified_date)}
+        bib_entries = {}
+        stale_ids = []
         for doc_id in doc_ids:
-            # Gather the bib info associated with the doc ID (or skipping if not found)
-            try:
-                bib_info = doc_df.loc[doc_id].copy()
-            except KeyError:
+            if doc_id not in mod_dates:
                 logging.debug(f"WARNING: No bib record found for doc ID {doc_id}, skipping.")
                 continue
+            cached = self.bib_entry_cache.get(doc_id, None)
+            if (cached is not None) and (cached[0] == mod_dates[doc_id]) and (cached[1] == fields_key):
+                bib_entries[doc_id] = cached[2]
+            else:
+                stale_ids.append(doc_id)
+        if len(stale_ids) == 0:
+            return bib_entries
 
-            # Verify that the document type and key are present
-            if ('doc_type' not in bib_info) | (bib_info['doc_type'] in [None, ""]):
-                logging.debug(f"Document type not found in bib info for doc ID {doc_id}. Using 'article'.")
-                bib_info['doc_type']="article"
-            if ('citation_key' not in bib_info) | (bib_info['citation_key'] in [None, ""]):
-                cite_key = f"doc_{str(doc_id).zfill(6)}"
-                logging.debug(f"Citation key blank or not found for doc ID {doc_id}. Using {cite_key}.")
-                bib_info['citation_key'] = cite_key
-
-            # Print the header for the entry
-            line = f"@{bib_info['doc_type']}{{{bib_info['citation_key']},\n"
-            f.write(line.encode('utf8'))
-
-            # Some field specific formatting
-            if ("year" in bib_info):
-                if bib_info['year'] is None:
-                    bib_info['year'] = ""
-                elif not isinstance(bib_info['year'], str):
-                    bib_info['year'] = str(int(bib_info['year']))
-            if ("author" in fields_included):
-                auth_rows = author_db.contribution == "Author" # Ignoring editors
-                author_list = author_db[auth_rows & (author_db.doc_id == doc_id)].full_name.to_list()
-                bib_info['author'] = " and ".join(author_list)
-            if (bib_info.get("editor", None) is not None):
-                bib_info['editor'] = bib_info['editor'].replace(";", " and")
-
-            # Iterate over all the fields and print any that are found
-            for field in fields_included:
-                if (field in bib_info) and (bib_info[field] != None) and (bib_info[field] != ""):
-                    line = f'\t{field.ljust(12)} = {{{bib_info[field]}}},\n'
-                    # TODO: Implement better way to handle special characters
-                    line = line.replace("&", "\&")
-                    f.write(line.encode('utf8'))
-
-            f.write("}\n".encode('utf8'))
-        f.close()
-        logging.debug(f"Bibfile, {filename}, successfully written.")
+        # Grabbing relevant tables (for just the stale documents)
+        author_db = self.get_table("Doc_Auth", columns=['doc_id', 'full_name'],
+                                    where={'doc_id': stale_ids, 'contribution': "Author"})
+        doc_df = self.get_table("Documents", where={'doc_id': stale_ids})
 
-    def write_all_proj_bib_files(self, bib_folder, force_regen = False, cascade = False):
+        # Joining each document's authors (in their stored order) in a single pass
+        author_strs = {}
+        for doc_id, full_name in zip(author_db.doc_id, author_db.full_name.fillna("")):
+            author_strs.setdefault(doc_id, []).append(full_name)
+        author_strs = {doc_id: " and ".join(names) for doc_id, names in author_strs.items()}
+
+        # Rendering from plain rows (rather than a per-document lookup into the frame)
+        info_cols = [col for col in doc_df.columns if col != 'doc_id']
+        for doc_id, row in zip(doc_df.doc_id, doc_df[info_cols].itertuples(index=False, name=None)):
+            bib_info = dict(zip(info_cols, row))
+            bib_entries[doc_id] = self.render_bib_entry(doc_id, bib_info,
+                                        author_strs.get(doc_id, ""), fields_included)
+            self.bib_entry_cache[doc_id] = (mod_dates[doc_id], fields_key, bib_entries[doc_id])
+
+        return bib_entries
+
+    def render_bib_entry(self, doc_id, bib_info, author_str, fields_included):
+        """
+            Returns the text of a single bib entry
+
+            :param doc_id: int of the document's ID
+            :param bib_info: dictionary of the document's row of the Documents table
+                    (which is modified in place)
+            :param author_str: str of the document's author full names joined by " and "
+            :param fields_included: list of str indicating which fields to include
+        """
+        # Verify that the document type and key are present
+        if ('doc_type' not in bib_info) or pd.isna(bib_info['doc_type']) or (bib_info['doc_type'] == ""):
+            logging.debug(f"Document type not found in bib info for doc ID {doc_id}. Using 'article'.")
+            bib_info['doc_type']="article"
+        if ('citation_key' not in bib_info) or pd.isna(bib_info['citation_key']) or (bib_info['citation_key'] == ""):
+            cite_key = f"doc_{str(doc_id).zfill(6)}"
+            logging.debug(f"Citation key blank or not found for doc ID {doc_id}. Using {cite_key}.")
+            bib_info['citation_key'] = cite_key
+
+        # Print the header for the entry
+        lines = [f"@{bib_info['doc_type']}{{{bib_info['citation_key']},\n"]
+
+        # Some field specific formatting
+        if ("year" in bib_info):
+            if pd.isna(bib_info['year']):
+                bib_info['year'] = ""
+            elif not isinstance(bib_info['year'], str):
+                bib_info['year'] = str(int(bib_info['year']))
+        if ("author" in fields_included):
+            bib_info['author'] = author_str
+        if isinstance(bib_info.get("editor", None), str):
+            bib_info['editor'] = bib_info['editor'].replace(";", " and")
+
+        # Iterate over all the fields and print any that are found
+        for field in fields_included:
+            # (Null fields come out of the db as either None or NaN)
+            if (field in bib_info) and (not pd.isna(bib_info[field])) and (bib_info[field] != ""):
+                line = f'\t{field.ljust(12)} = {{{bib_info[field]}}},\n'
+                # TODO: Implement better way to handle special characters
+                line = line.replace("&", "\&")
+                lines.append(line)
+
+        lines.append("}\n")
+        return "".join(lines)
+
+    def invalidate_bib_entries(self, doc_ids = None):
+        """
+            Drops the cached bib entries of the documents passed (or all if None)
+            for changes that don't update a document's modified date (eg authors)
+        """
+        if doc_ids is None:
+            self.bib_entry_cache = {}
+            return
+        if not isinstance(doc_ids, list):
+            doc_ids = [doc_ids]
+        for doc_id in doc_ids:
+            self.bib_entry_cache.pop(doc_id, None)
+
+    def write_all_proj_bib_files(self, bib_folder, force_regen = False, cascade = False,
+                                    max_workers = 1):
         """
             This function regenerates all the bib files associated with each
             project if there have been any changes to included bib records
@@ -517,20 +1000,25 @@ class ArDa_DB:
             :param cascade: boolean indicating if project document association
                 should cascade (ie proj include all docs in itself AND descendant
                 project documents)
+            :param max_workers: int of the number of threads writing project files
+                        (1 writes them in turn, None lets the pool decide)
+
+            Returns: dictionary of proj_id to the seconds spent writing its files
+                        (for each project that was rebuilt)
         """
         logging.debug("--------------CHECKING/BUILDING BIB FILES-----------------")
-        no_bib_files_built = True
         # Grabbing the current projects and document associations
         proj_df = self.get_table(table_name='Projects')
         proj_df.set_index('proj_id', inplace=True) # For easy indexing
-        doc_proj_df = self.get_table(table_name='Doc_Proj')
-        doc_df = self.get_table(table_name='Documents')
+        all_projs_docs = self.get_all_projs_docs(cascade=cascade)
+        doc_df = self.get_table(table_name='Documents', columns=['doc_id', 'modified_date'])
 
-        # Iterate over each project
+        # Gathering the projects which need rebuilding (and the files of each)
+        proj_jobs = []
         for proj_id, proj_row in proj_df.iterrows():
             proj_name = proj_row['proj_text']
             # Grab all doc IDs associated with project(s)
-            doc_ids = self.get_projs_docs(proj_id, cascade=cascade)
+            doc_ids = all_projs_docs.get(proj_id, [])
 
             if not force_regen: # If not being forced, we check last build times
                 # Grab last build time and most recent modified time amongst bib entries
@@ -541,23 +1029,44 @@ class ArDa_DB:
                     continue
                 logging.debug(f"Changes found, rebuilding project '{proj_name}' (ID = {proj_id}).")
             # Generating filename
-            file_path = bib_folder + "\\" + str(proj_id) + "-" + proj_name.replace(" ","") + ".bib"
-            # Generating the associated bib file
-            no_bib_files_built = False
-            self.write_bib_file(doc_ids, file_path)
+            file_paths = [bib_folder + "\\" + str(proj_id) + "-" + proj_name.replace(" ","") + ".bib"]
             # Generating additional bib files in the other project specific paths specified
-            if (proj_row['bib_paths'] is None) or (proj_row['bib_paths']==""):
-                bib_paths = []
-            else:
+            if isinstance(proj_row['bib_paths'], str) and (proj_row['bib_paths']!=""):
                 bib_paths = proj_row['bib_paths'].split(";")
-                bib_paths = [bib.strip().replace("\\","/") for bib in bib_paths if bib!=""]
-            for bib_path in bib_paths:
-                self.write_bib_file(doc_ids, bib_path)
-                
-            # Updating the bib file build date and time
+                file_paths += [bib.strip().replace("\\","/") for bib in bib_paths if bib!=""]
+            proj_jobs.append((proj_id, doc_ids, file_paths))
+
+        # Checking if no bib files need to be built
+        if len(proj_jobs) == 0:
+            logging.debug("No changes since last build, so nothing new built.")
+            logging.debug("------------------ Finished BIB FILES---------------------")
+            return {}
+
+        # Rendering the entries of every document involved once (from a single read
+        #   of the documents and authors) so the workers only assemble and write files
+        all_doc_ids = sorted({doc_id for _, doc_ids, _ in proj_jobs for doc_id in doc_ids})
+        bib_entries = self.get_bib_entries(all_doc_ids)
+
+        def write_proj_files(proj_job):
+            proj_id, doc_ids, file_paths = proj_job
+            start_time = time.perf_counter()
+            # Every path of the project is written from the same contents
+            bib_bytes = self.join_bib_entries(doc_ids, bib_entries)
+            for file_path in file_paths:
+                self.write_bib_text(file_path, bib_bytes)
+            return proj_id, time.perf_counter() - start_time
+
+        if max_workers == 1:
+            proj_times = dict(map(write_proj_files, proj_jobs))
+        else:
+            with ThreadPoolExecutor(max_workers = max_workers) as executor:
+                proj_times = dict(executor.map(write_proj_files, proj_jobs))
+
+        # Updating the bib file build date and time
+        for proj_id, _, _ in proj_jobs:
+            logging.debug(f"Project {proj_id} bib file(s) written in {proj_times[proj_id]:.3f}s.")
             dt_now = datetime.now().timestamp()*1e3
             self.update_record({'proj_id':proj_id}, 'bib_built', dt_now, table_name="Projects")
-        
-        # Checking if no bib files were built
-        if no_bib_files_built: logging.debug("No changes since last build, so nothing new built.")
-        logging.debug("------------------ Finished BIB FILES---------------------")
\ No newline at end of file
+
+        logging.debug("------------------ Finished BIB FILES---------------------")
+        return proj_times
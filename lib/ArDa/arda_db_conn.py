@@ -0,0 +1,85 @@
+# This defines a class which manages the sqlite connections of an ArDa database
+
+import sqlite3, threading, logging
+
+# Milliseconds a connection waits for another connection's write lock
+BUSY_TIMEOUT_MS = 30000
+
+class ArDa_DB_Conn:
+    """
+        Holds the sqlite connections used by an ArDa_DB_SQL instance. The thread
+        that opened the db (ie the UI thread) keeps a single long-lived connection
+        while any other (background) thread is handed a connection of its own,
+        drawn from a small pool of idle connections when one is available.
+    """
+
+    def __init__(self, db_path, max_pool_size = 4):
+        """
+            :param db_path: string path to the sqlite file
+            :param max_pool_size: int max number of idle worker connections kept around
+        """
+        self.db_path = db_path
+        self.max_pool_size = max_pool_size
+        self.main_thread_id = threading.get_ident()
+        self.main_conn = None
+        self.idle_pool = []
+        self.thread_conns = {}
+        self.lock = threading.Lock()
+
+    def open_conn(self):
+        """
+            Opens a brand new connection to the db. The db is put in WAL mode so
+            reads aren't blocked by another connection's write (eg an import on a
+            worker thread) and writes wait (up to the busy timeout) for the write
+            lock instead of failing with 'database is locked'.
+        """
+        conn = sqlite3.connect(self.db_path, check_same_thread=False,
+                                timeout=BUSY_TIMEOUT_MS/1000)
+        conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+        conn.execute("PRAGMA journal_mode = WAL")
+        return conn
+
+    def get_conn(self):
+        """ Returns the connection associated with the calling thread """
+        thread_id = threading.get_ident()
+        # The thread that opened the db always reuses the same connection
+        if thread_id == self.main_thread_id:
+            if self.main_conn is None:
+                self.main_conn = self.open_conn()
+            return self.main_conn
+        # Worker threads reuse their connection (or grab one from the pool)
+        with self.lock:
+            if thread_id not in self.thread_conns:
+                if len(self.idle_pool) > 0:
+                    self.thread_conns[thread_id] = self.idle_pool.pop()
+                else:
+                    self.thread_conns[thread_id] = self.open_conn()
+            return self.thread_conns[thread_id]
+
+    def release_conn(self):
+        """ Returns the calling (worker) thread's connection to the idle pool """
+        thread_id = threading.get_ident()
+        if thread_id == self.main_thread_id:
+            return      # The main connection is never released
+        with self.lock:
+            conn = self.thread_conns.pop(thread_id, None)
+            if conn is None:
+                return
+            # Discard any uncommitted work before handing it to another thread
+            conn.rollback()
+            if len(self.idle_pool) < self.max_pool_size:
+                self.idle_pool.append(conn)
+            else:
+                conn.close()
+
+    def close(self):
+        """ Closes every connection held by this manager """
+        with self.lock:
+            all_conns = [self.main_conn] + self.idle_pool + list(self.thread_conns.values())
+            for conn in all_conns:
+                if conn is not None:
+                    conn.close()
+            self.main_conn = None
+            self.idle_pool = []
+            self.thread_conns = {}
+        logging.debug(f"Closed all connections to {self.db_path}.")
@@ -0,0 +1,177 @@
+# This file holds the schema migrations of the sqlite back-end and the functions that apply them
+
+import logging, sqlite3
+from datetime import date
+try:
+    import ArDa.aux_functions as aux
+except ModuleNotFoundError:
+    import lib.ArDa.aux_functions as aux
+
+# Fills the (empty) project closure table with every ancestor/descendant pair (and
+#   their distance) of the Projects table. The depth cap guards against cycles.
+BUILD_PROJ_CLOSURE = """INSERT INTO Project_Closure (ancestor_id, descendant_id, depth)
+        WITH RECURSIVE closure(ancestor_id, descendant_id, depth) AS (
+            SELECT proj_id, proj_id, 0 FROM Projects
+            UNION ALL
+            SELECT c.ancestor_id, p.proj_id, c.depth+1
+            FROM Projects AS p JOIN closure AS c ON p.parent_id = c.descendant_id
+            WHERE c.depth < 1000)
+        SELECT ancestor_id, descendant_id, MIN(depth) FROM closure
+        GROUP BY ancestor_id, descendant_id"""
+
+def fillDupKeys(c, doc_ids = None):
+    """
+        Inserts the duplicate keys (see aux.getDupKeys) of documents into Doc_Dup_Keys
+        (any existing keys of those documents should be deleted beforehand)
+
+        :param c: sqlite cursor of the db
+        :param doc_ids: list of the doc ids to fill (None fills all documents)
+    """
+    id_cond, id_vals = "", []
+    if doc_ids is not None:
+        if len(doc_ids) == 0: return
+        id_cond = f" AND doc_id IN ({', '.join(['?']*len(doc_ids))})"
+        id_vals = [aux.sqlValue(doc_id) for doc_id in doc_ids]
+    # The first author of each document is its first author row
+    c.execute("SELECT doc_id, last_name FROM Doc_Auth WHERE contribution = 'Author'"+
+                id_cond+" ORDER BY rowid", id_vals)
+    first_authors = {}
+    for doc_id, last_name in c.fetchall():
+        first_authors.setdefault(doc_id, last_name)
+    c.execute(f"SELECT doc_id, {', '.join(aux.DUP_KEY_FIELDS)} FROM Documents WHERE 1"+
+                id_cond, id_vals)
+    key_rows = []
+    for row in c.fetchall():
+        doc_dict = dict(zip(aux.DUP_KEY_FIELDS, row[1:]))
+        key_rows += [(row[0], key_type, key_value) for key_type, key_value
+                        in aux.getDupKeys(doc_dict, first_authors.get(row[0], None))]
+    c.executemany("INSERT INTO Doc_Dup_Keys (doc_id, key_type, key_value) VALUES (?, ?, ?)", key_rows)
+
+def createDocSearch(c):
+    """
+        Creates the Documents_FTS full-text index (an FTS5 table over the text of
+        Documents, see aux.DOC_SEARCH_FIELDS) along with the triggers keeping it in
+        sync and fills it. Sqlite builds without FTS5 are left without the index
+        (searches then fall back on scanning the Documents table).
+
+        :param c: sqlite cursor of the db
+    """
+    cols = ", ".join(aux.DOC_SEARCH_FIELDS)
+    new_vals = ", ".join(["new."+field for field in aux.DOC_SEARCH_FIELDS])
+    old_vals = ", ".join(["old."+field for field in aux.DOC_SEARCH_FIELDS])
+    try:
+        # The index has no copy of the text (it reads it from Documents by doc_id)
+        c.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS Documents_FTS USING fts5({cols}, "+
+                    "content='Documents', content_rowid='doc_id', tokenize='unicode61 remove_diacritics 2')")
+    except sqlite3.OperationalError as e:
+        logging.warning(f"Full-text search index not created (sqlite lacks FTS5?): {e}")
+        return
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS documents_fts_insert AFTER INSERT ON Documents BEGIN
+                    INSERT INTO Documents_FTS (rowid, {cols}) VALUES (new.doc_id, {new_vals});
+                END""")
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS documents_fts_delete AFTER DELETE ON Documents BEGIN
+                    INSERT INTO Documents_FTS (Documents_FTS, rowid, {cols}) VALUES ('delete', old.doc_id, {old_vals});
+                END""")
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS documents_fts_update AFTER UPDATE OF doc_id, {cols} ON Documents BEGIN
+                    INSERT INTO Documents_FTS (Documents_FTS, rowid, {cols}) VALUES ('delete', old.doc_id, {old_vals});
+                    INSERT INTO Documents_FTS (rowid, {cols}) VALUES (new.doc_id, {new_vals});
+                END""")
+    c.execute("INSERT INTO Documents_FTS (Documents_FTS) VALUES ('rebuild')")
+
+# Each migration is a tuple of (version, description, steps), where steps is a list
+#   of sql statements or functions (taking a cursor) run in order. Migrations must
+#   only ever be appended to this list (with increasing versions) since existing dbs
+#   will only run those that have a version greater than their current one.
+MIGRATIONS = [
+    (1, "Add indexes for per-document and per-project lookups",
+        ["CREATE INDEX IF NOT EXISTS idx_doc_auth_doc_id ON Doc_Auth (doc_id)",
+         "CREATE INDEX IF NOT EXISTS idx_doc_proj_proj_doc ON Doc_Proj (proj_id, doc_id)",
+         "CREATE INDEX IF NOT EXISTS idx_doc_proj_doc_id ON Doc_Proj (doc_id)",
+         "CREATE INDEX IF NOT EXISTS idx_doc_paths_doc_id ON Doc_Paths (doc_id)",
+         "CREATE INDEX IF NOT EXISTS idx_doc_paths_full_path ON Doc_Paths (full_path)",
+         "CREATE INDEX IF NOT EXISTS idx_proj_notes_doc_proj ON Proj_Notes (doc_id, proj_id)",
+         "CREATE INDEX IF NOT EXISTS idx_documents_citation_key ON Documents (citation_key)",
+         "CREATE INDEX IF NOT EXISTS idx_projects_parent_id ON Projects (parent_id)"]),
+    (2, "Add a table tracking the next id of each id variable (for reserved id blocks)",
+        ["CREATE TABLE IF NOT EXISTS 'ID_Sequences' ( `id_name` TEXT NOT NULL, "+
+            "`next_id` INTEGER NOT NULL, PRIMARY KEY(`id_name`) )"]),
+    (3, "Add a project closure table (every ancestor/descendant pair of projects)",
+        ["CREATE TABLE IF NOT EXISTS 'Project_Closure' ( `ancestor_id` INTEGER NOT NULL, "+
+            "`descendant_id` INTEGER NOT NULL, `depth` INTEGER NOT NULL, "+
+            "PRIMARY KEY(`ancestor_id`, `descendant_id`) )",
+         "CREATE INDEX IF NOT EXISTS idx_proj_closure_desc ON Project_Closure (descendant_id, depth)",
+         "DELETE FROM Project_Closure",
+         BUILD_PROJ_CLOSURE]),
+    (4, "Add a table of duplicate detection keys (title, doi, arXiv id, isbn, author and year)",
+        ["CREATE TABLE IF NOT EXISTS 'Doc_Dup_Keys' ( `doc_id` INTEGER NOT NULL, "+
+            "`key_type` TEXT NOT NULL, `key_value` TEXT NOT NULL )",
+         "CREATE INDEX IF NOT EXISTS idx_doc_dup_keys_key ON Doc_Dup_Keys (key_type, key_value)",
+         "CREATE INDEX IF NOT EXISTS idx_doc_dup_keys_doc_id ON Doc_Dup_Keys (doc_id)",
+         "DELETE FROM Doc_Dup_Keys",
+         fillDupKeys]),
+    (5, "Add a full-text search index over the text fields of Documents",
+        [createDocSearch]),
+    (6, "Add indexes for reading the document view in sorted pages",
+        ["CREATE INDEX IF NOT EXISTS idx_documents_add_date ON Documents (add_date, doc_id)",
+         "CREATE INDEX IF NOT EXISTS idx_documents_modified_date ON Documents (modified_date, doc_id)",
+         "CREATE INDEX IF NOT EXISTS idx_documents_read_date ON Documents (read_date, doc_id)",
+         "CREATE INDEX IF NOT EXISTS idx_documents_year ON Documents (year, doc_id)",
+         "CREATE INDEX IF NOT EXISTS idx_documents_title ON Documents (title, doc_id)"]),
+    (7, "Make project memberships and project notes unique per (doc_id, proj_id)",
+        ["DELETE FROM Doc_Proj WHERE rowid NOT IN "+
+            "(SELECT MIN(rowid) FROM Doc_Proj GROUP BY doc_id, proj_id)",
+         # (keeping the latest note of each document and project)
+         "DELETE FROM Proj_Notes WHERE rowid NOT IN "+
+            "(SELECT MAX(rowid) FROM Proj_Notes GROUP BY doc_id, proj_id)",
+         "DROP INDEX IF EXISTS idx_doc_proj_doc_id",
+         "DROP INDEX IF EXISTS idx_proj_notes_doc_proj",
+         "CREATE UNIQUE INDEX IF NOT EXISTS idx_doc_proj_unique ON Doc_Proj (doc_id, proj_id)",
+         "CREATE UNIQUE INDEX IF NOT EXISTS idx_proj_notes_unique ON Proj_Notes (doc_id, proj_id)"]),
+]
+
+def getSchemaVersion(conn):
+    """
+        Returns the current schema version of the db (0 if it has never been migrated)
+
+        :param conn: sqlite connection to the db
+    """
+    c = conn.cursor()
+    c.execute("CREATE TABLE IF NOT EXISTS 'Schema_Version' ( `version` INTEGER NOT NULL, "+
+                "`applied_date` INTEGER, `description` TEXT, PRIMARY KEY(`version`) )")
+    conn.commit()
+    c.execute("SELECT MAX(version) FROM Schema_Version")
+    version = c.fetchone()[0]
+    return 0 if version is None else version
+
+def runMigrations(conn, migrations = MIGRATIONS):
+    """
+        Applies (in order) every migration whose version is greater than the db's
+        current schema version. Each migration runs in its own transaction so a
+        failure leaves the db at the last successfully applied version.
+
+        :param conn: sqlite connection to the db
+        :param migrations: list of (version, description, steps) tuples
+
+        Returns: int of the schema version of the db after migrating
+    """
+    version = getSchemaVersion(conn)
+    c = conn.cursor()
+    for mig_version, description, steps in sorted(migrations, key = lambda mig: mig[0]):
+        if mig_version <= version: continue
+        logging.debug(f"Migrating db to schema version {mig_version}: {description}")
+        try:
+            c.execute("BEGIN")
+            for step in steps:
+                if callable(step):
+                    step(c)
+                else:
+                    c.execute(step)
+            c.execute("INSERT INTO Schema_Version (version, applied_date, description) VALUES (?, ?, ?)",
+                        (mig_version, int(date.today().strftime("%Y%m%d")), description))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logging.exception(f"Migration to schema version {mig_version} failed, db left at version {version}")
+            raise
+        version = mig_version
+    return version
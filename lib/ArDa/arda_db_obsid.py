@@ -9,6 +9,7 @@ class ArDa_DB_Obsid(ArDa_DB):
     def __init__(self):
         self.db_type = "obsidian"
         self.db_path = None
+        self.init_table_cache()
 
     def make_new_db(self, db_path):
         # Make the folder if it doesn't exist (and check if empty if it does exist)
@@ -1,5 +1,6 @@
-import sqlite3, logging, warnings
+import sqlite3, logging, warnings, re
 import pandas as pd
+import numpy as np
 from os.path import exists
 
 try:
@@ -10,6 +11,18 @@ try:
     import ArDa.aux_functions as aux
 except ModuleNotFoundError:
     import lib.ArDa.aux_functions as aux
+try:
+    from ArDa.arda_db_conn import ArDa_DB_Conn
+except ModuleNotFoundError:
+    from lib.ArDa.arda_db_conn import ArDa_DB_Conn
+try:
+    import ArDa.arda_db_migrations as mig
+except ModuleNotFoundError:
+    import lib.ArDa.arda_db_migrations as mig
+try:
+    from ArDa.arda_filters import compileFilterCode
+except ModuleNotFoundError:
+    from lib.ArDa.arda_filters import compileFilterCode
 
 
 class ArDa_DB_SQL(ArDa_DB):
@@ -20,6 +33,15 @@ class ArDa_DB_SQL(ArDa_DB):
 
     def __init__(self):
         self.db_type = "sqllite"
+        self.db_path = None
+        self.db_conn = None
+        self.init_table_cache()
+
+    def init_table_cache(self):
+        """ Resets the table cache (and the cached project paths and compiled filters) """
+        super().init_table_cache()
+        self.proj_path_cache = None
+        self.compiled_filters = {}
 
     def make_new_db(self, db_path):
         # Check that path is valid and the file does not exist currently
@@ -54,58 +76,158 @@ class ArDa_DB_SQL(ArDa_DB):
         c.execute("CREATE TABLE 'Proj_Notes' ( `doc_id` INTEGER NOT NULL, `proj_id` INTEGER NOT NULL, `proj_note` TEXT NOT NULL )")
         conn.close()
         self.db_path = db_path
+        self.init_table_cache()
+        self.init_conn_manager()
+        self.migrate_db()
 
     def open_db(self, db_path):
-        return super().open_db(db_path)
+        super().open_db(db_path)
+        self.init_conn_manager()
+        self.migrate_db()
+
+    def migrate_db(self):
+        """ Brings the schema of the current db up to date (ie indexes, keys) """
+        self.schema_version = mig.runMigrations(self.get_conn())
+
+    def load_schema(self):
+        """ Builds the schema registry from the db's Fields table and table columns """
+        c = self.get_conn().cursor()
+        c.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+        table_names = [row[0] for row in c.fetchall()]
+        table_cols = {}
+        for table_name in table_names:
+            c.execute(f"PRAGMA table_info('{table_name}')")
+            table_cols[table_name] = [row[1] for row in c.fetchall()]
+        c.close()
+        # Falling back on the default field info if the db has no Fields table (yet)
+        if 'Fields' not in table_names:
+            return ArDa_Schema(super().load_schema().get_field_df(), table_cols)
+        return ArDa_Schema(self.extract_table("Fields"), table_cols)
+
+    def close_db(self):
+        """ Closes all the connections held to the current db """
+        if self.db_conn is not None:
+            self.db_conn.close()
+            self.db_conn = None
+
+    def init_conn_manager(self):
+        """ (Re)creates the connection manager for the current db path """
+        self.close_db()
+        self.db_conn = ArDa_DB_Conn(self.db_path)
+
+    def get_conn(self):
+        """ Returns the sqlite connection to use on the calling thread """
+        return self.db_conn.get_conn()
+
+    def release_conn(self):
+        """ Releases the calling (worker) thread's connection back to the pool """
+        if self.db_conn is not None:
+            self.db_conn.release_conn()
 
     ## Status/Attribute Extraction Functions #######################
     ################################################################
 
-    def get_table(self, table_name='Documents', use_header_text = False):
-        """ Extracts and returns the specified table """
+    def get_table(self, table_name='Documents', use_header_text = False,
+                    columns = None, where = None, order_by = None):
+        """
+            Extracts and returns the specified table (or just part of it). Whole
+            tables are cached, while parts are pulled from the cached table when
+            it is there and queried directly from the db otherwise.
+
+            :param table_name: string of the table name
+            :param use_header_text: boolean indicating whether to label columns with their header text
+            :param columns: list of str of the columns to return (None returns all)
+            :param where: dictionary whose keys are columns and whose values are
+                    either a single value (or None) to match or a list of values to match any of
+            :param order_by: str or list of str of columns (optionally followed by
+                    " DESC") to sort the rows by
+        """
         # Run parent class function which checks the inputs
         super().get_table(table_name)
 
-        # Connect to the underlying sql db
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
+        if (columns is None) and (where is None) and (order_by is None):
+            # Use the cached version of the table (if there is one)
+            temp_df = self.get_cached_table(table_name)
+            if temp_df is None:
+                temp_df = self.extract_table(table_name)
+                self.set_cached_table(table_name, temp_df)
+        elif table_name in self.table_cache:
+            # Filtering the cached table without copying it (see filter_table)
+            temp_df = self.filter_table(self.get_cached_table(table_name, copy=False),
+                                        columns, where, order_by)
+        else:
+            temp_df = self.extract_table(table_name, columns, where, order_by)
+
+        # Checking if using header text for column labels
+        if use_header_text:
+            # Grab the fields associated with this table
+            field_to_header = self.get_schema().get_field_to_header(table_name)
+            field_to_header = {key:value for key, value in field_to_header.items() if value is not None}
+            # Map the columns to their hearder version (if found)
+            temp_df.columns = [field_to_header.get(field, field) for field in temp_df.columns]
+
+        return temp_df
+
+    def get_sorted_doc_ids(self, field, descending = False, numeric = False):
+        """
+            Returns an array of every doc id ordered by a field the way the document
+            table sorts it (see aux.getSortRanks), ie empty values last in either
+            direction and text without case, with ties ordered by doc id
+
+            :param field: str of the Documents field to sort by
+            :param descending: boolean indicating whether the order is descending
+            :param numeric: boolean indicating whether the field is sorted by its numeric value
+        """
+        if "Documents" in self.table_cache:
+            doc_df = self.get_table("Documents", columns=['doc_id', field])
+            ranks = aux.getSortRanks(doc_df[field].to_numpy(), numeric)
+            num_values = ranks.max() + 1 if len(ranks) > 0 else 0
+            keys = np.where(ranks < 0, num_values, (num_values - 1 - ranks) if descending else ranks)
+            doc_ids = doc_df['doc_id'].to_numpy()
+            return doc_ids[np.lexsort((-doc_ids if descending else doc_ids, keys))]
+        command, values = aux.getSelectSQL("Documents", ['doc_id'])
+        direction = " DESC" if descending else ""
+        command += f" ORDER BY {aux.getSortOrderSQL(field, descending)}, doc_id{direction}"
+        c = self.get_conn().cursor()
+        c.execute(command, values)
+        doc_ids = np.array([row[0] for row in c.fetchall()], dtype=np.int64)
+        c.close()
+        return doc_ids
 
+    def extract_table(self, table_name, columns = None, where = None, order_by = None):
+        """
+            Reads the specified table directly from the db (bypassing the cache),
+            with the same optional arguments as get_table
+        """
         # Simple extraction for a few tables
         if table_name in ['Fields', 'Projects', 'Doc_Proj', 'Doc_Auth', 'Documents',
                             'Proj_Notes', 'Custom_Filters', 'Doc_Paths']:
-            c.execute(f'SELECT * FROM {table_name}')
-            temp_df = pd.DataFrame(c.fetchall(), columns=[description[0] for description in c.description])
+            from_expr = table_name
         # Special extraction for extended doc project
         elif table_name == 'Doc_Proj_Ext':
-            c.execute("SELECT p.*, dp.doc_id FROM Doc_Proj as dp Join Projects as p on dp.proj_id = p.proj_id")
-            temp_df = pd.DataFrame(c.fetchall(), columns=[description[0] for description in c.description])
+            from_expr = "(SELECT p.*, dp.doc_id FROM Doc_Proj as dp Join Projects as p on dp.proj_id = p.proj_id)"
         else:
             # Should not be possible to reach here (the parent function should have screened this out)
             raise NotImplementedError
+        command, values = aux.getSelectSQL(from_expr, columns, where, order_by)
+
+        # Grab a cursor on the underlying sql db and run the query
+        c = self.get_conn().cursor()
+        c.execute(command, values)
+        temp_df = pd.DataFrame(c.fetchall(), columns=[description[0] for description in c.description])
+        c.close()
 
         # Reordering the cols in the documents table (if that is one asked for)
-        if table_name == "Documents":
+        if (table_name == "Documents") and (columns is None):
             front_cols = ['doc_id', 'doc_type', 'title', 'year', 'journal']
             temp_df = temp_df[front_cols + [col for col in temp_df.columns if col not in front_cols]]
 
-        # Checking if using header text for column labels
-        if use_header_text:
-            # Grab the fields associated with this table
-            c.execute(f'SELECT * FROM Fields WHERE table_name = "{table_name}"')
-            field_df = pd.DataFrame(c.fetchall(), columns=[description[0] for description in c.description])
-            field_to_header = dict(zip(field_df.field, field_df.header_text))
-            field_to_header = {key:value for key, value in field_to_header.items() if value is not None}
-            # Map the columns to their hearder version (if found)
-            temp_df.columns = [field_to_header.get(field, field) for field in temp_df.columns]
-
-        conn.close()
         return temp_df
 
     def get_doc_record(self, doc_id):
-        # Connect to the db and grab the matching doc_id
-        conn = sqlite3.connect(self.db_path)
-        curs = conn.cursor()
-        curs.execute(f"SELECT * FROM Documents WHERE doc_id = {doc_id}")
+        # Grab the matching doc_id from the db
+        curs = self.get_conn().cursor()
+        curs.execute("SELECT * FROM Documents WHERE doc_id = ?", (aux.sqlValue(doc_id),))
         doc_keys = [description[0] for description in curs.description]
         doc_vals = curs.fetchall()
         if len(doc_vals) == 0:
@@ -128,33 +250,76 @@ class ArDa_DB_SQL(ArDa_DB):
         return doc_dict
 
     def get_next_id(self, table_type):
-        # Returns the next available id from either the Documents or Projects tables
-        
-        # Connect to the db and grab all document/project ids
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-        if table_type == "Documents":
-            c.execute("SELECT doc_id FROM Documents")
-        elif table_type == "Projects":
-            c.execute("SELECT proj_id FROM Projects")
-        else:
-            raise NotImplementedError
-        ids_found = [a[0] for a in c.fetchall()]
+        """
+            Returns the next available id from either the Documents or Projects
+            tables (without reserving it). This skips past any ids that have been
+            reserved (see reserve_ids) but not yet used.
+
+            :param table_type: str either "Documents" or "Projects"
+        """
+        id_var = self.get_id_var(table_type)
+        c = self.get_conn().cursor()
+        # Highest id in the table (a lookup on the primary key, so no scan)
+        c.execute(f"SELECT MAX({id_var}) FROM {table_type}")
+        max_id = c.fetchone()[0]
+        # Next id not reserved by a block handed out earlier
+        c.execute("SELECT next_id FROM ID_Sequences WHERE id_name = ?", (id_var,))
+        seq_row = c.fetchone()
         c.close()
 
         # Print the next available id (starting at 1)
-        if len(ids_found) == 0:
-            return 1
+        return max(1, (0 if max_id is None else max_id+1), (0 if seq_row is None else seq_row[0]))
+
+    def reserve_ids(self, table_type, num_ids, min_id = 1):
+        """
+            Reserves a contiguous block of ids (for inserting many records at once)
+            so that they won't be handed out by get_next_id or another reservation.
+
+            :param table_type: str either "Documents" or "Projects"
+            :param num_ids: int number of ids to reserve
+            :param min_id: int lowest id the block may start at
+
+            Returns: int of the first id in the block (ie ids first to first+num_ids-1)
+        """
+        id_var = self.get_id_var(table_type)
+        conn = self.get_conn()
+        # Taking the write lock first so two threads can't reserve the same block. Within
+        #   a transaction the caller opened, a savepoint leaves committing it to the caller.
+        own_transaction = not conn.in_transaction
+        conn.execute("BEGIN IMMEDIATE" if own_transaction else "SAVEPOINT reserve_ids")
+        try:
+            first_id = max(self.get_next_id(table_type), min_id)
+            conn.execute("INSERT OR REPLACE INTO ID_Sequences (id_name, next_id) VALUES (?, ?)",
+                            (id_var, first_id + num_ids))
+        except sqlite3.Error:
+            if own_transaction:
+                conn.rollback()
+            else:
+                conn.execute("ROLLBACK TO reserve_ids")
+                conn.execute("RELEASE reserve_ids")
+            raise
+        if own_transaction:
+            conn.commit()
         else:
-            return max(ids_found)+1
+            conn.execute("RELEASE reserve_ids")
+        return first_id
+
+    def get_id_var(self, table_type):
+        """ Returns the id variable of the passed table (either Documents or Projects) """
+        if table_type == "Documents":
+            return "doc_id"
+        elif table_type == "Projects":
+            return "proj_id"
+        else:
+            raise NotImplementedError
 
     def get_docs_projs(self, doc_ids, full_path = False, ignore_x_parents = 0):
         # This function returns a dictionary of all the projects that the currently
         #    selected document is in. Currently only those for the first ID (if multiple are selected)
         
         # Get all the project ids associated with the passed doc_ids
-        projs = self.get_table("Doc_Proj")
-        proj_ids = projs[projs.doc_id.isin(doc_ids)].proj_id.values.tolist()
+        projs = self.get_table("Doc_Proj", columns=['proj_id'], where={'doc_id': doc_ids})
+        proj_ids = projs.proj_id.values.tolist()
         proj_ids = list(set(proj_ids))  # Removing duplicates
 
         # Get the full path names for each project
@@ -163,6 +328,346 @@ class ArDa_DB_SQL(ArDa_DB):
 
         return proj_ids
 
+    ## Project Hierarchy Functions #################################
+    ################################################################
+    # These override the parent functions (which walk the Projects table in python)
+    #   with lookups on the Project_Closure table, which holds a row for every
+    #   (ancestor, descendant, depth) triple of projects (including each project
+    #   paired with itself at depth 0) and is kept current on every project write.
+
+    def get_proj_full_path(self, proj_id, ignore_x_parents = 0, path_delim = "/"):
+        """ This extracts the full path of the indicated project  and lops off
+            the top x parents specified.
+        """
+        full_path = self.get_proj_path_names().get(proj_id, None)
+        if full_path is None:
+            raise KeyError(proj_id)
+
+        # Rolling back and removing the top number of parents specified
+        if ignore_x_parents > 0:
+            full_path = full_path[ignore_x_parents:]
+
+        return path_delim.join(full_path)
+
+    def get_proj_path_names(self):
+        """
+            Returns a dictionary mapping every project id to the list of project
+            names from the root down to it (built in one query and kept until the
+            projects change)
+        """
+        if self.proj_path_cache is None:
+            c = self.get_conn().cursor()
+            c.execute("""SELECT pc.descendant_id, p.proj_text
+                        FROM Project_Closure AS pc JOIN Projects AS p ON p.proj_id = pc.ancestor_id
+                        ORDER BY pc.descendant_id, pc.depth DESC""")
+            path_names = {}
+            for proj_id, proj_text in c.fetchall():
+                path_names.setdefault(proj_id, []).append(proj_text)
+            c.close()
+            self.proj_path_cache = path_names
+        return self.proj_path_cache
+
+    def get_proj_ancestors(self, proj_id):
+        """
+            Returns the list of (proj_id, proj_text) tuples of the project and all its
+            ancestors, ordered from the root down to the project itself
+
+            :param proj_id: (int) identifies the project
+        """
+        c = self.get_conn().cursor()
+        c.execute("""SELECT p.proj_id, p.proj_text
+                    FROM Project_Closure AS pc JOIN Projects AS p ON p.proj_id = pc.ancestor_id
+                    WHERE pc.descendant_id = ? ORDER BY pc.depth DESC""",
+                    (aux.sqlValue(proj_id),))
+        ancestors = c.fetchall()
+        c.close()
+        return ancestors
+
+    def get_proj_children(self, proj_id, include_x_children = 1, proj_table = None):
+        """ Returns the proj_ids of all children projects (and their childrens
+            children etc) down to the level specified.
+
+            :param proj_id: (int) identified the main project
+            :param include_x_children: (int) >=0, indicates the generations to go down
+                eg =1 means it will return list of children projects of proj_id.
+                eg =2 means it will return them as well as children of children, etc
+            :param proj_table: (df) table containing project info, if passed the
+                children are found from it rather than the db
+        """
+        # Quick argument checks
+        msg = "Argument include_x_children must be a non-negative integer"
+        assert (isinstance(include_x_children, int) & include_x_children >=0), msg
+        if proj_table is not None:
+            return super().get_proj_children(proj_id, include_x_children, proj_table)
+
+        # All descendants down to the level specified (nearest generations first)
+        c = self.get_conn().cursor()
+        c.execute("""SELECT descendant_id FROM Project_Closure
+                    WHERE ancestor_id = ? AND depth BETWEEN 1 AND ?
+                    ORDER BY depth, descendant_id""",
+                    (aux.sqlValue(proj_id), include_x_children))
+        all_children = [row[0] for row in c.fetchall()]
+        c.close()
+        return all_children
+
+    def get_projs_docs(self, proj_ids, cascade = False):
+        """ This function returns a list of document ids that are in the
+            indicated project(s) (and of all children projects if cascade specified)
+        """
+        # Some initial checks/tweaks
+        if not isinstance(proj_ids, list):
+            proj_ids = [proj_ids]
+        if not cascade:
+            return super().get_projs_docs(proj_ids, cascade)
+        if len(proj_ids) == 0:
+            return []
+
+        # Gathering the documents of every project in the subtrees of those passed
+        #   (the direct ones are included for ids that may not be in Projects)
+        id_marks = ', '.join(['?']*len(proj_ids))
+        c = self.get_conn().cursor()
+        c.execute(f"""SELECT dp.doc_id FROM Project_Closure AS pc
+                        JOIN Doc_Proj AS dp ON dp.proj_id = pc.descendant_id
+                        WHERE pc.ancestor_id IN ({id_marks})
+                    UNION
+                    SELECT doc_id FROM Doc_Proj WHERE proj_id IN ({id_marks})
+                    ORDER BY 1""",
+                    [aux.sqlValue(proj_id) for proj_id in proj_ids]*2)
+        proj_docs = [row[0] for row in c.fetchall()]
+        c.close()
+        return proj_docs
+
+    def get_all_projs_docs(self, cascade = False):
+        """
+            Returns a dictionary mapping every project id to the list of its document
+            ids (including those of all its descendant projects if cascade specified)
+        """
+        c = self.get_conn().cursor()
+        c.execute(f"""SELECT DISTINCT pc.ancestor_id, dp.doc_id
+                    FROM Project_Closure AS pc JOIN Doc_Proj AS dp ON dp.proj_id = pc.descendant_id
+                    {'' if cascade else 'WHERE pc.depth = 0'}
+                    ORDER BY pc.ancestor_id, dp.doc_id""")
+        pairs = c.fetchall()
+        c.execute("SELECT proj_id FROM Projects")
+        all_projs_docs = {row[0]: [] for row in c.fetchall()}
+        c.close()
+        for proj_id, doc_id in pairs:
+            if proj_id in all_projs_docs:
+                all_projs_docs[proj_id].append(doc_id)
+        return all_projs_docs
+
+    ## Project Closure Maintenance Functions #######################
+    ################################################################
+
+    def rebuild_proj_closure(self):
+        """ Rebuilds the whole Project_Closure table from the Projects table """
+        conn = self.get_conn()
+        c = conn.cursor()
+        c.execute("DELETE FROM Project_Closure")
+        c.execute(mig.BUILD_PROJ_CLOSURE)
+        conn.commit()
+        c.close()
+        self.proj_path_cache = None
+
+    def add_proj_closure(self, proj_id, parent_id = None):
+        """
+            Adds the closure rows of a new (leaf) project, ie itself and the
+            ancestors of its parent (a parent of None or 0 indicates a root project)
+        """
+        conn = self.get_conn()
+        c = conn.cursor()
+        c.execute("INSERT OR REPLACE INTO Project_Closure (ancestor_id, descendant_id, depth) "+
+                    "VALUES (?, ?, 0)", (aux.sqlValue(proj_id), aux.sqlValue(proj_id)))
+        if (parent_id is not None) and (parent_id != 0):
+            c.execute("""INSERT OR REPLACE INTO Project_Closure (ancestor_id, descendant_id, depth)
+                        SELECT ancestor_id, ?, depth+1 FROM Project_Closure WHERE descendant_id = ?""",
+                        (aux.sqlValue(proj_id), aux.sqlValue(parent_id)))
+        conn.commit()
+        c.close()
+        self.proj_path_cache = None
+
+    def move_proj_closure(self, proj_id, new_parent_id):
+        """
+            Moves the subtree of a project (in the closure) under a new parent by
+            unlinking it from its old ancestors and linking it to the new ones
+        """
+        conn = self.get_conn()
+        c = conn.cursor()
+        proj_id, new_parent_id = aux.sqlValue(proj_id), aux.sqlValue(new_parent_id)
+        # Moving a project under one of its own descendants makes a cycle which
+        #   can't be linked up incrementally, so the whole table is rebuilt instead
+        c.execute("SELECT 1 FROM Project_Closure WHERE ancestor_id = ? AND descendant_id = ?",
+                    (proj_id, new_parent_id))
+        if c.fetchone() is not None:
+            c.close()
+            warnings.warn(f"Project {new_parent_id} is a descendant of project {proj_id}, "+
+                            "so this move creates a cycle in the project tree.")
+            self.rebuild_proj_closure()
+            return
+        # Removing the links between the subtree and the ancestors outside of it
+        c.execute("""DELETE FROM Project_Closure
+                    WHERE descendant_id IN (SELECT descendant_id FROM Project_Closure WHERE ancestor_id = ?)
+                    AND ancestor_id NOT IN (SELECT descendant_id FROM Project_Closure WHERE ancestor_id = ?)""",
+                    (proj_id, proj_id))
+        # Linking every ancestor of the new parent to every project of the subtree
+        if (new_parent_id is not None) and (new_parent_id != 0):
+            c.execute("""INSERT OR REPLACE INTO Project_Closure (ancestor_id, descendant_id, depth)
+                        SELECT sup.ancestor_id, sub.descendant_id, sup.depth + sub.depth + 1
+                        FROM Project_Closure AS sup CROSS JOIN Project_Closure AS sub
+                        WHERE sup.descendant_id = ? AND sub.ancestor_id = ?""",
+                        (new_parent_id, proj_id))
+        conn.commit()
+        c.close()
+        self.proj_path_cache = None
+
+    def delete_proj_closure(self, proj_id):
+        """ Removes every closure row involving the project """
+        conn = self.get_conn()
+        c = conn.cursor()
+        c.execute("DELETE FROM Project_Closure WHERE ancestor_id = ? OR descendant_id = ?",
+                    (aux.sqlValue(proj_id), aux.sqlValue(proj_id)))
+        conn.commit()
+        c.close()
+        self.proj_path_cache = None
+
+    ## Search Functions ############################################
+    ################################################################
+    # The text fields of Documents (see aux.DOC_SEARCH_FIELDS) are indexed in the
+    #   Documents_FTS (FTS5) table, which triggers keep in sync with Documents.
+    #   Custom filters are compiled into sql conditions on Documents.
+
+    def search_docs(self, search_text):
+        """
+            Returns the set of doc ids of documents whose text fields match every
+            term of the search text (see aux.getFTSQuery for the syntax)
+
+            :param search_text: str of the text to search for
+        """
+        fts_query = aux.getFTSQuery(search_text)
+        if fts_query == "":
+            return set()
+        c = self.get_conn().cursor()
+        try:
+            c.execute("SELECT rowid FROM Documents_FTS WHERE Documents_FTS MATCH ?", (fts_query,))
+        except sqlite3.OperationalError:
+            # Without the index (ie sqlite lacks FTS5) each term is found by scanning
+            logging.debug("No full-text index found, searching by scanning Documents.")
+            terms = [term for term, _ in aux.getSearchTerms(search_text)]
+            term_cond = "(" + " OR ".join([f"{field} LIKE ?" for field in aux.DOC_SEARCH_FIELDS]) + ")"
+            c.execute("SELECT doc_id FROM Documents WHERE " + " AND ".join([term_cond]*len(terms)),
+                        [f"%{term}%" for term in terms for _ in aux.DOC_SEARCH_FIELDS])
+        doc_ids = {row[0] for row in c.fetchall()}
+        c.close()
+        return doc_ids
+
+    def search_field_docs(self, field, search_value):
+        """
+            Returns the set of doc ids of documents whose field contains the search
+            text (ignoring case) or, for a number, equals it
+
+            :param field: str of the Documents field to search
+            :param search_value: str of the text (or int of the number) to search for
+        """
+        if field not in self.get_schema().get_fields("Documents"):
+            raise ValueError(f"Field ({field}) not recognized for searching.")
+        if isinstance(search_value, str):
+            condition = f"`{field}` LIKE ? ESCAPE '\\'"
+            search_value = "%" + re.sub(r"([\\%_])", r"\\\1", search_value) + "%"
+        else:
+            condition = f"`{field}` = ?"
+        c = self.get_conn().cursor()
+        c.execute(f"SELECT doc_id FROM Documents WHERE {condition}", (aux.sqlValue(search_value),))
+        doc_ids = {row[0] for row in c.fetchall()}
+        c.close()
+        return doc_ids
+
+    def get_custom_filter_docs(self, filter_id, cascade = False):
+        """
+            Returns the set of doc ids kept by a custom filter (see compileFilterCode
+            for the filter code syntax), or None if its code is empty (ie the filter
+            keeps every document). Compiled filters are cached by filter id (until
+            their code changes). Raises a ValueError if the code can't be compiled.
+
+            :param filter_id: int of the filter's id (in Custom_Filters)
+            :param cascade: boolean indicating whether project conditions include
+                    the documents of sub-projects
+        """
+        filters = self.get_table("Custom_Filters")
+        filter_codes = filters.loc[filters.filter_id == filter_id, 'filter_code'].tolist()
+        if len(filter_codes) == 0:
+            raise ValueError(f"Custom filter ({filter_id}) not found.")
+        filter_code = filter_codes[0] if isinstance(filter_codes[0], str) else ""
+        cache_key = (filter_code, cascade)
+        if self.compiled_filters.get(filter_id, (None, None))[0] != cache_key:
+            self.compiled_filters[filter_id] = (cache_key,
+                                    compileFilterCode(filter_code, self.get_schema(), cascade))
+        compiled = self.compiled_filters[filter_id][1]
+        if compiled is None:
+            return None
+        condition, params = compiled
+        c = self.get_conn().cursor()
+        c.execute(f"SELECT doc_id FROM Documents WHERE {condition}", [aux.sqlValue(val) for val in params])
+        doc_ids = {row[0] for row in c.fetchall()}
+        c.close()
+        return doc_ids
+
+    ## Duplicate Detection Functions ###############################
+    ################################################################
+    # Each document has a few keys (see aux.getDupKeys) stored in the (indexed)
+    #   Doc_Dup_Keys table, so finding a document's potential duplicates only
+    #   takes a handful of index lookups
+
+    def find_duplicate_ids(self, doc_dict, exclude_doc_ids = None):
+        """
+            Returns the set of doc ids of documents sharing any duplicate key
+            (eg normalized title, doi, arXiv id) with the document passed. Documents
+            only sharing the first author and year must also have a similar title
+            (so other papers by the same author that year aren't matched).
+
+            :param doc_dict: dictionary (with field keys) of the document
+            :param exclude_doc_ids: list of doc ids to leave out (the document's own
+                    id, if it has one, is always left out)
+        """
+        dup_keys = self.get_dup_keys(doc_dict)
+        if len(dup_keys) == 0:
+            return set()
+        c = self.get_conn().cursor()
+        c.execute("SELECT DISTINCT doc_id, key_type FROM Doc_Dup_Keys WHERE "+
+                    " OR ".join(["(key_type = ? AND key_value = ?)"]*len(dup_keys)),
+                    [val for dup_key in dup_keys for val in dup_key])
+        key_matches = c.fetchall()
+        dup_ids = {doc_id for doc_id, key_type in key_matches if key_type != 'author_year'}
+        year_ids = [doc_id for doc_id, key_type in key_matches
+                    if (key_type == 'author_year') and (doc_id not in dup_ids)]
+        if (len(year_ids) > 0) and isinstance(doc_dict.get('title', None), str):
+            for i in range(0, len(year_ids), 500):
+                id_chunk = year_ids[i:i+500]
+                c.execute(f"SELECT doc_id, title FROM Documents WHERE doc_id IN ({', '.join(['?']*len(id_chunk))})",
+                            id_chunk)
+                dup_ids |= {doc_id for doc_id, title in c.fetchall()
+                            if aux.isSimilarTitle(doc_dict['title'], title)}
+        c.close()
+        exclude_doc_ids = set([] if exclude_doc_ids is None else exclude_doc_ids)
+        if 'doc_id' in doc_dict:
+            exclude_doc_ids.add(doc_dict['doc_id'])
+        return dup_ids - exclude_doc_ids
+
+    def refresh_dup_keys(self, doc_ids = None):
+        """ Rebuilds the duplicate keys of the documents passed (or all if None) """
+        conn = self.get_conn()
+        c = conn.cursor()
+        if doc_ids is None:
+            c.execute("DELETE FROM Doc_Dup_Keys")
+            mig.fillDupKeys(c)
+        else:
+            for i in range(0, len(doc_ids), 500):
+                id_chunk = [aux.sqlValue(doc_id) for doc_id in doc_ids[i:i+500]]
+                c.execute(f"DELETE FROM Doc_Dup_Keys WHERE doc_id IN ({', '.join(['?']*len(id_chunk))})",
+                            id_chunk)
+                mig.fillDupKeys(c, id_chunk)
+        conn.commit()
+        c.close()
+
     ## Record Adding/Seleting/Editing Functions ####################
     ################################################################
 
@@ -182,7 +687,13 @@ class ArDa_DB_SQL(ArDa_DB):
             editors = doc_dict.pop("editor", None)
 
         # Inserting this row into the appropriate database
-        unused_keys = aux.insertIntoDB(doc_dict, table_name, self.db_path)
+        unused_keys = aux.insertIntoDB(doc_dict, table_name, self.db_path,
+                                        conn=self.get_conn(), schema=self.get_schema())
+        self.invalidate_tables(table_name)
+
+        # Linking new projects into the project closure
+        if table_name == "Projects":
+            self.add_proj_closure(doc_dict['proj_id'], doc_dict.get('parent_id', None))
 
         # Particular tweaks for "Documents" table insertion (after insertion)
         if table_name == "Documents":
@@ -198,9 +709,166 @@ class ArDa_DB_SQL(ArDa_DB):
             logging.debug(f"Unused keys in bib entry (ID={doc_dict['doc_id']}) insertion: "+\
                         f"{unused_keys}")
 
+    def add_table_records(self, doc_dicts, table_name = "Documents"):
+        """
+            Adds many records to one of the tables of the DB in a single transaction.
+            When adding documents, the doc_ids are allocated as a block and any
+            author/editor, 'full_path' and 'proj_id' (int or list) values are
+            inserted into Doc_Auth, Doc_Paths and Doc_Proj along with them.
+
+            :param doc_dicts: list of dictionaries whose keys are the fields of the
+                    table and whose values are the values to be added
+            :param table_name: string with the table to insert into
+
+            Returns: list with (for each dict passed) the standardized record that
+                    was inserted or None if that record was skipped
+        """
+        # Checking that this is a table we can insert records into
+        if table_name not in ['Documents', 'Projects', 'Doc_Proj', 'Doc_Paths',
+                                'Proj_Notes', 'Custom_Filters']:
+            warnings.warn(f"Table name ({table_name}) not recognized.")
+            return None
+        # Projects and filters are added rarely enough to just go one by one
+        if table_name in ['Projects', 'Custom_Filters']:
+            return [self.add_table_record(doc_dict, table_name) for doc_dict in doc_dicts]
+
+        # Grabbing the table columns once for all the records
+        conn = self.get_conn()
+        c = conn.cursor()
+        col_names = self.get_schema().get_table_cols(table_name)
+
+        # Standardizing all the records up front (setting aside the file paths and
+        #   projects of documents, which go in Doc_Paths and Doc_Proj, so they aren't
+        #   warned about as unrecognized fields)
+        link_keys = ['full_path', 'proj_id'] if table_name == "Documents" else []
+        std_dicts = []
+        for doc_dict in doc_dicts:
+            link_vals = {key.lower(): value for key, value in doc_dict.items() if key.lower() in link_keys}
+            std_dict = self.standardize_doc_dict_keys({key: value for key, value in doc_dict.items()
+                                                    if key.lower() not in link_keys}, table_name)
+            std_dict.update(link_vals)
+            std_dicts.append(std_dict)
+        doc_dicts = std_dicts
+
+        # Rows to be inserted into each table (and the result for each record)
+        ins_rows = {table_name: [], 'Doc_Auth': [], 'Doc_Paths': [], 'Doc_Proj': [],
+                    'Doc_Dup_Keys': []}
+        results = []
+        unused_keys = set()
+        if table_name == "Documents":
+            # Checking which of any passed doc_ids are already in use
+            passed_ids = [doc_dict['doc_id'] for doc_dict in doc_dicts if 'doc_id' in doc_dict]
+            used_ids = set()
+            for i in range(0, len(passed_ids), 500):
+                id_chunk = [aux.sqlValue(doc_id) for doc_id in passed_ids[i:i+500]]
+                c.execute(f"SELECT doc_id FROM Documents WHERE doc_id IN "+\
+                            f"({', '.join(['?']*len(id_chunk))})", id_chunk)
+                used_ids |= {row[0] for row in c.fetchall()}
+            # Reserving a block of ids for the new records (starting past any passed ids)
+            num_new = len(doc_dicts) - len(passed_ids)
+            next_id = self.reserve_ids("Documents", num_new,
+                                        min_id = max([1] + [doc_id+1 for doc_id in passed_ids]))
+
+            for doc_dict in doc_dicts:
+                # Check if doc_id is included (and not used) and assign one if not
+                if "doc_id" in doc_dict:
+                    if doc_dict["doc_id"] in used_ids:
+                        logging.debug(f"Cannot add a document with id {doc_dict['doc_id']} because it already exists in db")
+                        results.append(None)
+                        continue
+                else:
+                    doc_dict["doc_id"] = next_id
+                    next_id += 1
+                used_ids.add(doc_dict["doc_id"])
+                doc_dict = self.set_doc_defaults(doc_dict)
+                doc_id = doc_dict["doc_id"]
+
+                # Popping the values that belong in other tables
+                authors = doc_dict.pop("author", None)
+                editors = doc_dict.pop("editor", None)
+                full_path = doc_dict.pop("full_path", None)
+                proj_ids = doc_dict.pop("proj_id", None)
+
+                # Gathering the authors/editors (and their summaries in Documents)
+                auth_list = self.format_authors(authors)
+                for auth in auth_list:
+                    auth.update({'doc_id': doc_id, 'contribution': "Author"})
+                ins_rows['Doc_Auth'] += auth_list
+                doc_dict['author_lasts'] = ", ".join([auth['last_name'] for auth in auth_list])
+                if editors is not None:
+                    edit_list = self.format_authors(editors)
+                    for edit in edit_list:
+                        edit.update({'doc_id': doc_id, 'contribution': "Editor"})
+                    ins_rows['Doc_Auth'] += edit_list
+                    doc_dict['editor'] = "; ".join([edit['full_name'] for edit in edit_list])
+
+                # Gathering the file path and project associations
+                if (full_path is not None) and (full_path != ""):
+                    ins_rows['Doc_Paths'].append({'doc_id': doc_id, 'full_path': full_path})
+                if proj_ids is not None:
+                    if not isinstance(proj_ids, list): proj_ids = [proj_ids]
+                    ins_rows['Doc_Proj'] += [{'doc_id': doc_id, 'proj_id': proj_id}
+                                                for proj_id in proj_ids]
+
+                # Filtering the keys to just those in table columns (and getting unused)
+                unused_keys |= (set(doc_dict.keys()) - set(col_names))
+                ins_rows['Documents'].append({key: val for key, val in doc_dict.items()
+                                                if key in col_names})
+                # Gathering the keys used to find its duplicates
+                first_author = auth_list[0]['last_name'] if len(auth_list) > 0 else None
+                ins_rows['Doc_Dup_Keys'] += [{'doc_id': doc_id, 'key_type': key_type, 'key_value': key_value}
+                            for key_type, key_value in aux.getDupKeys(doc_dict, first_author)]
+                results.append(doc_dict)
+        else:
+            # Checking that each record includes the keys the table needs
+            req_keys = {'Doc_Proj': ['doc_id', 'proj_id'],
+                        'Doc_Paths': ['doc_id', 'full_path'],
+                        'Proj_Notes': ['doc_id', 'proj_id', 'proj_note']}[table_name]
+            for doc_dict in doc_dicts:
+                if any([key not in doc_dict for key in req_keys]):
+                    warnings.warn(f"Can't insert {doc_dict} into '{table_name}' without {req_keys}")
+                    results.append(None)
+                    continue
+                unused_keys |= (set(doc_dict.keys()) - set(col_names))
+                ins_rows[table_name].append({key: val for key, val in doc_dict.items()
+                                                if key in col_names})
+                results.append(doc_dict)
+
+        # Inserting all the rows in a single transaction
+        try:
+            for ins_table, rows in ins_rows.items():
+                if len(rows) == 0: continue
+                # Using the union of all keys (in order) so one statement covers every row
+                cols = list(dict.fromkeys([key for row in rows for key in row]))
+                c.executemany(aux.getInsertSQL(ins_table, tuple(cols)),
+                            [[aux.sqlValue(row.get(col, None)) for col in cols] for row in rows])
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            self.invalidate_tables(list(ins_rows.keys()))
+            warnings.warn(f"Bulk insertion into {table_name} failed and was rolled back: {e}")
+            return [None]*len(doc_dicts)
+        self.invalidate_tables([ins_table for ins_table, rows in ins_rows.items() if len(rows) > 0])
+
+        # Notification of any unused keys
+        if len(unused_keys) > 0:
+            logging.debug(f"Unused keys in bulk insertion into {table_name}: {unused_keys}")
+
+        return results
+
     def delete_table_record(self, cond_key, table_name):
         """ Removes the record(s) specified by cond_key from the specified table """
-        aux.deleteFromDB(cond_key, table_name, self.db_path, force_commit=True)
+        aux.deleteFromDB(cond_key, table_name, self.db_path, force_commit=True,
+                            conn=self.get_conn())
+        self.drop_cached_rows(table_name, cond_key)
+        if table_name == "Projects":
+            if list(cond_key.keys()) == ['proj_id']:
+                self.delete_proj_closure(cond_key['proj_id'])
+            else:
+                self.rebuild_proj_closure()
+        # Keeping the duplicate keys in step with the documents (and first authors)
+        if table_name in ["Documents", "Doc_Auth"]:
+            self.refresh_dup_keys([cond_key['doc_id']] if 'doc_id' in cond_key else None)
 
     def update_record(self, cond_dict, column_name, new_value, table_name = "Documents",
                             debug_print = False):
@@ -219,17 +887,67 @@ class ArDa_DB_SQL(ArDa_DB):
 
             Returns: (bool) indicating whether the change was successfully made
         """
-        return aux.updateDB(cond_dict, column_name, new_value, db_path=self.db_path, 
-                        table_name=table_name, debug_print=debug_print)
+        result = aux.updateDB(cond_dict, column_name, new_value, db_path=self.db_path,
+                        table_name=table_name, debug_print=debug_print,
+                        conn=self.get_conn())
+        # Changes to the field info (ie from the settings) require rebuilding the schema
+        if table_name == "Fields":
+            self.schema = None
+        # Keeping the project closure (and paths) in step with the project tree
+        if (table_name == "Projects") and (result is not None):
+            if column_name in ['parent_id', 'proj_id']:
+                if (column_name == 'parent_id') and (list(cond_dict.keys()) == ['proj_id']):
+                    self.move_proj_closure(cond_dict['proj_id'], new_value)
+                else:
+                    self.rebuild_proj_closure()
+            elif column_name == 'proj_text':
+                self.proj_path_cache = None
+        if ((table_name == "Documents") and (column_name in aux.DUP_KEY_FIELDS+['doc_id'])) or \
+                (table_name == "Doc_Auth"):
+            if 'doc_id' in cond_dict:
+                self.refresh_dup_keys([cond_dict['doc_id']] +
+                                        ([new_value] if column_name == 'doc_id' else []))
+            else:
+                self.refresh_dup_keys()
+        self.patch_cache_after_update(cond_dict, column_name, new_value, table_name, result)
+        return result
+
+    def patch_cache_after_update(self, cond_dict, column_name, new_value, table_name, result):
+        """
+            Mirrors an update (made through update_record) in the table cache, using
+            the value as it was actually stored in the db (ie after type affinity)
+        """
+        # Failed updates leave us unsure of the db state so we just drop the table
+        if (result is None) or (table_name not in self.table_cache):
+            self.invalidate_tables(table_name)
+            return
+        # Updates of a condition column (ie reassigning ids) can't be read back
+        if column_name in cond_dict:
+            self.patch_cached_table(table_name, cond_dict, column_name, aux.sqlValue(new_value))
+            return
+        # Read back the stored value (and modified date for documents)
+        read_cols = [column_name] + (['modified_date'] if table_name == "Documents" else [])
+        c = self.get_conn().cursor()
+        c.execute(f"SELECT {', '.join(read_cols)} FROM {table_name} WHERE "+\
+                    " AND ".join([f"{key} = ?" for key in cond_dict]),
+                    [aux.sqlValue(value) for value in cond_dict.values()])
+        stored_vals = c.fetchone()
+        c.close()
+        if stored_vals is None:
+            return      # No rows matched so nothing changed
+        self.patch_cached_table(table_name, cond_dict, column_name, stored_vals[0])
+        if table_name == "Documents":
+            self.patch_cached_table(table_name, cond_dict, 'modified_date', stored_vals[1])
 
     def delete_doc_record(self, doc_id):
         """ Removes the specified document record across all relevant tables """
         
         cond_key = {'doc_id':doc_id}
-        aux.deleteFromDB(cond_key, 'Documents', self.db_path, force_commit=True)
-        aux.deleteFromDB(cond_key, 'Doc_Paths', self.db_path, force_commit=True)
-        aux.deleteFromDB(cond_key, 'Doc_Auth', self.db_path, force_commit=True)
-        aux.deleteFromDB(cond_key, 'Doc_Proj', self.db_path, force_commit=True)
+        self.delete_table_record(cond_key, 'Documents')
+        self.delete_table_record(cond_key, 'Doc_Paths')
+        self.delete_table_record(cond_key, 'Doc_Auth')
+        self.delete_table_record(cond_key, 'Doc_Proj')
+        self.invalidate_bib_entries(doc_id)
 
     def delete_project(self, project_id, children_action = "reassign"):
         """
@@ -269,16 +987,21 @@ class ArDa_DB_SQL(ArDa_DB):
             # Iterate over all the associated documents and change their association to the parent
             proj_docs = self.get_projs_docs(project_id)
             logging.debug(f"Assigning docs {proj_docs} from project {project_id} to project {parent_id}")
+            parent_docs = set(self.get_projs_docs(parent_id))
             for doc_id in proj_docs:
+                # (memberships are unique, so docs already in the parent just leave this project)
+                if doc_id in parent_docs:
+                    self.delete_table_record({'proj_id': project_id, 'doc_id': doc_id}, "Doc_Proj")
+                    continue
                 self.update_record({'proj_id': project_id, 'doc_id': doc_id}, "proj_id", 
                                     new_value=parent_id, table_name="Doc_Proj")
         elif children_action == "delete":
             # Delete all associations with this project
             logging.debug(f"Deleting all docs {proj_docs} associations with project {project_id}")
-            aux.deleteFromDB({'proj_id': project_id}, "Doc_Proj", self.db_path, force_commit=True)
+            self.delete_table_record({'proj_id': project_id}, "Doc_Proj")
 
         # Delete the project entry
-        aux.deleteFromDB({'proj_id': project_id}, "Projects", self.db_path, force_commit=True)
+        self.delete_table_record({'proj_id': project_id}, "Projects")
 
     def update_authors(self, doc_id, authors, as_editors=False):
         """
@@ -298,22 +1021,24 @@ class ArDa_DB_SQL(ArDa_DB):
 
         # First we delete all the authors (or editors) currently associated with this doc
         del_cond_key = {'doc_id':doc_id, 'contribution':"Editor" if as_editors else "Author"}
-        aux.deleteFromDB(del_cond_key, 'Doc_Auth', self.db_path, force_commit=True)
+        self.delete_table_record(del_cond_key, 'Doc_Auth')
+        self.invalidate_bib_entries(doc_id)
         # Then add the authors back to the author table (assuming nonempty)
         if len(auth_list) > 0:
-            aux.insertIntoDB(auth_list, 'Doc_Auth', self.db_path)
+            aux.insertIntoDB(auth_list, 'Doc_Auth', self.db_path, conn=self.get_conn(),
+                                schema=self.get_schema())
+            self.invalidate_tables('Doc_Auth')
+            self.refresh_dup_keys([doc_id])
 
         # Updating the Documents table
         if not as_editors:
             # Creating list of last names for authors
             last_names = ", ".join([auth['last_name'] for auth in auth_list])
-            aux.updateDB({'doc_id':doc_id}, column_name="author_lasts", new_value=last_names, 
-                        db_path=self.db_path, table_name= "Documents")
+            self.update_record({'doc_id':doc_id}, column_name="author_lasts", new_value=last_names)
         else:
             # Creating list of full names for editors
             full_names = "; ".join([auth['full_name'] for auth in auth_list])
-            aux.updateDB({'doc_id':doc_id}, column_name="editor",
-                            new_value=full_names, db_path=self.db_path)
+            self.update_record({'doc_id':doc_id}, column_name="editor", new_value=full_names)
 
     def merge_doc_records(self, doc_id_1, doc_id_2, value_dict, id_dict = None,
                         proj_union = True):
@@ -338,8 +1063,7 @@ class ArDa_DB_SQL(ArDa_DB):
         other_doc_id = (doc_id_2 if (doc_id_1 == bdoc_id) else doc_id_1)
 
         # Grabbing the fields in the Documents table
-        doc_field_df = self.get_table("Fields")
-        doc_field_df = doc_field_df[doc_field_df['table_name']=="Documents"]
+        doc_field_df = self.get_schema().get_field_df("Documents")
 
         # Dealing with Documents table (iterate over it's fields)
         cond_key = {'doc_id':bdoc_id}
@@ -349,38 +1073,42 @@ class ArDa_DB_SQL(ArDa_DB):
             if field in skip_fields:    continue
             # Update with value in value_dict if it is there
             if field in value_dict:
-                aux.updateDB(cond_key, field, value_dict[field], self.db_path)
+                self.update_record(cond_key, field, value_dict[field])
                 # self.updateDocViewCell(bdoc_id, row['header_text'], value_dict[field])
 
         # Dealing with Authors (only need to if chose the other doc's authors)
         if ('author_lasts' in id_dict) and (id_dict['author_lasts'] != bdoc_id):
             # First we remove the old author information (associated with bdoc_id)
-            aux.deleteFromDB({'doc_id':bdoc_id, 'contribution':"Author"}, 
-                            "Doc_Auth", self.db_path, force_commit=True)
+            self.delete_table_record({'doc_id':bdoc_id, 'contribution':"Author"}, "Doc_Auth")
             # Then we copy the author info (from other_doc_id) over to the base doc id
-            aux.updateDB({'doc_id': other_doc_id, 'contribution':"Author"}, 
-                        'doc_id', bdoc_id, self.db_path, table_name='Doc_Auth')
+            self.update_record({'doc_id': other_doc_id, 'contribution':"Author"}, 
+                        'doc_id', bdoc_id, table_name='Doc_Auth')
         
         # Dealing with Editors (only need to if chose the other doc's editors)
         if ('editor' in id_dict) and (id_dict['editor'] != bdoc_id):
             # First we remove the old editor information (associated with bdoc_id)
-            aux.deleteFromDB({'doc_id':bdoc_id, 'contribution':"Editor"}, 
-                            "Doc_Auth", self.db_path, force_commit=True)
+            self.delete_table_record({'doc_id':bdoc_id, 'contribution':"Editor"}, "Doc_Auth")
             # Then we copy the author info (from other_doc_id) over to the base doc id
-            aux.updateDB({'doc_id': other_doc_id, 'contribution':"Editor"}, 
-                        'doc_id', bdoc_id, self.db_path, table_name='Doc_Auth')
+            self.update_record({'doc_id': other_doc_id, 'contribution':"Editor"}, 
+                        'doc_id', bdoc_id, table_name='Doc_Auth')
 
         # Dealing with Doc_Paths (only need to if chose the other doc's filepaths)
         if ('file_path' in id_dict) and (id_dict['file_path'] != bdoc_id):
             # First we remove the old file path information (associated with bdoc_id)
-            aux.deleteFromDB(cond_key, "Doc_Paths", self.db_path, force_commit=True)
+            self.delete_table_record(cond_key, "Doc_Paths")
             # Then we copy the author info (from other_doc_id) over to the base doc id
-            aux.updateDB({'doc_id': other_doc_id}, 'doc_id', bdoc_id, self.db_path, table_name='Doc_Paths')
+            self.update_record({'doc_id': other_doc_id}, 'doc_id', bdoc_id,
+                        table_name='Doc_Paths')
 
         # Dealing with Doc_Proj (if membership union is specified)
         if proj_union:
-            # Copy the project membership of the other document
-            aux.updateDB({'doc_id': other_doc_id}, 'doc_id', bdoc_id, self.db_path, table_name='Doc_Proj')
+            # Copy the project membership of the other document (besides the
+            #   projects the base document is already in, as memberships are unique)
+            for proj_id in self.get_table("Doc_Proj", columns=['proj_id'],
+                                            where={'doc_id': bdoc_id})['proj_id'].tolist():
+                self.delete_table_record({'doc_id': other_doc_id, 'proj_id': proj_id}, "Doc_Proj")
+            self.update_record({'doc_id': other_doc_id}, 'doc_id', bdoc_id,
+                        table_name='Doc_Proj')
 
         # Finally we delete any remnants of the old bib entry
         self.delete_doc_record(other_doc_id)
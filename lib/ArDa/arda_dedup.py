@@ -0,0 +1,265 @@
+# This file holds the library-wide near-duplicate detection (MinHash signatures
+#   with LSH banding) used to find clusters of documents which may be duplicates
+
+import re, zlib, unicodedata, logging
+import numpy as np
+
+# Characters dropped when normalizing text (see normalizeText)
+DROPPED_CHARS = re.compile(r"[^\w\s]|_")
+# Bits per character in the codes of title shingles (enough for any unicode point)
+CHAR_BITS = 21
+
+def normalizeText(text):
+    """
+        Lowercases text and drops accents and punctuation (like aux.normalizeDupText)
+        but keeps the word breaks, as single spaces
+    """
+    text = DROPPED_CHARS.sub("", unicodedata.normalize('NFKD', text).lower())
+    return " ".join(text.split())
+
+def shingleCodes(titles, author_lasts, years, k = 3):
+    """
+        Returns integer codes of the shingles of each document, ie the character
+        k-grams of its (normalized) title along with tokens for its authors' last
+        names and year. Character shingles keep OCR-mangled or reworded titles
+        largely overlapping. Title k-grams are coded straight from their characters
+        (for all the documents at once) while the few other tokens are hashed.
+
+        :param titles: list of the document titles (may be null)
+        :param author_lasts: list of the comma separated author last names (may be null)
+        :param years: list of the document years (int, str or null)
+        :param k: int of the length of the title shingles (at most 3)
+
+        Returns: tuple of arrays of the document (row) of each shingle and its code
+    """
+    num_docs = len(titles)
+    title_texts = [normalizeText(title) if isinstance(title, str) else "" for title in titles]
+
+    # Coding every k-gram of the joined titles, where the (null) separators mark
+    #   the k-grams spanning two titles, which are dropped
+    chars = np.frombuffer("\x00".join(title_texts).encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+    char_rows = np.repeat(np.arange(num_docs), [len(text)+1 for text in title_texts])[:len(chars)]
+    num_grams = max(len(chars)-k+1, 0)
+    codes = np.zeros(num_grams, dtype=np.uint64)
+    valid = np.ones(num_grams, dtype=bool)
+    for j in range(k):
+        codes |= chars[j:j+num_grams] << np.uint64(CHAR_BITS*(k-1-j))
+        valid &= chars[j:j+num_grams] != 0
+    title_rows, title_codes = char_rows[:num_grams][valid], codes[valid]
+
+    # Hashing the other tokens (setting the top bit so they can't match a k-gram)
+    token_rows, token_codes = [], []
+    for row, (text, auths, year) in enumerate(zip(title_texts, author_lasts, years)):
+        tokens = ["t:"+text] if 0 < len(text) < k else []    # Titles too short for k-grams
+        if isinstance(auths, str):
+            tokens += ["a:"+last.replace(" ", "") for last in normalizeText(auths).split(",")
+                        if last.strip() != ""]
+        if (year is not None) and not (isinstance(year, float) and np.isnan(year)):
+            year = str(year).strip()
+            if year.endswith(".0"): year = year[:-2]     # ie years read back as floats
+            if year != "": tokens.append("y:"+year)
+        token_rows += [row]*len(tokens)
+        token_codes += [zlib.crc32(token.encode('utf8')) | (1 << 63) for token in tokens]
+
+    return (np.concatenate([title_rows, np.array(token_rows, dtype=title_rows.dtype)]),
+            np.concatenate([title_codes, np.array(token_codes, dtype=np.uint64)]))
+
+def minHashSignatures(shingle_rows, shingle_codes, num_docs, num_perm = 64, seed = 1,
+                        chunk_size = 250000):
+    """
+        Returns the MinHash signatures (an array of shape (num_docs, num_perm)) of
+        the documents' shingles. Rows of documents without shingles are left at the
+        max value.
+
+        :param shingle_rows: array of the document (row) of each shingle
+        :param shingle_codes: array of the (uint64) code of each shingle
+        :param num_docs: int of the number of documents
+        :param num_perm: int of the number of hash functions (ie signature length)
+        :param seed: int seeding the hash functions
+        :param chunk_size: int of the (rough) number of shingles hashed together (bounds memory)
+    """
+    # Multiply-shift hashes, ie the top 32 bits of a*x + b (wrapping around at 64 bits)
+    rng = np.random.RandomState(seed)
+    hash_a = (rng.randint(0, 1 << 62, size=(num_perm, 1), dtype=np.int64).astype(np.uint64)
+                << np.uint64(1)) | np.uint64(1)
+    hash_b = rng.randint(0, 1 << 62, size=(num_perm, 1), dtype=np.int64).astype(np.uint64)
+    signatures = np.full((num_docs, num_perm), np.iinfo(np.uint32).max, dtype=np.uint64)
+    if len(shingle_codes) == 0:
+        return signatures
+
+    # Ordering the shingles by document and finding where each document's start and end
+    order = np.argsort(shingle_rows, kind='stable')
+    shingle_rows, shingle_codes = shingle_rows[order], shingle_codes[order]
+    doc_starts = np.flatnonzero(np.r_[True, shingle_rows[1:] != shingle_rows[:-1]])
+    doc_ends = np.r_[doc_starts[1:], len(shingle_rows)]
+
+    # Hashing whole documents at a time and taking the minimum within each document
+    first = 0
+    while first < len(doc_starts):
+        last = max(np.searchsorted(doc_ends, doc_starts[first] + chunk_size, side='right'), first+1)
+        start, end = doc_starts[first], doc_ends[last-1]
+        hashed = (hash_a * shingle_codes[np.newaxis, start:end] + hash_b) >> np.uint64(32)
+        signatures[shingle_rows[doc_starts[first:last]]] = \
+            np.minimum.reduceat(hashed, doc_starts[first:last] - start, axis=1).T
+        first = last
+    return signatures
+
+def lshCandidatePairs(signatures, bands = 16, max_bucket_size = 50):
+    """
+        Returns the set of (row_i, row_j) pairs (with row_i < row_j) whose signatures
+        match on every row of at least one band, ie the candidate duplicates
+
+        :param signatures: array of MinHash signatures (one row per document)
+        :param bands: int of the number of bands (must divide the signature length)
+        :param max_bucket_size: int of the most rows paired within a bucket. Larger
+                buckets (made by very common shingles, eg short titles) are split by
+                re-keying them on more rows of the signatures (see splitBucket).
+    """
+    num_docs, num_perm = signatures.shape
+    rows_per_band = num_perm // bands
+    # Random odd multipliers folding the rows of a band into a single bucket key
+    band_mults = np.random.RandomState(0).randint(1, 1 << 62, size=rows_per_band,
+                                                    dtype=np.int64).astype(np.uint64) | np.uint64(1)
+    candidates = set()
+    num_split, num_linked = 0, 0
+    for band in range(bands):
+        band_sigs = signatures[:, band*rows_per_band:(band+1)*rows_per_band]
+        # Grouping the rows which share the band's values (ie land in the same bucket)
+        bucket_keys = (band_sigs * band_mults).sum(axis=1)  # (wraps around on overflow)
+        _, bucket_ids, bucket_sizes = np.unique(bucket_keys, return_inverse=True, return_counts=True)
+        bucket_ids = bucket_ids.ravel()
+        shared_rows = np.flatnonzero(bucket_sizes[bucket_ids] > 1)
+        if len(shared_rows) == 0: continue
+        shared_rows = shared_rows[np.argsort(bucket_ids[shared_rows], kind='stable')]
+        bounds = np.flatnonzero(np.diff(bucket_ids[shared_rows])) + 1
+        for bucket in np.split(shared_rows, bounds):
+            groups, identical = [bucket], []
+            if len(bucket) > max_bucket_size:
+                num_split += 1
+                groups, identical = splitBucket(signatures, bucket, band*rows_per_band,
+                                                rows_per_band, max_bucket_size)
+            for group in groups:
+                for i in range(len(group)):
+                    for j in range(i+1, len(group)):
+                        candidates.add((int(min(group[i], group[j])), int(max(group[i], group[j]))))
+            # Rows with identical signatures are only linked to the first of them
+            #   (which joins them into the same cluster just the same)
+            for group in identical:
+                num_linked += len(group)
+                candidates.update([(int(min(group[0], row)), int(max(group[0], row))) for row in group[1:]])
+    if num_split > 0:
+        logging.debug(f"Split {num_split} crowded LSH buckets (of more than {max_bucket_size} documents), "+
+                        f"linking {num_linked} documents with identical signatures.")
+    return candidates
+
+def splitBucket(signatures, bucket, first_col, num_cols, max_bucket_size):
+    """
+        Splits a crowded LSH bucket by re-keying its rows on more (ie doubling)
+        rows of their signatures until each sub-bucket holds at most max_bucket_size
+        rows or the whole signatures are used
+
+        :param signatures: array of MinHash signatures (one row per document)
+        :param bucket: array of the rows in the bucket
+        :param first_col: int of the first signature row of the bucket's band
+        :param num_cols: int of the number of signature rows of the band
+        :param max_bucket_size: int of the most rows in a sub-bucket
+
+        Returns: tuple of the list of the sub-buckets (arrays of rows, with more than
+                    one row) and the list of the sub-buckets still too large, whose
+                    rows have identical signatures
+    """
+    num_perm = signatures.shape[1]
+    groups, crowded = [], [bucket]
+    while (len(crowded) > 0) and (num_cols < num_perm):
+        num_cols = min(2*num_cols, num_perm)
+        cols = (first_col + np.arange(num_cols)) % num_perm
+        still_crowded = []
+        for rows in crowded:
+            _, keys = np.unique(signatures[np.ix_(rows, cols)], axis=0, return_inverse=True)
+            keys = keys.ravel()
+            rows = rows[np.argsort(keys, kind='stable')]
+            for sub_bucket in np.split(rows, np.flatnonzero(np.diff(np.sort(keys))) + 1):
+                if len(sub_bucket) > max_bucket_size:
+                    still_crowded.append(sub_bucket)
+                elif len(sub_bucket) > 1:
+                    groups.append(sub_bucket)
+        crowded = still_crowded
+    return groups, crowded
+
+def shingleSets(shingle_rows, shingle_codes, num_docs):
+    """
+        Returns a function giving the sorted array of the unique shingle codes of a
+        document (for exact Jaccard similarities)
+
+        :param shingle_rows: array of the document (row) of each shingle
+        :param shingle_codes: array of the (uint64) code of each shingle
+        :param num_docs: int of the number of documents
+    """
+    order = np.lexsort((shingle_codes, shingle_rows))
+    rows, codes = shingle_rows[order], shingle_codes[order]
+    keep = np.r_[True, (rows[1:] != rows[:-1]) | (codes[1:] != codes[:-1])][:len(rows)]
+    rows, codes = rows[keep], codes[keep]
+    starts = np.searchsorted(rows, np.arange(num_docs+1))
+    return lambda row: codes[starts[row]:starts[row+1]]
+
+def jaccardSimilarity(codes_i, codes_j):
+    """ Returns the Jaccard similarity of two sorted arrays of unique shingle codes """
+    num_shared = len(np.intersect1d(codes_i, codes_j, assume_unique=True))
+    num_total = len(codes_i) + len(codes_j) - num_shared
+    return num_shared / num_total if num_total > 0 else 0.0
+
+def findDuplicateClusters(doc_ids, titles, author_lasts, years, threshold = 0.5,
+                            num_perm = 64, bands = 16):
+    """
+        Finds clusters of near-duplicate documents (eg a preprint and its published
+        version) without comparing every pair: MinHash signatures of each document's
+        shingles are banded (LSH) to find candidate pairs, which are kept if their
+        estimated and then their exact (Jaccard) similarity reach the threshold and
+        are then joined into clusters.
+
+        :param doc_ids: list of the doc ids
+        :param titles/author_lasts/years: lists of the documents' values (same order)
+        :param threshold: float of the minimum similarity of a pair
+        :param num_perm: int of the signature length
+        :param bands: int of the number of LSH bands
+
+        Returns: list of (list of doc ids, float of the lowest similarity linking them)
+                    tuples, sorted by descending similarity
+    """
+    doc_ids = list(doc_ids)
+    shingle_rows, shingle_codes = shingleCodes(list(titles), list(author_lasts), list(years))
+    signatures = minHashSignatures(shingle_rows, shingle_codes, len(doc_ids), num_perm)
+
+    # Scoring the candidate pairs (ignoring those of documents without shingles)
+    has_shingles = np.zeros(len(doc_ids), dtype=bool)
+    has_shingles[shingle_rows] = True
+    parents = list(range(len(doc_ids)))
+    def find_root(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+    pairs = np.array(sorted(lshCandidatePairs(signatures, bands)), dtype=np.int64).reshape(-1, 2)
+    pairs = pairs[has_shingles[pairs[:, 0]] & has_shingles[pairs[:, 1]]]
+    # Screening the pairs on their estimated similarity (the exact one confirms them below)
+    estimated = np.concatenate([np.zeros(0)] + [(signatures[chunk[:, 0]] == signatures[chunk[:, 1]]).mean(axis=1)
+                                                for chunk in np.split(pairs, range(100000, len(pairs), 100000))])
+    doc_shingles = shingleSets(shingle_rows, shingle_codes, len(doc_ids))
+    link_scores = {}
+    for i, j in pairs[estimated >= threshold].tolist():
+        root_i, root_j = find_root(i), find_root(j)
+        if root_i == root_j: continue
+        score = jaccardSimilarity(doc_shingles(i), doc_shingles(j))
+        if score < threshold: continue
+        # Joining the two clusters (union-find) and tracking their weakest link
+        parents[root_j] = root_i
+        link_scores[root_i] = min(score, link_scores.pop(root_i, 1.0), link_scores.pop(root_j, 1.0))
+
+    # Gathering the members of each cluster
+    clusters = {}
+    for i in range(len(doc_ids)):
+        root = find_root(i)
+        if root in link_scores:
+            clusters.setdefault(root, []).append(doc_ids[i])
+    clusters = [(sorted(members), link_scores[root]) for root, members in clusters.items()]
+    return sorted(clusters, key = lambda cluster: (-cluster[1], cluster[0]))
@@ -0,0 +1,277 @@
+# This defines a class which combines the filters (project, dialog, custom and search) of the document view
+
+import re
+import numpy as np
+
+class ArDa_Filter_Engine:
+    """
+        Holds each filter (ie facet) of the document view as a boolean mask aligned
+        to the rows of the table model. The rows shown are those no facet rejects,
+        tracked with a count per row of the facets rejecting it, so changing one
+        facet only touches that facet's mask.
+    """
+
+    # Facets in the order they are described in the current subset label
+    FACETS = ['project', 'filter', 'custom', 'search']
+
+    def __init__(self, doc_ids = None):
+        """
+            :param doc_ids: array of the document id of each row of the table model
+        """
+        self.facet_ids = {}         # Doc ids kept by each active facet
+        self.facet_masks = {}       # Rows kept by each active facet
+        self.descriptions = {}      # Description of each active facet
+        self.set_doc_ids(np.array([]) if doc_ids is None else doc_ids)
+
+    def set_doc_ids(self, doc_ids):
+        """
+            Realigns the facets to new rows (eg after rows were added or removed)
+
+            :param doc_ids: array of the document id of each row of the table model
+        """
+        self.doc_ids = doc_ids
+        self.reject_counts = np.zeros(len(doc_ids), dtype=np.int8)
+        for facet, facet_ids in self.facet_ids.items():
+            self.facet_masks[facet] = np.isin(doc_ids, facet_ids)
+            self.reject_counts += ~self.facet_masks[facet]
+        self.shown_mask = self.reject_counts == 0
+
+    def set_facet(self, facet, doc_ids, description = ""):
+        """
+            Sets the documents kept by a facet
+
+            :param facet: str of the facet (see FACETS)
+            :param doc_ids: collection (eg set or list) of the doc ids kept by the
+                    facet (None clears the facet, ie keeps every document)
+            :param description: str describing the facet (for the subset label)
+
+            Returns: array of the rows whose visibility changed
+        """
+        if facet not in self.FACETS:
+            raise ValueError(f"Filter facet ({facet}) not recognized.")
+        old_shown = self.shown_mask
+        # Swapping out only this facet's rejections
+        if facet in self.facet_masks:
+            self.reject_counts -= ~self.facet_masks.pop(facet)
+            del self.facet_ids[facet]
+            del self.descriptions[facet]
+        if doc_ids is not None:
+            self.facet_ids[facet] = np.array(list(doc_ids))
+            self.facet_masks[facet] = np.isin(self.doc_ids, self.facet_ids[facet])
+            self.reject_counts += ~self.facet_masks[facet]
+            self.descriptions[facet] = description
+        self.shown_mask = self.reject_counts == 0
+        return np.flatnonzero(old_shown != self.shown_mask)
+
+    def clear_facet(self, facet):
+        """ Clears a facet (returning the rows whose visibility changed) """
+        return self.set_facet(facet, None)
+
+    def clear_all(self):
+        """ Clears every facet (returning the rows whose visibility changed) """
+        changed_rows = np.flatnonzero(~self.shown_mask)
+        self.facet_ids, self.facet_masks, self.descriptions = {}, {}, {}
+        self.reject_counts[:] = 0
+        self.shown_mask = self.reject_counts == 0
+        return changed_rows
+
+    def is_filtered(self, facet = None):
+        """ Returns whether the facet (or any facet if None) is active """
+        return (len(self.facet_masks) > 0) if facet is None else (facet in self.facet_masks)
+
+    def get_shown_mask(self):
+        """ Returns the boolean array of which rows are shown """
+        return self.shown_mask
+
+    def get_shown_ids(self):
+        """ Returns the set of doc ids shown """
+        return set(self.doc_ids[self.get_shown_mask()].tolist())
+
+    def get_label_text(self):
+        """ Returns the text describing the current subset (eg for the filter label) """
+        return "Current subset:" + "".join([f" {facet} ({self.descriptions[facet]});"
+                                            for facet in self.FACETS if facet in self.descriptions])
+
+## Custom Filter Code #######################################################
+# Custom filters (the Custom_Filters table) hold small expressions over the fields
+#   of Documents which are compiled into parameterized sql conditions, eg:
+#       read == false
+#       year in 2010..2015 and not (journal contains "arxiv" or doi == null)
+#       project == "Thesis" and author contains 'smith'
+#   Fields may be given by their name or (lowercase) header text. Comparing a
+#   (non boolean) field with true/false checks whether it has a value (eg 'read'
+#   is true for documents with a read date) and 'project' matches the documents
+#   of a project (given by its id or name).
+
+FILTER_TOKENS = re.compile(r"""\s*(?:(?P<string>"[^"]*"|'[^']*')|(?P<number>-?\d+(?:\.\d+)?(?!\.\d))|
+                            (?P<op>==|!=|<=|>=|=|<|>|\.\.|\(|\))|(?P<word>\w+))""", re.VERBOSE)
+FILTER_OPS = {'==': '=', '=': '=', '!=': '!=', '<': '<', '<=': '<=', '>': '>', '>=': '>='}
+FILTER_CONSTS = {'true': True, 'false': False, 'null': None, 'none': None}
+
+def tokenizeFilterCode(filter_code):
+    """
+        Splits filter code into a list of (kind, value) tokens, where kind is one
+        of 'string', 'number', 'op' or 'word' (words are lowercased)
+    """
+    tokens, pos = [], 0
+    filter_code = filter_code.rstrip()
+    while pos < len(filter_code):
+        match = FILTER_TOKENS.match(filter_code, pos)
+        if match is None:
+            raise ValueError(f"Unexpected character in filter code at position {pos}: {filter_code[pos:pos+10]!r}")
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'string':
+            value = value[1:-1]
+        elif kind == 'number':
+            value = float(value) if "." in value else int(value)
+        elif kind == 'word':
+            value = value.lower()
+        tokens.append((kind, value))
+        pos = match.end()
+    return tokens
+
+def compileFilterCode(filter_code, schema, cascade = False):
+    """
+        Compiles custom filter code into a condition on the Documents table
+
+        :param filter_code: str of the filter expression (see above)
+        :param schema: ArDa_Schema of the db (to resolve field names)
+        :param cascade: boolean indicating whether project conditions include the
+                documents of sub-projects
+
+        Returns: tuple of (str of the sql condition, list of its parameter values),
+                    or None if the code is empty (ie the filter keeps everything)
+    """
+    tokens = tokenizeFilterCode(filter_code)
+    if len(tokens) == 0:
+        return None
+    fields = set(schema.get_fields("Documents"))
+    header_to_field = schema.get_header_to_field("Documents", lower = True)
+    params = []
+    pos = 0
+
+    def peek(offset = 0):
+        return tokens[pos+offset] if pos+offset < len(tokens) else (None, None)
+
+    def take(kind = None, value = None):
+        nonlocal pos
+        token = peek()
+        if (token[0] is None) or ((kind is not None) and (token[0] != kind)) or \
+                ((value is not None) and (token[1] != value)):
+            expected = value if value is not None else (kind if kind is not None else "more code")
+            found = "the end" if token[0] is None else repr(token[1])
+            raise ValueError(f"Expected {expected} in filter code but found {found}.")
+        pos += 1
+        return token[1]
+
+    def parse_or():
+        conds = [parse_and()]
+        while peek() == ('word', 'or'):
+            take()
+            conds.append(parse_and())
+        return conds[0] if len(conds) == 1 else "(" + " OR ".join(conds) + ")"
+
+    def parse_and():
+        conds = [parse_not()]
+        while peek() == ('word', 'and'):
+            take()
+            conds.append(parse_not())
+        return conds[0] if len(conds) == 1 else "(" + " AND ".join(conds) + ")"
+
+    def parse_not():
+        if peek() == ('word', 'not'):
+            take()
+            return f"NOT COALESCE({parse_not()}, 0)"     # (null conditions count as false)
+        if peek() == ('op', '('):
+            take()
+            cond = parse_or()
+            take('op', ')')
+            return cond
+        return parse_condition()
+
+    def parse_value():
+        kind, value = peek()
+        if kind in ['string', 'number']:
+            return take()
+        if (kind == 'word') and (value in FILTER_CONSTS):
+            take()
+            return FILTER_CONSTS[value]
+        raise ValueError(f"Expected a value in filter code but found {'the end' if kind is None else repr(value)}.")
+
+    def parse_condition():
+        name = take('word')
+        if name == 'project':
+            return project_condition()
+        field = name if name in fields else header_to_field.get(name, None)
+        if field is None:
+            raise ValueError(f"Field ({name}) in filter code not recognized.")
+        kind, value = peek()
+        # A bare (boolean) field is the same as comparing it to true
+        if (kind is None) or ((kind == 'word') and (value in ['and', 'or'])) or (value == ')'):
+            return compare(field, '=', True)
+        if value == 'contains':
+            take()
+            text = str(parse_value())
+            params.append("%" + re.sub(r"([\\%_])", r"\\\1", text) + "%")
+            return f"`{field}` LIKE ? ESCAPE '\\'"
+        if value in ['in', 'between']:
+            take()
+            low = parse_value()
+            if value == 'in':
+                take('op', '..')
+            else:
+                take('word', 'and')
+            high = parse_value()
+            params.extend([low, high])
+            return f"`{field}` BETWEEN ? AND ?"
+        if (kind == 'op') and (value in FILTER_OPS):
+            take()
+            return compare(field, FILTER_OPS[value], parse_value())
+        raise ValueError(f"Expected a comparison after {name} in filter code.")
+
+    def compare(field, op, value):
+        if (value is None) or isinstance(value, bool):
+            if op not in ['=', '!=']:
+                raise ValueError("Filter code can only compare true, false or null with == or !=.")
+        if value is None:
+            return f"`{field}` IS {'NOT ' if op == '!=' else ''}NULL"
+        if isinstance(value, bool):
+            if schema.get_var_type("Documents", field) == 'boolean':
+                # Booleans are stored as their strings
+                params.append("True")
+                is_true = f"`{field}` = ?"
+            else:
+                is_true = f"(`{field}` IS NOT NULL AND `{field}` != '')"
+            return is_true if (value == (op == '=')) else f"NOT COALESCE({is_true}, 0)"
+        params.append(value)
+        collate = " COLLATE NOCASE" if isinstance(value, str) else ""
+        if op == '!=':      # Documents without a value also differ from it
+            return f"(`{field}` IS NULL OR `{field}` != ?{collate})"
+        return f"`{field}` {op} ?{collate}"
+
+    def project_condition():
+        negate = False
+        if peek() == ('op', '!='):
+            negate = True
+            take()
+        elif peek()[1] in ['==', '=', 'in']:
+            take()
+        else:
+            raise ValueError("Expected ==, != or in after project in filter code.")
+        value = parse_value()
+        proj_cond = "proj_id = ?" if isinstance(value, int) else \
+                    "proj_id IN (SELECT proj_id FROM Projects WHERE proj_text = ? COLLATE NOCASE)"
+        params.append(value)
+        if cascade:
+            proj_cond = proj_cond.replace("proj_id", "ancestor_id", 1)
+            docs = f"""SELECT dp.doc_id FROM Doc_Proj AS dp JOIN Project_Closure AS pc
+                        ON dp.proj_id = pc.descendant_id WHERE pc.{proj_cond}"""
+        else:
+            docs = f"SELECT doc_id FROM Doc_Proj WHERE {proj_cond}"
+        return f"doc_id {'NOT ' if negate else ''}IN ({docs})"
+
+    condition = parse_or()
+    if pos != len(tokens):
+        raise ValueError(f"Unexpected {tokens[pos][1]!r} in filter code.")
+    return condition, params
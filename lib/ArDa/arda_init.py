@@ -21,7 +21,8 @@ def init_user():
     config_file["General Properties"]={
             "start_up_check_watched_folders": "False",
             "project_selection_cascade": "True",
-            "file_found_action" : "Do Nothing"
+            "file_found_action" : "Do Nothing",
+            "paged_min_docs": 50000
             }
     config_file["Data Sources"]={
             "db_path": root_path+"\\user\\user_db.sqlite",
@@ -53,8 +54,8 @@ def init_user():
     logging.debug(f"Creating new empty sql lite db at: {db_path}")
     blank_db.make_new_db(db_path)
 
-    # Opening connection to new DB to add app specific tables
-    conn = sqlite3.connect(db_path)
+    # Grabbing the new DB's connection to add app specific tables
+    conn = blank_db.get_conn()
     c = conn.cursor()
 
     # Creating the custom filters table and filling it with defaults
@@ -76,7 +77,6 @@ def init_user():
     insert_stmt = "INSERT INTO Fields VALUES(?,?,?,?,?,?,?,?,?,?,?,?)"
     c.executemany(insert_stmt, field_data)
     conn.commit()
-    conn.close()
 
     # Add a few documents to start the DB off with something in it
     blank_db.add_table_record({'doc_type': 'article',
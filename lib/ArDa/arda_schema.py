@@ -0,0 +1,104 @@
+# This defines a class which holds the field information (ie the schema) of an ArDa database
+
+import pandas as pd
+
+class ArDa_Schema:
+    """
+        Registry of the field information of an opened db (built once from the
+        Fields table) so that key normalization and column lookups are simple
+        dictionary lookups rather than repeated reads of Fields.csv or the db.
+    """
+
+    def __init__(self, field_df, table_cols = None):
+        """
+            :param field_df: DataFrame with the field info (as found in Fields.csv)
+            :param table_cols: dictionary whose keys are table names and values
+                    are the list of columns actually in that table of the db
+        """
+        self.field_df = field_df.copy()
+        self.table_cols = {} if table_cols is None else table_cols
+        self.field_to_header = {}
+        self.header_to_field = {}
+        self.lower_header_to_field = {}
+        self.var_types = {}
+        self.key_maps = {}
+        # Building the maps of each table
+        for table_name, table_fields in self.field_df.groupby('table_name', sort=False):
+            headers = [header if isinstance(header, str) else None for header in table_fields.header_text]
+            self.field_to_header[table_name] = dict(zip(table_fields.field, headers))
+            self.header_to_field[table_name] = {header: field for header, field
+                                in zip(headers, table_fields.field) if header is not None}
+            self.lower_header_to_field[table_name] = {header.lower(): field for header, field
+                                in self.header_to_field[table_name].items()}
+            self.var_types[table_name] = dict(zip(table_fields.field, table_fields.var_type))
+
+    def get_field_df(self, table_name = None):
+        """ Returns (a copy of) the field info of one table (or all if None passed) """
+        if table_name is None:
+            return self.field_df.copy()
+        return self.field_df[self.field_df.table_name == table_name].copy()
+
+    def get_fields(self, table_name):
+        """ Returns the list of fields of the table (as listed in the field info) """
+        return list(self.field_to_header.get(table_name, {}).keys())
+
+    def get_field_to_header(self, table_name):
+        """ Returns a dictionary mapping the fields of the table to their header text """
+        return self.field_to_header.get(table_name, {})
+
+    def get_header_to_field(self, table_name, lower = False):
+        """
+            Returns a dictionary mapping the header text of the table to their fields
+
+            :param lower: boolean indicating whether the header text keys should be lowercase
+        """
+        if lower:
+            return self.lower_header_to_field.get(table_name, {})
+        return self.header_to_field.get(table_name, {})
+
+    def get_var_type(self, table_name, field):
+        """ Returns the variable type of the field (or None if not found) """
+        return self.var_types.get(table_name, {}).get(field, None)
+
+    def get_table_cols(self, table_name):
+        """ Returns the list of columns of the table in the db (falls back on the fields) """
+        if table_name in self.table_cols:
+            return self.table_cols[table_name]
+        return self.get_fields(table_name)
+
+    def get_display_order(self, table_name = "Documents", order_col = 'doc_table_order'):
+        """
+            Returns the header text of the table's fields sorted by their display order
+            (with hidden fields, ie an order of -1, at the end) and the set of those hidden
+
+            :param order_col: str of the column in the field info holding the order
+        """
+        table_fields = self.field_df[self.field_df.table_name == table_name].copy()
+        hidden = set(table_fields[table_fields[order_col] == -1].header_text)
+        table_fields.loc[table_fields[order_col] == -1, order_col] = 1000
+        display_order = table_fields.sort_values(order_col, kind='stable')['header_text'].tolist()
+        return display_order, hidden
+
+    def get_key_map(self, key_format, table_name = None):
+        """
+            Returns the key mapping used by aux.convertBibEntryKeys (built once)
+
+            :param key_format: str either 'bib' (header to field) or 'header' (field to header)
+            :param table_name: str of the table whose fields are mapped (None uses all tables)
+
+            Returns: tuple of (dict of old key to new key, set of all keys in the new format)
+        """
+        if (key_format, table_name) not in self.key_maps:
+            field_df = self.get_field_df(table_name)
+            if key_format == "bib":
+                key_map = (dict(zip(field_df['header_text'], field_df['field'])), set(field_df['field']))
+            elif key_format == "header":
+                key_map = (dict(zip(field_df['field'], field_df['header_text'])), set(field_df['header_text']))
+            else:
+                return None
+            # Dropping any null entries (so they aren't checked on every conversion)
+            key_map = ({old_key: new_key for old_key, new_key in key_map[0].items()
+                            if (old_key not in [None, '']) and (new_key not in [None, ''])
+                            and not pd.isna(old_key) and not pd.isna(new_key)}, key_map[1])
+            self.key_maps[(key_format, table_name)] = key_map
+        return self.key_maps[(key_format, table_name)]
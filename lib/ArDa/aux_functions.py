@@ -1,8 +1,9 @@
 from PyQt5 import QtGui
 import sqlite3
 import pandas as pd
+import numpy as np
 import pdb, warnings
-import functools, time, datetime
+import functools, time, datetime, math, re, hashlib, unicodedata, difflib, json
 
 # This file houses auxiliary functions used by the main class
 
@@ -129,14 +130,26 @@ def autoResizeTextWidget(my_widget, resize_height=True, height_padding=0, resize
     print(f"After resizing W:{textWidth} and H:{textHeight}")
     #my_widget.updateGeometry()
 
-def getDocumentDB(db_path, table_name='Documents'):
+def openConn(db_path, conn = None):
+    """
+        Returns a sqlite connection (and whether the caller should close it).
+        If a connection is passed it is reused, otherwise a new one is opened.
+
+        :param db_path: string path to the DB file
+        :param conn: an already open connection (eg from an ArDa_DB_Conn manager)
+    """
+    if conn is not None:
+        return conn, False
+    return sqlite3.connect(db_path), True
+
+def getDocumentDB(db_path, table_name='Documents', conn = None):
     """
         This function will load the database and perform any processing needed
+
+        :param conn: (optional) an open sqlite connection to use instead of
+                opening (and closing) a new one to db_path
     """
     # TODO: This function should be obsolete eventually (use arda_db.get_table() instead)
-    conn = sqlite3.connect(db_path)  #'MendCopy2.sqlite')
-    c = conn.cursor()
-
     # Checking that a valid table name has been sent
     if table_name not in ['Documents', 'Fields', 'Projects', 'Doc_Auth',
                             'Doc_Proj', 'Doc_Paths', 'Doc_Proj_Ext',
@@ -144,22 +157,25 @@ def getDocumentDB(db_path, table_name='Documents'):
         warnings.warn(f"Table name ({table_name}) not recognized.")
         return pd.DataFrame()
 
+    conn, close_conn = openConn(db_path, conn)
+    c = conn.cursor()
+
     # Simple extraction for a few tables
     if table_name in ['Fields', 'Projects', 'Doc_Proj', 'Doc_Auth',
                         'Proj_Notes', 'Custom_Filters', 'Doc_Paths']:
         c.execute(f'SELECT * FROM {table_name}')
         temp_df = pd.DataFrame(c.fetchall(), columns=[description[0] for description in c.description])
-        conn.close()
+        if close_conn: conn.close()
         return temp_df
 
     # Special extraction for extended doc project
     if table_name == 'Doc_Proj_Ext':
         c.execute("SELECT p.*, dp.doc_id FROM Doc_Proj as dp Join Projects as p on dp.proj_id = p.proj_id")
         temp_df = pd.DataFrame(c.fetchall(), columns=[description[0] for description in c.description])
-        conn.close()
+        if close_conn: conn.close()
         return temp_df
 
-    c.execute(f'SELECT * FROM Fields WHERE table_name = "{table_name}"')
+    c.execute('SELECT * FROM Fields WHERE table_name = ?', (table_name,))
     field_df = pd.DataFrame(c.fetchall(), columns=[description[0] for description in c.description])
     field_to_header = dict(zip(field_df.field, field_df.header_text))
 
@@ -224,7 +240,7 @@ def getDocumentDB(db_path, table_name='Documents'):
     # df2 = df2[['ID', 'Author1', 'Author2', 'Year', 'Title', 'DateRead', 'DateCreated', 'DateModifiedF',
     # 			'Path', 'MendDateAdd', 'MendDateMod', 'MendRead', 'Projects']]
 
-    conn.close()
+    if close_conn: conn.close()
     #elanConn.close()
     # return df2
     return df
@@ -246,7 +262,136 @@ def pathCleaner(path_str):
 
     return path_str
 
-def convertBibEntryKeys(bib_dict_raw, key_format, field_df, debug_print = False):
+def iterBibEntries(bib_file, chunk_size = 65536):
+    """
+        Generator which parses the entries of a bib file one at a time (reading
+        the file in chunks) so only the current entry is ever held in memory.
+        Entries are yielded as dictionaries shaped like those of bibtexparser (ie
+        with 'ID', 'ENTRYTYPE' and lowercase field keys). @string macros are
+        substituted while @comment and @preamble blocks are skipped.
+
+        :param bib_file: file object (opened in text mode) of the bib file
+        :param chunk_size: int of the number of characters read at a time
+    """
+    bib_strings = {}
+    buffer = ""
+    at_eof = False
+    while True:
+        # Finding the start of the next block (text between blocks is ignored)
+        block_start = buffer.find("@")
+        while (block_start == -1) and (not at_eof):
+            buffer = bib_file.read(chunk_size)
+            at_eof = (buffer == "")
+            block_start = buffer.find("@")
+        if block_start == -1:
+            return
+        buffer = buffer[block_start:]
+
+        # Reading the block type and its opening delimiter
+        header = re.match(r"@\s*(\w+)\s*([{(])", buffer)
+        while (header is None) and (not at_eof) and (len(buffer) < 256):
+            chunk = bib_file.read(chunk_size)
+            at_eof = (chunk == "")
+            buffer += chunk
+            header = re.match(r"@\s*(\w+)\s*([{(])", buffer)
+        if header is None:
+            buffer = buffer[1:]     # A stray '@' (ie not the start of a block)
+            continue
+
+        # Scanning (reading more as needed) for the delimiter that closes the block
+        closer = "}" if header.group(2) == "{" else ")"
+        depth = 1 if closer == "}" else 0
+        ind = header.end()
+        block_end = None
+        while block_end is None:
+            if ind >= len(buffer):
+                if at_eof: break
+                chunk = bib_file.read(chunk_size)
+                at_eof = (chunk == "")
+                buffer += chunk
+                continue
+            char = buffer[ind]
+            if char == "{":
+                depth += 1
+            elif char == "}":
+                depth -= 1
+            if (char == closer) and (depth == 0):
+                block_end = ind
+            ind += 1
+        if block_end is None:
+            warnings.warn("Bib file ended part way through an entry, which was skipped.")
+            return
+        block_type = header.group(1).lower()
+        block_body = buffer[header.end():block_end]
+        buffer = buffer[block_end+1:]
+
+        # Handling the block according to its type
+        if block_type in ["comment", "preamble"]:
+            continue
+        elif block_type == "string":
+            bib_strings.update(parseBibFields(block_body, bib_strings))
+            continue
+        key_end = block_body.find(",")
+        if key_end == -1: key_end = len(block_body)
+        bib_entry = parseBibFields(block_body[key_end+1:], bib_strings)
+        bib_entry['ID'] = block_body[:key_end].strip()
+        bib_entry['ENTRYTYPE'] = block_type
+        yield bib_entry
+
+def parseBibFields(fields_text, bib_strings = None):
+    """
+        Parses the 'name = value' fields (separated by commas) of a bib entry into a
+        dictionary with lowercase keys. Values may be braced, quoted, numbers or
+        @string macros (concatenated with '#') and have their whitespace collapsed.
+
+        :param fields_text: str of the body of the entry (after its key)
+        :param bib_strings: dictionary of lowercase macro names to their values
+    """
+    if bib_strings is None: bib_strings = {}
+    fields = {}
+    ind, text_len = 0, len(fields_text)
+    while ind < text_len:
+        # Finding the field name
+        eq_ind = fields_text.find("=", ind)
+        if eq_ind == -1:
+            break
+        name = fields_text[ind:eq_ind].strip(" \t\r\n,").lower()
+        ind = eq_ind + 1
+        # Reading the parts of the value (until a comma at the top level)
+        parts = []
+        while ind < text_len:
+            char = fields_text[ind]
+            if char.isspace() or (char == "#"):
+                ind += 1
+            elif char == ",":
+                ind += 1
+                break
+            elif char in "{\"":
+                # Braced values end at the matching brace, quoted ones at a quote
+                #   which isn't inside braces
+                depth, part_start = 0, ind + 1
+                ind += 1
+                while ind < text_len:
+                    if fields_text[ind] == "{":
+                        depth += 1
+                    elif fields_text[ind] == "}":
+                        if (char == "{") and (depth == 0): break
+                        depth -= 1
+                    elif (fields_text[ind] == "\"") and (char == "\"") and (depth == 0):
+                        break
+                    ind += 1
+                parts.append(fields_text[part_start:ind])
+                ind += 1
+            else:
+                token = re.match(r"[^\s,#]+", fields_text[ind:]).group(0)
+                parts.append(bib_strings.get(token.lower(), token))
+                ind += len(token)
+        if name != "":
+            fields[name] = " ".join("".join(parts).split())
+    return fields
+
+def convertBibEntryKeys(bib_dict_raw, key_format, field_df = None, debug_print = False,
+                            key_map = None):
     """
         This function converts the keys in a bib entry dict to conform
         with the desired format (bib files or table header)
@@ -255,12 +400,16 @@ def convertBibEntryKeys(bib_dict_raw, key_format, field_df, debug_print = False)
             'bib' = bib file format (and DB field column names)
             'header' = header names in the table view dataframe
         :param field_df: dataframe containing all the various possible keys
+        :param key_map: (optional) tuple of the key mapping dict and set of all
+            keys (as returned by ArDa_Schema.get_key_map) used instead of field_df
     """
     # Copying the row data so we don't change the source
     bib_dict = bib_dict_raw.copy()
 
     # Creating a dictionary for key mapping depending on the format desired
-    if key_format == "bib":
+    if key_map is not None:
+        key_chg_dict, all_fields = key_map
+    elif key_format == "bib":
         all_fields = field_df['field']
         key_chg_dict = dict(zip(field_df['header_text'], field_df['field']))
     elif key_format == "header":
@@ -284,8 +433,250 @@ def convertBibEntryKeys(bib_dict_raw, key_format, field_df, debug_print = False)
 
     return bib_dict
 
+# Document fields used to build the duplicate keys (see getDupKeys)
+DUP_KEY_FIELDS = ['title', 'doi', 'arxiv_id', 'isbn', 'year']
+
+def normalizeDupText(text):
+    """
+        Reduces text to lowercase letters and digits (dropping accents, case,
+        punctuation and whitespace) so trivial variants compare equal
+    """
+    text = unicodedata.normalize('NFKD', str(text))
+    return "".join([char for char in text if char.isalnum()]).lower()
+
+def getDupKeys(doc_dict, first_author_last = None):
+    """
+        Returns the keys which identify (likely) duplicate documents, as a list of
+        (key_type, key_value) tuples. Two documents sharing any key (besides
+        'author_year', which also needs similar titles, see isSimilarTitle) are
+        considered potential duplicates. The keys are:
+            'title': hash of the normalized title
+            'doi': the doi (without any url prefix)
+            'arxiv': the arXiv id (without any prefix or version)
+            'isbn': the digits of the isbn
+            'author_year': the first author's last name and the year
+
+        :param doc_dict: dictionary (with field keys) of the document
+        :param first_author_last: str of the last name of the document's first author
+    """
+    def clean(value):
+        # Null values (None/NaN) and empty strings count as missing
+        if (value is None) or (isinstance(value, float) and math.isnan(value)):
+            return ""
+        return str(value).strip()
+
+    dup_keys = []
+    title = normalizeDupText(clean(doc_dict.get('title', None)))
+    if title not in ["", "newtitle"]:   # Skipping the default title of new records
+        dup_keys.append(('title', hashlib.sha1(title.encode('utf8')).hexdigest()[:16]))
+    doi = re.sub(r"^(https?://)?(dx\.)?(doi\.org/)|^doi:", "", clean(doc_dict.get('doi', None)).lower())
+    if doi != "":
+        dup_keys.append(('doi', doi.strip()))
+    arxiv = re.sub(r"^(arxiv:)|(v\d+)$", "", clean(doc_dict.get('arxiv_id', None)).lower())
+    if arxiv != "":
+        dup_keys.append(('arxiv', arxiv.strip()))
+    isbn = re.sub(r"[^0-9x]", "", clean(doc_dict.get('isbn', None)).lower())
+    if isbn != "":
+        dup_keys.append(('isbn', isbn))
+    year = clean(doc_dict.get('year', None))
+    if year.endswith(".0"): year = year[:-2]     # ie years read back as floats
+    author = normalizeDupText(clean(first_author_last))
+    if (year != "") and (author != ""):
+        dup_keys.append(('author_year', f"{author}|{year}"))
+    return dup_keys
+
+# Lowest similarity (see isSimilarTitle) of the titles of potential duplicates
+#   which only share their first author and year
+DUP_TITLE_SIMILARITY = 0.9
+
+def isSimilarTitle(title_a, title_b):
+    """
+        Returns whether two titles are nearly the same once normalized (see
+        normalizeDupText), eg differing by a typo or a subtitle's punctuation. Titles
+        with different numbers (eg parts or volumes of a series) are never similar.
+    """
+    title_a, title_b = normalizeDupText(title_a or ""), normalizeDupText(title_b or "")
+    if (title_a == "") or (title_b == ""):
+        return False
+    if re.sub(r"\D", "", title_a) != re.sub(r"\D", "", title_b):
+        return False
+    return difflib.SequenceMatcher(None, title_a, title_b).ratio() >= DUP_TITLE_SIMILARITY
+
+# Document fields indexed for full-text search (see the Documents_FTS table)
+DOC_SEARCH_FIELDS = ['title', 'abstract', 'author_lasts', 'journal', 'keyword', 'note']
+
+def getSearchTerms(search_text):
+    """
+        Splits search text into a list of (str of the term, bool of whether it is a
+        prefix) tuples. Quoted text is kept as a (whole) phrase while other words
+        are prefixes. Punctuation splits words into phrases (eg 'state-of-the-art'
+        becomes 'state of the art') like the full-text tokenizer does.
+
+        :param search_text: str of the text typed by the user
+    """
+    terms = []
+    # Splitting into quoted phrases and bare words (an unclosed quote runs to the end)
+    for phrase, word in re.findall(r'"([^"]*)"?|(\S+)', search_text):
+        tokens = re.findall(r"\w+", phrase if phrase != "" else word)
+        if len(tokens) > 0:
+            terms.append((" ".join(tokens), phrase == ""))
+    return terms
+
+def getFTSQuery(search_text):
+    """
+        Converts search text into an FTS5 match expression where every term (see
+        getSearchTerms) must match, so 'neur net' matches 'neural networks'.
+        Returns an empty string if the text has no searchable terms.
+
+        :param search_text: str of the text typed by the user
+    """
+    return " ".join(['"' + term + '"' + ("*" if is_prefix else "")
+                        for term, is_prefix in getSearchTerms(search_text)])
+
+def sqlValue(value):
+    """
+        Converts a python value into one sqlite can bind to a '?' placeholder
+        (ie numpy scalars become their python equivalents and NaN becomes NULL)
+
+        :param value: the value to be bound
+    """
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, bool): # Booleans are stored as their strings
+        return ("True" if value else "False")
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+@functools.lru_cache(maxsize=None)
+def getInsertSQL(table_name, columns):
+    """
+        Returns the parameterized insert statement for the table and column set.
+        The statement text is cached so that sqlite reuses the compiled statement.
+
+        :param table_name: str name of the table
+        :param columns: tuple of str column names being inserted
+    """
+    # Project memberships are unique, so adding one a document already has is a no-op
+    verb = "INSERT OR IGNORE" if table_name == "Doc_Proj" else "INSERT"
+    return f"{verb} INTO {table_name} ({', '.join(columns)}) " +\
+                f"VALUES ({', '.join(['?']*len(columns))})"
+
+@functools.lru_cache(maxsize=None)
+def getUpdateSQL(table_name, column_name, cond_columns):
+    """
+        Returns the parameterized update statement for the table, column and
+        condition columns (cached for the same reason as getInsertSQL)
+
+        :param table_name: str name of the table
+        :param column_name: str name of the column being set
+        :param cond_columns: tuple of str column names in the where clause
+    """
+    conditions = " AND ".join([f"{col} = ?" for col in cond_columns])
+    return f"UPDATE {table_name} SET {column_name} = ? WHERE {conditions}"
+
+@functools.lru_cache(maxsize=None)
+def getDeleteSQL(table_name, cond_columns):
+    """
+        Returns the parameterized delete statement for the table and condition
+        columns (cached for the same reason as getInsertSQL)
+
+        :param table_name: str name of the table
+        :param cond_columns: tuple of str column names in the where clause
+    """
+    conditions = " AND ".join([f"{col} = ?" for col in cond_columns])
+    return f"DELETE FROM {table_name} WHERE {conditions}"
+
+# Lists of values longer than this are bound as one json array (rather than a '?' each)
+SQL_IN_MAX_PARAMS = 500
+
+def getSelectSQL(from_expr, columns = None, where = None, order_by = None):
+    """
+        Returns a parameterized select statement along with the values to bind to it
+
+        :param from_expr: str name of the table (or a subquery) to select from
+        :param columns: list of str column names to return (None returns all)
+        :param where: dictionary whose keys are column names and whose values are
+                either a single value (or None) to match or a list of values to match
+                any of (long lists are matched through json_each)
+        :param order_by: str or list of str of column names (optionally followed
+                by ASC or DESC) to sort by
+    """
+    # Column names are put directly in the statement so we make sure they are just names
+    def checkName(name):
+        if not isinstance(name, str) or not name.replace("_", "").isalnum():
+            raise ValueError(f"Invalid column name passed to select statement: {name}")
+        return name
+
+    col_text = "*" if columns is None else ", ".join([checkName(col) for col in columns])
+    command = f"SELECT {col_text} FROM {from_expr}"
+    values = []
+    # Building the conditions (a list of values becomes an IN clause)
+    if (where is not None) and (len(where) > 0):
+        conditions = []
+        for col, value in where.items():
+            if isinstance(value, (list, tuple, set, np.ndarray, pd.Series)):
+                value = [sqlValue(val) for val in value]
+                if len(value) > SQL_IN_MAX_PARAMS:
+                    # (long lists would run into sqlite's limit on bound parameters)
+                    conditions.append(f"{checkName(col)} IN (SELECT value FROM json_each(?))")
+                    values.append(json.dumps(value))
+                else:
+                    conditions.append(f"{checkName(col)} IN ({', '.join(['?']*len(value))})")
+                    values += value
+            elif sqlValue(value) is None:
+                conditions.append(f"{checkName(col)} IS NULL")
+            else:
+                conditions.append(f"{checkName(col)} = ?")
+                values.append(sqlValue(value))
+        command += " WHERE " + " AND ".join(conditions)
+    # Adding the ordering (with any direction specified)
+    if order_by is not None:
+        if isinstance(order_by, str): order_by = [order_by]
+        order_text = []
+        for order_col in order_by:
+            col, _, direction = order_col.strip().partition(" ")
+            if direction.strip().upper() not in ["", "ASC", "DESC"]:
+                raise ValueError(f"Invalid sort direction passed to select statement: {order_col}")
+            order_text.append(f"{checkName(col)} {direction.strip().upper()}".strip())
+        command += " ORDER BY " + ", ".join(order_text)
+    return command, values
+
+def getSortOrderSQL(column, descending = False):
+    """
+        Returns an order by clause sorting like getSortRanks, ie with empty values
+        (null or '') last in either direction and text compared without case
+        (sqlite's NOCASE only folds ASCII letters)
+
+        :param column: str name of the column to sort by
+        :param descending: boolean indicating whether the order is descending
+    """
+    if not isinstance(column, str) or not column.replace("_", "").isalnum():
+        raise ValueError(f"Invalid column name passed to order by clause: {column}")
+    direction = " DESC" if descending else ""
+    return f"({column} IS NULL OR {column} = ''), NULLIF({column}, '') COLLATE NOCASE{direction}"
+
+def getSortRanks(values, numeric = False):
+    """
+        Returns an array ranking each value for sorting (equal values share a rank
+        and empty values get -1). Numeric values are ranked by their numeric value
+        and anything else by its casefolded text.
+
+        :param values: array of the values to rank
+        :param numeric: boolean indicating whether to rank the values as numbers
+    """
+    values = np.asarray(values)
+    if numeric or (values.dtype.kind in 'iufb'):
+        keys = pd.to_numeric(pd.Series(values), errors='coerce').to_numpy(dtype=float)
+    else:
+        keys = np.array([None if (value is None) or (value == '') or
+                            (isinstance(value, float) and math.isnan(value))
+                        else str(value).casefold() for value in values], dtype=object)
+    ranks, _ = pd.factorize(keys, sort=True)
+    return ranks
+
 def updateDB(cond_dict, column_name, new_value, db_path, table_name = "Documents",
-                        debug_print = False):
+                        debug_print = False, conn = None):
     """
         This function updates a single cell in a specified table
 
@@ -299,6 +690,7 @@ def updateDB(cond_dict, column_name, new_value, db_path, table_name = "Documents
         :param new_value: the value to be updated with
         :param db_path: string path to the DB file
         :param table_name: string with the table to update
+        :param conn: (optional) an open sqlite connection to use instead of db_path
 
         Returns (bool) indicating whether the change was successful or not
     """
@@ -308,41 +700,24 @@ def updateDB(cond_dict, column_name, new_value, db_path, table_name = "Documents
                                 'Doc_Paths', "Doc_Auth", 'Proj_Notes']:
         warnings.warn(f"Table name ({table_name}) not recognized (or not yet implemented).")
         return pd.DataFrame()
-    # Checking and purging any quotes or apostrophes in conditions
-    for key, value in cond_dict.items():
-        if (isinstance(value,str)) and (('"' in value) or ("'" in value)):
-            cond_dict[key] = value.replace('"','').replace("'","")
-            warnings.warn(f'''Update may not work since apostrophe or quote was found and removed in: {value}''')
-        if (isinstance(key,str)) and (('"' in key) or ("'" in key)):
-            cond_dict[key.replace('"','').replace("'","")] = cond_dict.pop(key)
-            warnings.warn(f'''Update may not work since apostrophe or quote was found and removed in: {key}''')
-    # If it is a string we clean it and add quotes
-    if isinstance(new_value, str):
-        if (('"' in new_value) or ("'" in new_value)):
-            warnings.warn(f'''Update may not work as expected since apostrophe or quote was found and removed in: {new_value}''')
-        new_value = new_value.replace('"','').replace("'","")
-        new_value = '"'+new_value+'"'
-    elif isinstance(new_value, bool): # Replace booleans with their strings
-        new_value = ("True" if new_value else "False")
-        new_value = '"'+new_value+'"'
+    # Building the (cached) statement and the values bound to it
+    command = getUpdateSQL(table_name, column_name, tuple(cond_dict.keys()))
+    values = [sqlValue(new_value)] + [sqlValue(value) for value in cond_dict.values()]
     # Opening connection and executing command
-    conn = sqlite3.connect(db_path)
+    conn, close_conn = openConn(db_path, conn)
     c = conn.cursor()
-    command = f'UPDATE {table_name} SET {column_name} = {new_value} ' +\
-                f'WHERE '
-    conditions = [key+"='"+value+"'" if isinstance(value,str) else key+"="+str(value)
-                    for key, value in cond_dict.items()]
-    command += " AND ".join(conditions)
     if debug_print:
-        print(command)
+        print(command, values)
     try:
-        c.execute(command)
+        c.execute(command, values)
         result = c.fetchall()
     except sqlite3.Error:
-        print(f"There was a sql error with the following: {command}")
-        # Saving changes
-        conn.close()
+        print(f"There was a sql error with the following: {command} {values}")
+        # Dropping any pending changes (a borrowed connection is used by later callers)
+        conn.rollback()
+        if close_conn: conn.close()
         return
+    row_count = c.rowcount
 
     # Parse the result to test whether it was a success or not
     if debug_print:
@@ -351,18 +726,18 @@ def updateDB(cond_dict, column_name, new_value, db_path, table_name = "Documents
     # Also updating the modified date (if in the documents table)
     if table_name == "Documents":
         dt_obj = datetime.datetime.now().timestamp()*1e3
-        command = f'UPDATE Documents SET modified_date = "{dt_obj}" ' +\
-                    f'WHERE doc_id == {cond_dict["doc_id"]}'
-        c.execute(command)
+        c.execute(getUpdateSQL("Documents", "modified_date", ("doc_id",)),
+                    [dt_obj, sqlValue(cond_dict["doc_id"])])
 
     # Saving changes
     conn.commit()
-    conn.close()
+    if close_conn: conn.close()
 
     # Returning true if successful and false otherwise
-    return (True if (c.rowcount==1) else False)
+    return (True if (row_count==1) else False)
 
-def insertIntoDB(data_in, table_name, db_path, debug_print = False):
+def insertIntoDB(data_in, table_name, db_path, debug_print = False, conn = None,
+                    schema = None):
     """
         Inserts a single record into the specified table and returns unused keys
 
@@ -370,6 +745,9 @@ def insertIntoDB(data_in, table_name, db_path, debug_print = False):
                 and whose values are the values to be put in the table.
                 May also be a list of dictionaries to be iterated over.
         :param table_name: The name of which table these should be put in
+        :param conn: (optional) an open sqlite connection to use instead of db_path
+        :param schema: (optional) ArDa_Schema of the db, used for the field info and
+                table columns instead of querying the db for them
     """
     # Checking that a valid table name has been sent
     if table_name not in ['Documents', 'Projects', 'Fields', 'Doc_Proj', 
@@ -388,22 +766,19 @@ def insertIntoDB(data_in, table_name, db_path, debug_print = False):
     # Initializing the unused keys
     unused_keys = set()
 
-    # Extracting info about the fields of the DB we're inserting into
-    field_df = getDocumentDB(db_path, table_name='Fields')
-    field_df = field_df[field_df.table_name==table_name].copy()
-
-    # Getting list of fields by their var type
-    string_fields = list(field_df[(field_df.var_type=="string")]['field'])
-    int_fields = list(field_df[(field_df.var_type=="int")]['field'])
-    boolean_fields = list(field_df[(field_df.var_type=="boolean")]['field'])
-
     # Connecting to the database
-    conn = sqlite3.connect(db_path)  #'MendCopy2.sqlite')
+    conn, close_conn = openConn(db_path, conn)
     c = conn.cursor()
 
-    # Getting the table cols
-    c.execute(f"SELECT * FROM {table_name} LIMIT 5")
-    col_names = [description[0] for description in c.description]
+    # Extracting info about the fields and columns of the table we're inserting into
+    if schema is not None:
+        key_map = schema.get_key_map('bib', table_name)
+        col_names = schema.get_table_cols(table_name)
+    else:
+        field_df = getDocumentDB(db_path, table_name='Fields', conn=conn)
+        key_map = None
+        c.execute(f"SELECT * FROM {table_name} LIMIT 5")
+        col_names = [description[0] for description in c.description]
 
     # Iterating over every dictionary in the list
     for row_dict_raw in data_in:
@@ -414,47 +789,50 @@ def insertIntoDB(data_in, table_name, db_path, debug_print = False):
         # Copying the row data so we don't change the source
         row_dict = row_dict_raw.copy()
         # Convert keys to match those in the DB (same as bib fields)
-        row_dict = convertBibEntryKeys(row_dict, 'bib', field_df)
+        if key_map is not None:
+            row_dict = convertBibEntryKeys(row_dict, 'bib', key_map=key_map)
+        else:
+            row_dict = convertBibEntryKeys(row_dict, 'bib', field_df[field_df.table_name==table_name])
 
         # Canceling operation if no path to insert
         if (table_name == "Doc_Paths") and ('full_path' not in row_dict):
+            conn.rollback()
+            if close_conn: conn.close()
             return set(row_dict.keys())
 
-        # Converting all values to strings
-        row_dict = {key: str(val) for key, val in row_dict.items()}
-        # Adding apostrophes for the string values (and escape chars)
-        row_dict = {key: ("'"+val.replace("'", "''")+"'" if key in string_fields else val)\
-                                            for key, val in row_dict.items()}
-
-
         # Filtering the keys to just those in table columns (and getting unused)
         unused_keys = unused_keys | (set(row_dict.keys()) - set(col_names))
         row_dict = {key: val for key, val in row_dict.items() if key in col_names}
 
-        # Forming insertion command and executing it
-        command = f"INSERT INTO {table_name} ("
-        command += ", ".join(row_dict.keys())
-        command += ") VALUES ("
-        command += ", ".join(row_dict.values())
-        command += ")"
+        # Grabbing the (cached) insertion command and executing it
+        command = getInsertSQL(table_name, tuple(row_dict.keys()))
+        values = [sqlValue(val) for val in row_dict.values()]
         if debug_print:
-            print(command)
-        c.execute(command)
+            print(command, values)
+        try:
+            c.execute(command, values)
+        except sqlite3.Error:
+            # Dropping the rows inserted so far (a borrowed connection is used by later callers)
+            conn.rollback()
+            if close_conn: conn.close()
+            raise
 
     # Saving changes
     try:
         conn.commit()
     except sqlite3.OperationalError:
         print("Unable to save the DB changes (DB may be open elsewhere)")
-        conn.close()
+        conn.rollback()
+        if close_conn: conn.close()
         return
     result = c.fetchall()
-    conn.close()
+    if close_conn: conn.close()
 
     # Returning any keys that were not used in the insertion
     return unused_keys
 
-def deleteFromDB(cond_dict, table_name, db_path, force_commit=False, debug_print=False):
+def deleteFromDB(cond_dict, table_name, db_path, force_commit=False, debug_print=False,
+                    conn = None):
     """
         Deletes records from the specified DB according to the conditions passed
 
@@ -466,27 +844,33 @@ def deleteFromDB(cond_dict, table_name, db_path, force_commit=False, debug_print
         :param db_path: str path of the DB to open
         :param force_commit: boolean indicating whether to ask to continue
                 if more or less than 1 row is affected by the DB change
+        :param conn: (optional) an open sqlite connection to use instead of db_path
     """
-    conn = sqlite3.connect(db_path)  #'MendCopy2.sqlite')
+    conn, close_conn = openConn(db_path, conn)
     curs = conn.cursor()
-    command = f"DELETE FROM {table_name} WHERE "
-    conditions = [key+"='"+value+"'" if isinstance(value,str) else key+"="+str(value)
-                    for key, value in cond_dict.items()]
-    command += " AND ".join(conditions)
+    command = getDeleteSQL(table_name, tuple(cond_dict.keys()))
+    values = [sqlValue(value) for value in cond_dict.values()]
     if debug_print:
-        print(command)
-    curs.execute(command)
+        print(command, values)
+    try:
+        curs.execute(command, values)
+    except sqlite3.Error:
+        # Leaving no transaction open (a borrowed connection is used by later callers)
+        conn.rollback()
+        if close_conn: conn.close()
+        raise
 
     if force_commit or (curs.rowcount == 0):
         ans = "y"
     else:
-        print(command)
+        print(command, values)
         print(f"{curs.rowcount} rows were affected in the most recent sql call.")
         ans = input("Continue (y/n)? ")
 
     if (ans != "y") & (ans != "yes"):
         print("Aborting deletions made to the DB.")
-        conn.close()
+        conn.rollback()
+        if close_conn: conn.close()
         return
 
     try:
@@ -494,7 +878,8 @@ def deleteFromDB(cond_dict, table_name, db_path, force_commit=False, debug_print
         conn.commit()
     except sqlite3.OperationalError:
         print("Unable to save the DB changes (DB may be open elsewhere)")
-        conn.close()
+        conn.rollback()
+        if close_conn: conn.close()
         return
     result = curs.fetchall()
-    conn.close()
+    if close_conn: conn.close()
@@ -159,7 +159,8 @@ class DocSearchDialog(QtWidgets.QDialog):
             #   doc tables. Currently arda_db_sql uses the 'author' key not 'author_lasts'
             # if 'author' in self.bib_dict:
             #     self.bib_dict['author_lasts'] = self.bib_dict.pop('author')
-            doc_dict = aux.convertBibEntryKeys(self.bib_dict, 'header', self.arda_app.field_df)
+            doc_dict = aux.convertBibEntryKeys(self.bib_dict, 'header',
+                                key_map=self.arda_app.adb.get_schema().get_key_map("header"))
             # Getting selected doc id and adding the entry (temporarily)
             if len(self.arda_app.selected_doc_ids) == 0:
                 msg = "There is no document selected (in the existing bib "+\
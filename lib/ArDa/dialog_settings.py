@@ -344,9 +344,10 @@ class SettingsDialog(QtWidgets.QDialog):
         # This saves the custom filters (if any have changed)
         if self.custom_filters_changed:
             # Overwrite the existing custom filter table
-            conn = sqlite3.connect(self.parent_window.adb.db_path)
+            conn = self.parent_window.adb.get_conn()
             self.filter_df.to_sql('Custom_Filters', conn, if_exists = "replace", index = False)
-            conn.close()
+            conn.commit()
+            self.parent_window.adb.invalidate_tables('Custom_Filters')
 
     def closeDialog(self, no_save = False):
         """
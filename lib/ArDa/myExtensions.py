@@ -5,15 +5,84 @@ from PyQt5.QtWidgets import QLabel, QApplication, QAction, QTableView, QInputDia
 from PyQt5.QtGui import QPainter, QFontMetrics, QTextDocument
 import datetime
 import ArDa.aux_functions as aux
-import math, pdb, sqlite3, warnings, logging
+from ArDa.arda_filters import ArDa_Filter_Engine
+from ArDa.arda_db_sql import ArDa_DB_SQL
+import math, pdb, sqlite3, warnings, logging, time, threading
 import numpy as np
+import pandas as pd
+
+# Marks display cache entries which haven't been formatted yet
+UNFORMATTED = object()
+# Rows read at a time by paged table models (see docTableModel.startPaging)
+DOC_PAGE_SIZE = 1000
+# Fields sorted by their numeric value (others are sorted as casefolded text)
+NUMERIC_SORT_FIELDS = ['doc_id', 'year', 'add_date', 'read_date', 'modified_date']
 
 class docTableModel(QAbstractTableModel):
-    def __init__(self, datain, headerdata, parent=None, *args):
+    def __init__(self, datain, headerdata, parent=None, schema=None, *args):
         QAbstractTableModel.__init__(self, *args)
-        self.arraydata = datain
         self.headerdata = headerdata
         self.parent = parent
+        # Mapping each column header to its field once (so formatting doesn't depend on header text)
+        if schema is not None:
+            header_to_field = schema.get_header_to_field("Documents")
+        else:
+            header_to_field = {'ID':'doc_id', 'Year':'year', 'Added':'add_date',
+                                'Read':'read_date', 'Modified':'modified_date'}
+        self.col_fields = [header_to_field.get(header, header) for header in headerdata]
+        # Paging state (only used once startPaging is called)
+        self.adb = None
+        self.pending_ids = np.array([], dtype=np.int64)
+        self.lazy_headers = set()
+        self.page_size = DOC_PAGE_SIZE
+        # Relative dates (eg 'Today') are reformatted when the day changes
+        self.day_timer = QTimer()
+        self.day_timer.setSingleShot(True)
+        self.day_timer.timeout.connect(self.onDayChange)
+        self.scheduleDayChange()
+        self.arraydata = datain
+
+    @property
+    def arraydata(self):
+        return self._arraydata
+
+    @arraydata.setter
+    def arraydata(self, datain):
+        # Replacing the data drops all cached cell values (rows are added and removed
+        #   with addRows and dropRows, which keep them)
+        self._arraydata = datain
+        self.resetDisplayCache()
+
+    def resetDisplayCache(self):
+        """
+            Drops the cached cell values. Display values are formatted lazily (the
+            first time a cell is painted) and memoized in an array per column, so
+            repaints only index into those arrays.
+        """
+        num_cols = self._arraydata.shape[1]
+        self.raw_cols = [None]*num_cols
+        self.display_cols = [None]*num_cols
+        self.doc_ids = None
+        self.doc_id_rows = None
+        self.sort_orders = {}       # Sorted doc ids of each (column, descending) sorted by
+        self.display_today = datetime.date.today()
+
+    def scheduleDayChange(self):
+        # Starts the timer firing just after the next midnight
+        tomorrow = datetime.datetime.combine(datetime.date.today() + datetime.timedelta(days=1),
+                                                datetime.time())
+        self.day_timer.start(int((tomorrow - datetime.datetime.now()).total_seconds()*1000) + 1000)
+
+    def onDayChange(self):
+        # Drops the formatted dates (which may read 'Today' or 'Yesterday') and repaints them
+        self.display_today = datetime.date.today()
+        for col, field in enumerate(self.col_fields):
+            if field in ['add_date', 'read_date', 'modified_date']:
+                self.display_cols[col] = None
+        if self.rowCount(QModelIndex()) > 0:
+            self.dataChanged.emit(self.index(0, 0), self.index(self.rowCount(QModelIndex()) - 1,
+                                                                self.columnCount(QModelIndex()) - 1))
+        self.scheduleDayChange()
 
     def rowCount(self, parent):
         return self.arraydata.shape[0]
@@ -27,52 +96,348 @@ class docTableModel(QAbstractTableModel):
         elif role != Qt.DisplayRole:
             return QVariant()
 
-        # Grabbing cell value and checking if empty or null
-        cell_val = self.arraydata.iloc[index.row()][index.column()]
-        if (cell_val==None) | (cell_val==''): # Handling null values
-            return QVariant()
+        # Grabbing the (memoized) display value of the cell
+        row, col = index.row(), index.column()
+        display_col = self.display_cols[col]
+        if display_col is None:
+            display_col = np.full(self._arraydata.shape[0], UNFORMATTED, dtype=object)
+            self.display_cols[col] = display_col
+        cell_val = display_col[row]
+        if cell_val is UNFORMATTED:
+            cell_val = self.formatCell(self.getRawColumn(col)[row], self.col_fields[col])
+            display_col[row] = cell_val
+        return QVariant() if cell_val is None else QVariant(cell_val)
+
+    def getRawColumn(self, col):
+        # Returns the (cached) array of the column's values
+        if self.raw_cols[col] is None:
+            if self.headerdata[col] in self.lazy_headers:
+                self.loadColumns([self.headerdata[col]])
+            self.raw_cols[col] = self._arraydata.iloc[:, col].to_numpy()
+        return self.raw_cols[col]
+
+    def startPaging(self, adb, sort_header = 'Added', descending = True, lazy_headers = None):
+        """
+            Switches the model to reading its rows from the db a page at a time.
+            Only the doc ids (ordered by the sort column in the db, the same way
+            sortRows orders them) are read up front and the rows are read as the view scrolls to them
+            (see canFetchMore/fetchMore), so large libraries show their first page
+            without reading the whole Documents table. Lazy columns (eg abstract and
+            note) are only read once they are displayed.
+
+            :param adb: the ArDa_DB object holding the documents
+            :param sort_header: str of the header of the column ordering the rows
+            :param descending: boolean indicating whether the order is descending
+            :param lazy_headers: collection of the headers of the columns read on demand
+        """
+        self.adb = adb
+        self.lazy_headers = set() if lazy_headers is None else set(lazy_headers) & set(self.headerdata)
+        self.sortPages(list(self.headerdata).index(sort_header), descending)
+
+    def sortPages(self, col, descending = False):
+        """
+            Reorders a paged model by a column, ie drops the rows read so far and
+            starts reading them again in the new order
+
+            :param col: int of the column to sort by
+            :param descending: boolean indicating whether the order is descending
+        """
+        doc_ids = self.adb.get_sorted_doc_ids(self.col_fields[col], descending,
+                                                self.col_fields[col] in NUMERIC_SORT_FIELDS)
+        self.beginResetModel()
+        self.pending_ids = doc_ids[self.page_size:]
+        self.arraydata = self.readRows(doc_ids[:self.page_size])
+        self.endResetModel()
+
+    def readRows(self, doc_ids):
+        """
+            Reads the rows of documents from the db (in the order given, with the
+            lazy columns left empty)
+
+            :param doc_ids: array of the doc ids to read
+        """
+        fields = [field for field, header in zip(self.col_fields, self.headerdata)
+                    if header not in self.lazy_headers]
+        if len(doc_ids) == 0:
+            return pd.DataFrame(columns=self.headerdata)
+        rows = self.adb.get_table("Documents", use_header_text=True, columns=fields,
+                                    where={'doc_id': doc_ids.tolist()})
+        # Putting the rows back in the order asked for
+        id_order = dict(zip(doc_ids.tolist(), range(len(doc_ids))))
+        rows = rows.iloc[np.argsort(rows['ID'].map(id_order).to_numpy(), kind='stable')]
+        return rows.reindex(columns=self.headerdata).reset_index(drop=True)
+
+    def canFetchMore(self, parent):
+        return len(self.pending_ids) > 0
+
+    def fetchMore(self, parent):
+        # Reads the next page of rows (skipping any documents added to the model since)
+        self.appendRows(self.pending_ids[:self.page_size])
+        self.pending_ids = self.pending_ids[self.page_size:]
+
+    def fetchDocIDs(self, doc_ids):
+        """
+            Reads just the rows left to read of the given documents (eg those a
+            filter shows), keeping the rest of the pages to read
+
+            :param doc_ids: collection of the doc ids to read
+        """
+        doc_ids = np.array(list(doc_ids), dtype=np.int64)
+        fetch_mask = np.isin(self.pending_ids, doc_ids)
+        if fetch_mask.any():
+            fetch_ids = self.pending_ids[fetch_mask]
+            self.pending_ids = self.pending_ids[~fetch_mask]
+            self.appendRows(fetch_ids)
+
+    def appendRows(self, doc_ids):
+        """
+            Reads and appends the rows of documents not already in the model
+
+            :param doc_ids: array of the doc ids to read
+        """
+        doc_ids = np.asarray(doc_ids)
+        self.addRows(self.readRows(doc_ids[~np.isin(doc_ids, self.getDocIDs())]))
+
+    def addRows(self, rows):
+        """
+            Appends rows to the model, extending the cached column values (rather
+            than dropping them). Only the sort orders are dropped.
+
+            :param rows: dataframe of the rows (with the model's columns)
+        """
+        if rows.shape[0] == 0:
+            return
+        row_ct = self.rowCount(QModelIndex())
+        self.beginInsertRows(QModelIndex(), row_ct, row_ct + rows.shape[0] - 1)
+        self._arraydata = pd.concat([self._arraydata, rows.reindex(columns=self._arraydata.columns)],
+                                    ignore_index=True)
+        for col, raw_col in enumerate(self.raw_cols):
+            if raw_col is None:
+                continue
+            new_vals = self._arraydata.iloc[row_ct:, col].to_numpy()
+            if new_vals.dtype != raw_col.dtype:
+                # (the new rows changed the column's type, eg ints with a missing value)
+                self.raw_cols[col], self.display_cols[col] = None, None
+                continue
+            self.raw_cols[col] = np.concatenate([raw_col, new_vals])
+            if self.display_cols[col] is not None:
+                self.display_cols[col] = np.concatenate([self.display_cols[col],
+                                            np.full(len(new_vals), UNFORMATTED, dtype=object)])
+        if self.doc_ids is not None:
+            self.doc_ids = np.concatenate([self.doc_ids, self._arraydata['ID'].iloc[row_ct:].to_numpy()])
+        if self.doc_id_rows is not None:
+            for row, row_doc_id in enumerate(self._arraydata['ID'].iloc[row_ct:].tolist(), row_ct):
+                self.doc_id_rows.setdefault(row_doc_id, row)
+        self.sort_orders = {}
+        self.endInsertRows()
+
+    def dropRows(self, rows):
+        """
+            Removes rows from the model, deleting their positions from the cached
+            column values (and their doc ids from the sort orders)
+
+            :param rows: collection of ints of the rows to remove
+        """
+        rows = np.unique(np.array(list(rows), dtype=np.int64))
+        rows = rows[(rows >= 0) & (rows < self.rowCount(QModelIndex()))]
+        if len(rows) == 0:
+            return
+        removed_ids = self.getDocIDs()[rows]
+        # Removing each run of consecutive rows (from the last run to the first)
+        range_starts = np.flatnonzero(np.diff(rows) != 1) + 1
+        for range_rows in reversed(np.split(rows, range_starts)):
+            first, last = int(range_rows[0]), int(range_rows[-1])
+            self.beginRemoveRows(QModelIndex(), first, last)
+            kept_rows = np.r_[0:first, last+1:self._arraydata.shape[0]]
+            self._arraydata = self._arraydata.iloc[kept_rows].reset_index(drop=True)
+            self.raw_cols = [None if values is None else values[kept_rows] for values in self.raw_cols]
+            self.display_cols = [None if values is None else values[kept_rows] for values in self.display_cols]
+            self.doc_ids = None if self.doc_ids is None else self.doc_ids[kept_rows]
+            self.doc_id_rows = None
+            self.endRemoveRows()
+        self.sort_orders = {key: sort_ids[~np.isin(sort_ids, removed_ids)]
+                            for key, sort_ids in self.sort_orders.items()}
+
+    def loadColumns(self, headers, doc_df = None):
+        """
+            Reads lazy columns' values for every row of the model (columns already
+            read are skipped)
+
+            :param headers: list of the headers of the columns to read
+            :param doc_df: dataframe (indexed by doc id) holding the columns (None
+                    reads them from the db)
+        """
+        headers = [header for header in headers if header in self.lazy_headers]
+        if len(headers) == 0:
+            return
+        if doc_df is None:
+            fields = [self.col_fields[list(self.headerdata).index(header)] for header in headers]
+            doc_df = self.adb.get_table("Documents", use_header_text=True, columns=['doc_id']+fields)
+            doc_df = doc_df.set_index(doc_df['ID'].to_numpy())
+        for header in headers:
+            col = list(self.headerdata).index(header)
+            self.lazy_headers.discard(header)
+            self._arraydata[header] = self._arraydata['ID'].map(doc_df[header]).to_numpy()
+            self.raw_cols[col], self.display_cols[col] = None, None
+            self.dropSortOrders(col)
+
+    def getSortRanks(self, col):
+        """
+            Returns the sort key of a column, ie an array ranking each row's value
+            (equal values share a rank and empty values get -1). Dates and other
+            numeric fields are ranked by their numeric values and text by its
+            casefolded value.
+
+            :param col: int of the column
+        """
+        return aux.getSortRanks(self.getRawColumn(col), self.col_fields[col] in NUMERIC_SORT_FIELDS)
+
+    def sortRows(self, col, descending = False):
+        """
+            Reorders the rows by a column, with empty values last (in either order)
+            and equal values kept in their current order. The order of each column
+            and direction is cached (as doc ids) until the column's data changes, so
+            sorting by it again only reorders the rows.
+
+            :param col: int of the column to sort by
+            :param descending: boolean indicating whether the order is descending
+        """
+        sort_ids = self.sort_orders.get((col, descending), None)
+        if sort_ids is None:
+            ranks = self.getSortRanks(col)
+            num_values = ranks.max() + 1 if len(ranks) > 0 else 0
+            keys = np.where(ranks < 0, num_values, (num_values - 1 - ranks) if descending else ranks)
+            order = np.argsort(keys, kind='stable')
+            self.sort_orders[(col, descending)] = self.getDocIDs()[order]
+        else:
+            order = pd.Index(self.getDocIDs()).get_indexer(sort_ids)
+        self.reorderRows(order)
+
+    def reorderRows(self, order):
+        """
+            Reorders the rows (a layout change keeping the cached values and moving
+            the persistent indexes, eg the selection, with their rows)
+
+            :param order: array of the current row of each new row
+        """
+        if np.array_equal(order, np.arange(len(order))):
+            return
+        self.layoutAboutToBeChanged.emit()
+        new_rows = np.empty_like(order)
+        new_rows[order] = np.arange(len(order))
+        old_indexes = self.persistentIndexList()
+        new_indexes = [self.index(int(new_rows[index.row()]), index.column()) for index in old_indexes]
+        self._arraydata = self._arraydata.iloc[order]
+        self.raw_cols = [None if values is None else values[order] for values in self.raw_cols]
+        self.display_cols = [None if values is None else values[order] for values in self.display_cols]
+        self.doc_ids = None if self.doc_ids is None else self.doc_ids[order]
+        self.doc_id_rows = None
+        self.changePersistentIndexList(old_indexes, new_indexes)
+        self.layoutChanged.emit()
+
+    def dropSortOrders(self, col):
+        # Drops the cached sort orders of a column (eg after its values changed)
+        self.sort_orders = {key: sort_ids for key, sort_ids in self.sort_orders.items()
+                            if key[0] != col}
+
+    def getDocRow(self, doc_id):
+        """
+            Returns (a copy of) the row of a document, reading any of its values
+            still left in lazy columns
+
+            :param doc_id: int of the document's ID
+        """
+        row = self.getRowOfDocID(doc_id)
+        if row == -1:
+            raise IndexError(f"Document (ID = {doc_id}) not found in the table model.")
+        doc_row = self._arraydata.iloc[row].copy()
+        if len(self.lazy_headers) > 0:
+            fields = [field for field, header in zip(self.col_fields, self.headerdata)
+                        if header in self.lazy_headers]
+            lazy_vals = self.adb.get_table("Documents", use_header_text=True, columns=fields,
+                                            where={'doc_id': int(doc_id)})
+            if lazy_vals.shape[0] > 0:
+                for header in lazy_vals.columns:
+                    doc_row[header] = lazy_vals[header].iloc[0]
+        return doc_row
+
+    def formatCell(self, cell_val, col_field):
+        """
+            Returns the value to display for a cell (None for empty cells)
+
+            :param cell_val: the cell's value in the data
+            :param col_field: str of the field of the cell's column
+        """
+        # Checking if empty or null
+        if (cell_val is None) or (isinstance(cell_val, str) and cell_val == ''): # Handling null values
+            return None
         if isinstance(cell_val, float) or isinstance(cell_val, int):
             if math.isnan(cell_val):
-                return QVariant()
+                return None
 
         # Handling different column data types
-        col_name = self.headerdata[index.column()]
-        if col_name == 'Year':
+        if col_field == 'year':
             try:
-                year_val = QVariant(str(int(cell_val)))
+                year_val = str(int(cell_val))
             except ValueError:
                 year_val = None
             return year_val
-        elif col_name in ['Added', 'Read']:
+        elif col_field in ['add_date', 'read_date']:
             try:
                 cell_val = int(float(cell_val))
             except ValueError:
                 warnings.warn(f"Year value {cell_val} could not be coerced into an int.")
-                cell_val = 0
-                return QVariant()
+                return None
             # Converting to date
             cell_date = datetime.date(cell_val//10000, (cell_val%10000)//100, cell_val%100)
             # Checking if today or yesterday
-            today = datetime.date.today()
+            today = self.display_today
             if (cell_date.year == today.year) and (cell_date.month == today.month):
                 if cell_date.day == today.day:
                     cell_date = 'Today'
                 elif cell_date.day == today.day-1:
                     cell_date = 'Yesterday'
-            return QVariant(str(cell_date))
-        elif col_name == 'Modified':
+            return str(cell_date)
+        elif col_field == 'modified_date':
             dt_obj = datetime.datetime.fromtimestamp(cell_val/1e3)
             # Displaying time if same as today (and date otherwise)
-            if dt_obj.date() == datetime.date.today():
+            if dt_obj.date() == self.display_today:
                 dt_obj = dt_obj.time()
                 dt_obj = dt_obj.strftime('%#I:%M %p')
             else:
                 dt_obj = dt_obj.date()
-            return QVariant(str(dt_obj))
-        elif col_name == 'ID':
-            return QVariant(int(cell_val))  #QVariant(self.arraydata[index.row()][index.column()])
+            return str(dt_obj)
+        elif col_field == 'doc_id':
+            return int(cell_val)
         else:
-            return QVariant(str(cell_val))  #QVariant(self.arraydata[index.row()][index.column()])
+            return str(cell_val)
+
+    def setDocValues(self, doc_id, header_values):
+        """
+            Sets cells in a document's row, refreshing only those cells
+
+            :param doc_id: int of the document's ID
+            :param header_values: dictionary whose keys are column headers and
+                    values are the new cell values
+        """
+        row = self.getRowOfDocID(doc_id)
+        if row == -1:
+            return
+        columns = list(self.headerdata)
+        for header, value in header_values.items():
+            if header not in columns: continue
+            col = columns.index(header)
+            self._arraydata.iat[row, col] = value
+            # Dropping the column array (the set may have changed its dtype) and the cell
+            self.raw_cols[col] = None
+            if self.display_cols[col] is not None:
+                self.display_cols[col][row] = UNFORMATTED
+            if header == 'ID':
+                self.doc_ids, self.doc_id_rows = None, None
+                self.sort_orders = {}
+            self.dropSortOrders(col)
+            cell_index = self.index(row, col)
+            self.dataChanged.emit(cell_index, cell_index)
 
     def headerData(self, col, orientation, role):
         ## For debugging the header out of bounds issue
@@ -95,13 +460,20 @@ class docTableModel(QAbstractTableModel):
         return Qt.ItemFlags(QAbstractTableModel.flags(self, index) | Qt.ItemIsDragEnabled)
         # Add the additional flag to make cell editable: Qt.ItemIsEditable
 
+    def getDocIDs(self):
+        # Returns the (cached) array of the document id of each row (a new array
+        #   whenever the rows change)
+        if self.doc_ids is None:
+            self.doc_ids = self._arraydata['ID'].to_numpy()
+        return self.doc_ids
+
     def getRowOfDocID(self, doc_id):
-        # This function returns the row that contains the passed document id
-        row_inds = self.arraydata[self.arraydata['ID']==doc_id].index
-        if len(row_inds) == 0:
-            return -1
-        else:
-            return row_inds[0]
+        # This function returns the row (position) that contains the passed document id
+        if self.doc_id_rows is None:
+            self.doc_id_rows = {}
+            for row, row_doc_id in enumerate(self.getDocIDs().tolist()):
+                self.doc_id_rows.setdefault(row_doc_id, row)
+        return self.doc_id_rows.get(doc_id, -1)
 
     def mimeTypes(self):
         return ['text/xml']
@@ -255,24 +627,6 @@ class projTreeModel(QAbstractItemModel):
         ind = self.createIndex(row,0,node)
         return ind
 
-    def projectPath(self, proj_id, ignore_x_parents = 0):
-        # This function returns the full project path (ie all the ancestors) of
-        #		the passed proj_id
-
-        # Defining the nest delineator (e.g. slashes)
-        nest_char = "/"
-        # Initializing the path
-        curr_proj = self.tree_nodes[proj_id]
-        proj_path = curr_proj.data(0)
-        # Iterating over the parents until we hit the root
-        while curr_proj.parentItem != self.rootItem:
-            curr_proj = curr_proj.parentItem
-            proj_path = curr_proj.data(0) + nest_char + proj_path
-        # Rolling back and removing the top number of parents specified
-        for i in range(ignore_x_parents):
-            proj_path = proj_path[proj_path.find(nest_char)+1:]
-        return proj_path
-
     def parent(self, index):
         if not index.isValid():
             return QModelIndex()
@@ -359,26 +713,102 @@ class projTreeModel(QAbstractItemModel):
 
 # Customize a sort/filter proxy by making its filterAcceptsRow method
 # test the character in that row against a filter function in the parent.
+# Filter changes touching more (contiguous) ranges of rows than this remap the
+#   whole proxy rather than have Qt re-check each range
+MAX_FILTER_DIFF_RANGES = 64
+
 class mySortFilterProxy(QSortFilterProxyModel):
     def __init__(self, parent=None, table_model=None): #, table_model=None):
         QSortFilterProxyModel.__init__(self, parent)
         # Saving pointer to table model
         self.table_model = table_model
-        # Initializing the doc_ID_show list
-        self.show_list = None # Empty list indicates showing all documents
+        # Initializing the filter facets (no facet shows all documents)
+        self.filters = ArDa_Filter_Engine()
         # super(mySortFilterProxy, self).__init__(parent)
         # self.panelRef = parent # save pointer to the panel widget
         # self.setSortLocaleAware(True) # make sort respect accents? Defaults to off!
 
-    def filterAcceptsRow(self, row, parent_index):
-        # Grab the doc_id of this row
-        qmi = self.table_model.index(row, 0, parent_index)
-        doc_id = self.table_model.data(qmi,Qt.DisplayRole).value()
-        # Checking if the row should be shown given the current filter
-        if self.show_list is None:
-            return True # Showing everything initially
+    def getFilters(self):
+        # Returns the filter engine (realigned whenever the table model's rows change)
+        doc_ids = self.table_model.getDocIDs()
+        if self.filters.doc_ids is not doc_ids:
+            self.filters.set_doc_ids(doc_ids)
+        return self.filters
+
+    def setFilterFacet(self, facet, doc_ids, description = ""):
+        """
+            Sets which documents a filter facet keeps (see ArDa_Filter_Engine)
+
+            :param facet: str of the facet (eg 'project' or 'search')
+            :param doc_ids: collection of the doc ids kept (None clears the facet)
+            :param description: str describing the facet (for the subset label)
+        """
+        facet_ids = [ids for key, ids in self.filters.facet_ids.items() if key != facet]
+        if doc_ids is not None:
+            facet_ids.append(doc_ids)
+        self.fetchFilteredRows(facet_ids)
+        self.updateShownRows(self.getFilters().set_facet(facet, doc_ids, description))
+
+    def clearFilters(self):
+        # Clears every filter facet (showing all documents)
+        self.updateShownRows(self.getFilters().clear_all())
+
+    def fetchFilteredRows(self, facet_ids):
+        """
+            Reads the rows a paged table model has left to read which every facet
+            keeps, so filtering shows all its documents without reading the rest
+            of the library (see canFetchMore)
+
+            :param facet_ids: list of the collections of doc ids kept by each facet
+        """
+        if (len(facet_ids) == 0) or not self.table_model.canFetchMore(QModelIndex()):
+            return
+        kept_ids = set(facet_ids[0]).intersection(*facet_ids[1:])
+        self.table_model.fetchDocIDs(kept_ids)
+
+    def canFetchMore(self, parent):
+        # A filtered view already has every row it shows (see fetchFilteredRows) so
+        #   scrolling it doesn't page in rows the filters would hide
+        if self.filters.is_filtered():
+            return False
+        return super().canFetchMore(parent)
+
+    def updateShownRows(self, changed_rows):
+        """
+            Has the proxy re-check only the (source) rows whose visibility changed,
+            by signalling them as changed, so Qt inserts/removes just those rows.
+            Changes scattered over many ranges of rows remap the whole proxy instead.
+
+            :param changed_rows: sorted array of the changed source rows
+        """
+        if len(changed_rows) == 0:
+            return
+        range_starts = np.flatnonzero(np.diff(changed_rows) != 1) + 1
+        if len(range_starts) >= MAX_FILTER_DIFF_RANGES:
+            self.invalidate()
+            return
+        for rows in np.split(changed_rows, range_starts):
+            self.table_model.dataChanged.emit(self.table_model.index(int(rows[0]), 0),
+                                                self.table_model.index(int(rows[-1]), 0))
+
+    def sort(self, column, order = Qt.AscendingOrder):
+        # Sorting reorders the table model's rows (by precomputed keys, see
+        #   docTableModel.sortRows) leaving the proxy itself unsorted, which spares Qt
+        #   comparing the (formatted) display values of every pair of rows
+        if self.sortColumn() != -1:
+            super().sort(-1)
+        if column < 0:
+            return
+        if self.table_model.canFetchMore(QModelIndex()):
+            # Paged models with rows left to read are sorted by reading them in the new
+            #   order (along with the rows the filters show)
+            self.table_model.sortPages(column, order == Qt.DescendingOrder)
+            self.fetchFilteredRows(list(self.filters.facet_ids.values()))
         else:
-            return (doc_id in self.show_list)
+            self.table_model.sortRows(column, order == Qt.DescendingOrder)
+    def filterAcceptsRow(self, row, parent_index):
+        # Checking if the row should be shown given the current filters
+        return bool(self.getFilters().get_shown_mask()[row])
 
     def getRowFromDocID(self, doc_id):
         # This functions returns the row (given filter/sort) containing
@@ -389,3 +819,74 @@ class mySortFilterProxy(QSortFilterProxyModel):
         index = self.table_model.index(source_row,0)
         # Returning the row this corresponds to
         return self.mapFromSource(index).row()
+
+class importWorker(QObject):
+    """
+        Runs a bulk import (eg ArDa_DB.import_bib_file) on a background thread so
+        the UI stays responsive. The import opens its own ArDa_DB_SQL on the db (so
+        the UI's table caches are never touched from the worker thread) and reports
+        back through signals (which Qt delivers on the UI thread). Entries sharing a
+        duplicate key (eg normalized title or doi) with an existing document (or one
+        added earlier in the import) are held back and handed over once finished.
+    """
+    progress = pyqtSignal(int, int, int)    # Docs read, amount done, total amount
+    batchAdded = pyqtSignal(list)           # doc_ids of each committed batch
+    finished = pyqtSignal(list)             # Document dictionaries held back
+    failed = pyqtSignal(str)
+
+    def __init__(self, db_path, import_func, check_duplicates = True):
+        """
+            :param db_path: str path of the (sqlite) db to import into
+            :param import_func: function taking the worker's ArDa_DB object and the
+                    progress_callback, entry_filter and batch_callback keyword
+                    arguments which runs the import
+            :param check_duplicates: boolean indicating whether to hold back entries
+                    which are potential duplicates
+        """
+        QObject.__init__(self)
+        self.db_path = db_path
+        self.adb = None
+        self.import_func = import_func
+        self.check_duplicates = check_duplicates
+        self.canceled = threading.Event()
+        self.held_docs = []
+        self.import_keys = set()
+
+    def cancel(self):
+        # Cancellation is cooperative, ie the import stops after its current batch. This
+        #   is called directly from the UI thread (the worker's thread is busy in run)
+        self.canceled.set()
+
+    def run(self):
+        try:
+            self.adb = ArDa_DB_SQL()
+            self.adb.open_db(self.db_path)
+            self.import_func(self.adb, progress_callback = self.reportProgress,
+                            entry_filter = self.filterEntry,
+                            batch_callback = self.reportBatch)
+        except Exception as e:
+            logging.exception("Import failed.")
+            self.failed.emit(str(e))
+        finally:
+            if self.adb is not None:
+                self.adb.close_db()
+        self.finished.emit(self.held_docs)
+
+    def filterEntry(self, doc_dict):
+        # Holding back any entries matching a document in the db or this import
+        if not self.check_duplicates:
+            return True
+        # (first author and year alone don't make entries of this import duplicates)
+        dup_keys = {dup_key for dup_key in self.adb.get_dup_keys(doc_dict) if dup_key[0] != 'author_year'}
+        if (len(dup_keys & self.import_keys) > 0) or (len(self.adb.find_duplicate_ids(doc_dict)) > 0):
+            self.held_docs.append(doc_dict)
+            return False
+        self.import_keys |= dup_keys
+        return True
+
+    def reportBatch(self, added_docs):
+        self.batchAdded.emit([doc_dict['doc_id'] for doc_dict in added_docs])
+
+    def reportProgress(self, num_read, amount_done, amount_total):
+        self.progress.emit(num_read, amount_done, amount_total)
+        return not self.canceled.is_set()
@@ -297,9 +297,12 @@ def getNextID(db_path, id_var, debug_print=False):
 
     doc_id_maxes = []
     # Grab the highest id within each table (and then across tables)
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
     for table_name in dbs:
-        df = getDocumentDB(db_path, table_name)
-        doc_id_maxes.append(df[id_var].max())
+        c.execute(f"SELECT MAX({id_var}) FROM {table_name}")
+        doc_id_maxes.append(c.fetchone()[0] or 0)
+    conn.close()
     next_id = max(doc_id_maxes) + 1
 
     if debug_print:
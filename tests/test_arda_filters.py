@@ -0,0 +1,189 @@
+import sqlite3
+import pytest
+import numpy as np
+import pandas as pd
+from lib.ArDa.arda_filters import ArDa_Filter_Engine, compileFilterCode, tokenizeFilterCode
+from lib.ArDa.arda_schema import ArDa_Schema
+
+@pytest.fixture(name="engine")
+def make_filter_engine():
+    # Rows hold doc ids 10 to 15 (in a shuffled order)
+    return ArDa_Filter_Engine(np.array([12, 10, 15, 11, 14, 13]))
+
+def test_engine_unfiltered(engine):
+    # Tests that every row is shown without any facets
+    assert not engine.is_filtered()
+    assert engine.get_shown_mask().all()
+    assert engine.get_shown_ids() == {10, 11, 12, 13, 14, 15}
+    assert engine.get_label_text() == "Current subset:"
+
+def test_engine_set_facet(engine):
+    # Tests setting a facet (and the changed rows it returns)
+    changed_rows = engine.set_facet('project', {10, 11, 12}, "ID = 3")
+    assert changed_rows.tolist() == [2, 4, 5]
+    assert engine.get_shown_mask().tolist() == [True, True, False, True, False, False]
+    assert engine.get_shown_ids() == {10, 11, 12}
+    assert engine.is_filtered() and engine.is_filtered('project')
+    assert not engine.is_filtered('search')
+
+def test_engine_combine_facets(engine):
+    # Tests that rows are only shown if no facet rejects them
+    engine.set_facet('project', {10, 11, 12})
+    changed_rows = engine.set_facet('search', [11, 12, 13, 14])
+    assert changed_rows.tolist() == [1]
+    assert engine.get_shown_ids() == {11, 12}
+
+def test_engine_replace_facet(engine):
+    # Tests that replacing a facet only swaps out that facet's rejections
+    engine.set_facet('project', {10, 11, 12})
+    engine.set_facet('search', [11, 12, 13])
+    changed_rows = engine.set_facet('project', {12, 13, 14}, "ID = 4")
+    assert changed_rows.tolist() == [3, 5]
+    assert engine.get_shown_ids() == {12, 13}
+    assert engine.reject_counts.tolist() == [0, 2, 2, 1, 1, 0]
+
+def test_engine_clear_facet(engine):
+    # Tests clearing a single facet and then all of them
+    engine.set_facet('project', {10, 11})
+    engine.set_facet('search', [11, 12])
+    changed_rows = engine.clear_facet('project')
+    assert changed_rows.tolist() == [0]
+    assert engine.get_shown_ids() == {11, 12}
+    assert not engine.is_filtered('project')
+    changed_rows = engine.clear_all()
+    assert changed_rows.tolist() == [1, 2, 4, 5]
+    assert not engine.is_filtered()
+    assert engine.get_shown_mask().all()
+    # Clearing an unset facet changes nothing
+    assert len(engine.clear_facet('custom')) == 0
+
+def test_engine_empty_facet(engine):
+    # Tests that a facet keeping no documents hides every row
+    engine.set_facet('filter', set())
+    assert not engine.get_shown_mask().any()
+    assert engine.is_filtered('filter')
+
+def test_engine_unknown_facet(engine):
+    # Tests that an unrecognized facet raises an error
+    with pytest.raises(ValueError):
+        engine.set_facet('journal', {10})
+
+@pytest.mark.parametrize("doc_ids", [[12, 10, 15, 11, 14, 13, 16, 11],   # Rows added
+                                     [15, 13, 10],                       # Rows removed
+                                     []])                                # No rows
+def test_engine_realign(engine, doc_ids):
+    # Tests that the facets follow new rows (eg after rows are added or removed)
+    engine.set_facet('project', {10, 11, 12, 16})
+    engine.set_facet('search', [11, 13, 16])
+    engine.set_doc_ids(np.array(doc_ids, dtype=int))
+    expected = [doc_id in {11, 16} for doc_id in doc_ids]
+    assert engine.get_shown_mask().tolist() == expected
+    assert len(engine.reject_counts) == len(doc_ids)
+    # Clearing a facet after realigning only changes the rows it rejected
+    changed_rows = engine.clear_facet('project')
+    assert changed_rows.tolist() == [row for row, doc_id in enumerate(doc_ids) if doc_id == 13]
+
+def test_engine_label_text(engine):
+    # Tests that the label describes the facets in a fixed order
+    engine.set_facet('search', [10], "'x' in Title")
+    engine.set_facet('project', {10}, "ID = 3")
+    assert engine.get_label_text() == "Current subset: project (ID = 3); search ('x' in Title);"
+    engine.clear_facet('search')
+    assert engine.get_label_text() == "Current subset: project (ID = 3);"
+
+## Custom Filter Code ##########################################################
+@pytest.fixture(name="schema", scope="module")
+def make_schema():
+    return ArDa_Schema(pd.read_csv("lib/ArDa/Fields.csv"))
+
+@pytest.fixture(name="filter_conn")
+def make_filter_db():
+    # A small db with four documents in a project (Thesis) and its sub-project (Chapter)
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE Documents (doc_id INTEGER, title TEXT, author_lasts TEXT, "+
+                    "journal TEXT, year INTEGER, read_date INTEGER, favorite TEXT, doi TEXT)")
+    conn.executemany("INSERT INTO Documents VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(1, "Deep 100% Learning", "Smith", "arXiv preprint", 2010, 20200101, "True", None),
+                     (2, "Graph_Nets", "Doe", "Nature", 2015, None, "False", "10.1/x"),
+                     (3, "Other", "Smith, Doe", None, 2016, "", None, None),
+                     (4, "Old", "Roe", "Science", 2009, 20210101, "False", "10.2/y")])
+    conn.execute("CREATE TABLE Projects (proj_id INTEGER, proj_text TEXT, parent_id INTEGER)")
+    conn.executemany("INSERT INTO Projects VALUES (?, ?, ?)", [(1, "Thesis", 0), (2, "Chapter", 1)])
+    conn.execute("CREATE TABLE Doc_Proj (doc_id INTEGER, proj_id INTEGER)")
+    conn.executemany("INSERT INTO Doc_Proj VALUES (?, ?)", [(1, 1), (2, 2), (4, 2)])
+    conn.execute("CREATE TABLE Project_Closure (ancestor_id INTEGER, descendant_id INTEGER, depth INTEGER)")
+    conn.executemany("INSERT INTO Project_Closure VALUES (?, ?, ?)", [(1, 1, 0), (2, 2, 0), (1, 2, 1)])
+    yield conn
+    conn.close()
+
+def filter_docs(conn, schema, filter_code, cascade = False):
+    # Returns the set of doc ids kept by the filter code
+    condition, params = compileFilterCode(filter_code, schema, cascade)
+    return {row[0] for row in conn.execute(f"SELECT doc_id FROM Documents WHERE {condition}", params)}
+
+def test_tokenize_filter_code():
+    # Tests splitting filter code into its tokens
+    assert tokenizeFilterCode('Year in 2010..2015.5 and title contains "A b"') == \
+            [('word', 'year'), ('word', 'in'), ('number', 2010), ('op', '..'), ('number', 2015.5),
+             ('word', 'and'), ('word', 'title'), ('word', 'contains'), ('string', 'A b')]
+
+@pytest.mark.parametrize("filter_code", ["", "   "])
+def test_compile_empty_filter_code(schema, filter_code):
+    # Tests that empty filter code keeps everything (ie has no condition)
+    assert compileFilterCode(filter_code, schema) is None
+
+@pytest.mark.parametrize("filter_code, doc_ids",
+        [("read == false", {2, 3}),                 # (read is the header of read_date)
+         ("read == true", {1, 4}),
+         ("read_date != null", {1, 3, 4}),
+         ("fav == true", {1}),                      # (favorite is a boolean field)
+         ("fav", {1}),
+         ("fav == false", {2, 3, 4}),
+         ("year in 2010..2015", {1, 2}),
+         ("year between 2010 and 2015", {1, 2}),
+         ("year >= 2015", {2, 3}),
+         ("journal == 'nature'", {2}),
+         ("journal != 'nature'", {1, 3, 4}),        # (including documents without a journal)
+         ("author_lasts contains 'SMITH'", {1, 3}),
+         ("authors contains 'doe' and year > 2015", {3}),
+         ("title contains '100%'", {1}),            # (% and _ match literally)
+         ("title contains '_'", {2}),
+         ("year in 2010..2016 and not (journal contains 'arxiv' or doi == null)", {2}),
+         ("not journal contains 'arxiv'", {2, 3, 4}),
+         ("(year == 2009 or year == 2016) and doi == null", {3})])
+def test_compile_filter_code(filter_conn, schema, filter_code, doc_ids):
+    # Tests that the compiled filter code keeps the expected documents
+    assert filter_docs(filter_conn, schema, filter_code) == doc_ids
+
+@pytest.mark.parametrize("filter_code, cascade, doc_ids",
+        [("project == 1", False, {1}),
+         ("project == 1", True, {1, 2, 4}),
+         ("project == 'thesis'", False, {1}),       # (names are case insensitive)
+         ("project == \"Thesis\"", True, {1, 2, 4}),
+         ("project in 2", False, {2, 4}),
+         ("project != 'Chapter'", False, {1, 3}),
+         ("project != 1", True, {3}),
+         ("project == 'Missing'", False, set())])
+def test_compile_project_filter_code(filter_conn, schema, filter_code, cascade, doc_ids):
+    # Tests project conditions (by id or name) with and without sub-projects
+    assert filter_docs(filter_conn, schema, filter_code, cascade) == doc_ids
+
+@pytest.mark.parametrize("filter_code",
+        ["color == 'red'",                  # Unknown field
+         "year ==",                         # Missing value
+         "year == and",                     # Value expected
+         "year > true",                     # Booleans only compare with == or !=
+         "doi < null",
+         "year in 2010 2015",               # Missing range operator
+         "year between 2010 or 2015",
+         "(year == 2010",                   # Unclosed parenthesis
+         "year == 2010)",                   # Unexpected token
+         "year == 2010 journal == 'x'",
+         "title contains 'x' @",            # Unexpected character
+         "year 2010",                       # Missing comparison
+         "project < 3",                     # Projects only compare with ==, != or in
+         "not"])
+def test_compile_bad_filter_code(schema, filter_code):
+    # Tests that invalid filter code raises a ValueError
+    with pytest.raises(ValueError):
+        compileFilterCode(filter_code, schema)